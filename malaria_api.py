@@ -0,0 +1,349 @@
+"""HTTP scoring service for the malaria model.
+
+POST /predict accepts either a single record (a JSON object with the 21 scan
+columns) or several records ({"records": [...]} or a JSON list). Concurrent
+single-record requests are coalesced into one predict_proba call: the first
+request in a batch waits at most MALARIA_BATCH_WINDOW_MS for others to join,
+and a batch never grows past MALARIA_MAX_BATCH records. Scored records are
+appended to the scan history (see malaria_history) with source "api", one
+transaction per batch, and shadow-scored by any challenger models listed in
+MALARIA_CHALLENGERS (see malaria_shadow). Their inputs and probabilities also
+feed the drift monitor (see malaria_drift), whose latest check GET /drift
+returns; with MALARIA_ADMIN=1, POST /drift/check runs one now. GET /metrics serves the malaria_metrics registry in
+Prometheus text format.
+
+Every result carries the version of the model that scored it. The model is
+reloaded without downtime when its artifact file changes (see
+malaria_reload): each batch is scored by the deployment that was current
+when it started, so requests in flight finish on the old model. GET /model
+describes the deployment; with MALARIA_ADMIN=1, POST /model/rollback swaps
+back to the previous one and POST /model/reload loads the file now. Each
+worker process reloads and rolls back on its own, so with several workers
+roll back by restoring the previous artifact file instead.
+
+Records that fail validation against the input schema (see malaria_schema)
+are quarantined rather than failing their batch: a single record gets a 422
+with its rejection reasons, and in a list each rejected record's result is
+{"error": ..., "reasons": [...]} while the others are scored as usual.
+
+Run with one model per worker process:
+    uvicorn malaria_api:app --workers 4
+
+or load the model once and fork the workers from it (see malaria_prefork):
+    python malaria_prefork.py api --workers 4
+
+Or in-process, e.g. from a script:
+    from starlette.testclient import TestClient
+    with TestClient(create_app()) as client:
+        client.post("/predict", json=record)
+"""
+import asyncio
+import os
+import time
+import warnings
+from contextlib import asynccontextmanager
+
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import malaria_metrics as metrics
+from malaria_drift import DRIFT_INTERVAL, start_monitor
+from malaria_history import HISTORY_DB, open_history
+from malaria_reload import RELOAD_INTERVAL, start_live_model
+from malaria_schema import REASONS_COLUMN
+from malaria_shadow import CHALLENGERS, SHADOW_DB, ShadowLog, ShadowScorer, load_challengers
+from malaria_scoring import FEATURE_COLUMNS, MODEL_PATH, score_batch_chunk
+
+BATCH_WINDOW_MS = float(os.environ.get('MALARIA_BATCH_WINDOW_MS', 5))
+MAX_BATCH = int(os.environ.get('MALARIA_MAX_BATCH', 256))
+
+
+def _results(scored, rejected, n_records, model_version=None):
+    """One result per record, in order, from the output of score_batch_chunk."""
+    results = [None] * n_records
+    for i, prediction, probability, risk_level in zip(
+            scored.index, scored['prediction'], scored['malaria_probability'], scored['risk_level']):
+        results[i] = {'prediction': prediction, 'malaria_probability': round(float(probability), 4),
+                      'risk_level': risk_level, 'model_version': model_version}
+    for i, reasons in zip(rejected.index, rejected[REASONS_COLUMN]):
+        results[i] = {'error': "Invalid record", 'reasons': reasons.split('; ')}
+    return results
+
+
+def score_records(model, records, history=None, model_version=None, shadow=None, drift=None):
+    """Score a list of record dicts with one predict_proba call.
+
+    The scored rows are recorded in history and handed to the shadow scorer
+    and drift monitor when those are given. Returns one result per record; rejected records get
+    an error and their rejection reasons instead of a prediction.
+    """
+    frame = pd.DataFrame.from_records(records)
+    start = time.perf_counter()
+    with metrics.span('api_batch'):
+        # Unrounded, so the shadow scorer compares like with like; _results() rounds
+        scored, rejected = score_batch_chunk(model, frame, decimals=None)
+    latency = time.perf_counter() - start
+    metrics.inc('api_rows_total', len(scored))
+    metrics.inc('api_rejected_total', len(rejected))
+    if history is not None and len(scored):
+        history.append_scored(scored, model_version, source='api')
+    if shadow is not None and len(scored):
+        shadow.observe(scored, scored['malaria_probability'], latency)
+    if drift is not None:
+        drift.update(scored, scored['malaria_probability'])
+    return _results(scored, rejected, len(frame), model_version)
+
+
+class MicroBatcher:
+    """Coalesce single-record requests into batched model calls.
+
+    Scoring runs in the default thread pool so the event loop keeps accepting
+    requests (and filling the next batch) while a batch is being scored. live
+    is a malaria_reload.LiveModel; each batch uses its current deployment.
+    """
+
+    def __init__(self, live, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, history=None, shadow=None,
+                 drift=None):
+        self.live = live
+        self.history = history
+        self.shadow = shadow
+        self.drift = drift
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, record):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            records = [record for record, _ in batch]
+            deployment = self.live.current
+            try:
+                results = await loop.run_in_executor(
+                    None, score_records, deployment.model, records, self.history, deployment.version, self.shadow,
+                    self.drift)
+            except Exception as e:
+                if len(batch) == 1:
+                    _, future = batch[0]
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                # One client's record must not fail the others it was batched
+                # with: score them one at a time and fail only the ones that raise
+                metrics.inc('api_batch_retries_total')
+                results = await loop.run_in_executor(None, self._score_each, deployment, records)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _score_each(self, deployment, records):
+        """Each record's result, or the exception scoring it on its own raised."""
+        results = []
+        for record in records:
+            try:
+                results.extend(score_records(deployment.model, [record], self.history, deployment.version,
+                                             self.shadow, self.drift))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def _missing_columns(record):
+    return [c for c in FEATURE_COLUMNS if c not in record]
+
+
+async def predict(request):
+    metrics.inc('api_requests_total')
+    with metrics.span('api_request'):
+        response = await _predict(request)
+    if response.status_code >= 400:
+        metrics.inc('api_errors_total')
+    return response
+
+
+async def _predict(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({'error': "Request body must be JSON"}, status_code=400)
+
+    if isinstance(payload, dict) and 'records' in payload:
+        payload = payload['records']
+
+    if isinstance(payload, dict):
+        missing = _missing_columns(payload)
+        if missing:
+            return JSONResponse({'error': f"Missing required columns: {', '.join(missing)}"}, status_code=422)
+        result = await request.app.state.batcher.submit(payload)
+        return JSONResponse(result, status_code=422 if 'error' in result else 200)
+
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        return JSONResponse({'error': "Expected a record object or a list of records"}, status_code=400)
+    for i, record in enumerate(payload):
+        missing = _missing_columns(record)
+        if missing:
+            return JSONResponse({'error': f"Record {i}: missing required columns: {', '.join(missing)}"},
+                                status_code=422)
+    if not payload:
+        return JSONResponse({'results': []})
+
+    loop = asyncio.get_running_loop()
+    state = request.app.state
+    deployment = state.live.current
+    results = await loop.run_in_executor(
+        None, score_records, deployment.model, payload, state.history, deployment.version, state.shadow,
+        state.drift)
+    return JSONResponse({'results': results})
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+
+def _describe(live):
+    return {
+        'version': live.current.version,
+        'loaded_at': live.current.loaded_at,
+        'previous_versions': [d.version for d in reversed(live.previous)],
+        'last_error': live.last_error,
+    }
+
+
+async def model_info(request):
+    return JSONResponse(_describe(request.app.state.live))
+
+
+async def model_rollback(request):
+    live = request.app.state.live
+    if live.rollback() is None:
+        return JSONResponse({'error': "No previous model to roll back to"}, status_code=409)
+    return JSONResponse(_describe(live))
+
+
+async def model_reload(request):
+    watcher = request.app.state.watcher
+    if watcher is None:
+        return JSONResponse({'error': "Hot reload is off (MALARIA_RELOAD_INTERVAL=0)"}, status_code=409)
+    await asyncio.get_running_loop().run_in_executor(None, lambda: watcher.reload(force=True))
+    live = request.app.state.live
+    if live.last_error:
+        return JSONResponse({'error': live.last_error, **_describe(live)}, status_code=422)
+    return JSONResponse(_describe(live))
+
+
+async def drift_info(request):
+    return JSONResponse(request.app.state.drift.describe())
+
+
+async def drift_check(request):
+    drift = request.app.state.drift
+    if drift.binning is None:
+        return JSONResponse({'error': "No drift reference profile for this model"}, status_code=409)
+    report = await asyncio.get_running_loop().run_in_executor(None, drift.check)
+    if report is None:
+        return JSONResponse({'error': f"Fewer than {drift.min_rows} rows scored since the last check",
+                             **drift.describe()}, status_code=409)
+    return JSONResponse(drift.describe())
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+def create_app(model_path=None, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, history_db=HISTORY_DB,
+               challengers=CHALLENGERS, shadow_db=SHADOW_DB, reload_interval=RELOAD_INTERVAL,
+               drift_interval=DRIFT_INTERVAL, admin=os.environ.get('MALARIA_ADMIN') == '1'):
+    """The Starlette app.
+
+    history_db=None or '' turns off the scan history, as does a database that
+    can't be opened; challengers lists the model artifacts to shadow-score
+    against the champion at model_path. reload_interval=0 turns off hot
+    reload and drift_interval=0 scheduled drift checks; admin adds the
+    rollback, reload and drift check endpoints.
+    """
+    model_path = model_path or os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        warnings.filterwarnings('ignore')
+        app.state.live, app.state.watcher = start_live_model(model_path, reload_interval)
+        app.state.history = open_history(history_db)
+        app.state.shadow = None
+        if challengers:
+            shadow = ShadowScorer(load_challengers(challengers), ShadowLog(shadow_db), app.state.live.current.version)
+            app.state.live.add_listener(lambda deployment: setattr(shadow, 'champion_version', deployment.version))
+            app.state.shadow = shadow
+        app.state.drift = start_monitor(app.state.live, drift_interval)
+        app.state.batcher = MicroBatcher(app.state.live, window_ms, max_batch, app.state.history, app.state.shadow,
+                                         app.state.drift)
+        app.state.batcher.start()
+        yield
+        await app.state.batcher.stop()
+        app.state.drift.stop()
+        if app.state.watcher is not None:
+            app.state.watcher.stop()
+        if app.state.shadow is not None:
+            app.state.shadow.close()
+            app.state.shadow.log.close()
+        if app.state.history is not None:
+            app.state.history.close()
+
+    routes = [
+        Route('/predict', predict, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/model', model_info, methods=['GET']),
+        Route('/drift', drift_info, methods=['GET']),
+    ]
+    if admin:
+        routes += [
+            Route('/model/rollback', model_rollback, methods=['POST']),
+            Route('/model/reload', model_reload, methods=['POST']),
+            Route('/drift/check', drift_check, methods=['POST']),
+        ]
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("malaria_api:app", host="0.0.0.0", port=int(os.environ.get('PORT', 8000)))
@@ -1,14 +1,18 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import joblib
-from sklearn.pipeline import Pipeline
-from PIL import Image
-import plotly.express as px
-import plotly.graph_objects as go
-import xgboost as xgb
-from xgboost import XGBClassifier
+import io
 import os
+import threading
+import time
+
+import malaria_metrics as metrics
+
+# Model and plotting libraries are heavy to import, so they are imported by
+# the functions that use them rather than here. Run malaria_startup.py to see
+# what the app costs at import time.
+
+MODEL_PATH = 'malaria_complete_model.joblib'
 
 # Page configuration
 st.set_page_config(
@@ -92,67 +96,140 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Load the model
+# Load the model into a LiveModel that a background watcher swaps when the
+# artifact changes (see malaria_reload). Returns (live model, watcher).
 @st.cache_resource
-def load_model():
+def load_live_model():
     try:
-        model = joblib.load('malaria_complete_model.joblib')
+        from malaria_reload import start_live_model
+        return start_live_model(MODEL_PATH)
 
-        if isinstance(model, Pipeline) and 'classifier' in model.named_steps:
-            old_classifier = model.named_steps['classifier']
-            booster = old_classifier.get_booster()
-            booster.save_model('malaria_model.json')
+    except Exception as e:
+        metrics.inc('model_load_errors_total')
+        st.error(f"Error loading model: {e}")
+        return None, None
 
-            booster = xgb.Booster()
-            booster.load_model('malaria_model.json')
+# The deployment serving new scans. Read it once per scan and use its model
+# and version throughout, so a scan never mixes two models.
+def current_deployment():
+    live, _ = load_live_model()
+    return live.current if live is not None else None
 
-            # Get original params, remove problematic ones
-            params = old_classifier.get_params()
-            params.pop('use_label_encoder', None)  # Remove if exists
-            params.pop('n_jobs', None)  # Optional: can remove deprecated ones
-            params.pop('objective', None)  # optional if stored inside booster
+# Scan results shared by every session in this process
+@st.cache_resource
+def load_prediction_cache():
+    from malaria_cache import PredictionCache
+    return PredictionCache()
 
-            # Reconstruct clean classifier
-            new_classifier = XGBClassifier(**params)
-            new_classifier._Booster = booster
-            new_classifier._le = None
+# Their feature contributions, kept apart so the prediction cache counts each scan once
+@st.cache_resource
+def load_contribution_cache():
+    from malaria_cache import PredictionCache
+    return PredictionCache()
 
-            # Replace classifier in pipeline
-            model.named_steps['classifier'] = new_classifier
+def warm_up_model():
+    # Loading a deployment includes its first prediction
+    load_live_model()
 
-        return model
+# Load and exercise the model in the background as soon as the process boots,
+# so the first AI Scan doesn't pay for it. Runs once per process; set
+# MALARIA_WARMUP=0 to disable.
+@st.cache_resource
+def start_model_warmup():
+    if os.environ.get('MALARIA_WARMUP', '1') == '0':
+        return None
+    thread = threading.Thread(target=warm_up_model, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
 
-    except Exception as e:
-        st.error(f"Error loading model: {e}")
+# Sweeps are keyed on the patient's inputs, the swept columns and the model
+# version, so revisiting a sweep (or another session asking for the same one)
+# does not rescore the grid
+@st.cache_data(max_entries=64, show_spinner=False)
+def run_sweep(base, x, y, points, version):
+    from malaria_whatif import sweep
+    live, _ = load_live_model()
+    deployment = live.get(version) or live.current
+    return sweep(deployment.model, base, x, y, points)
+
+# Scan history shared by every session; None when MALARIA_HISTORY_DB is empty
+# or the database can't be opened
+@st.cache_resource
+def load_scan_history():
+    from malaria_history import open_history
+    return open_history()
+
+# Challenger models from MALARIA_CHALLENGERS, scored in the background after
+# each scan; None when there are none
+@st.cache_resource
+def load_shadow_scorer():
+    from malaria_shadow import CHALLENGERS, ShadowLog, ShadowScorer, load_challengers
+    if not CHALLENGERS:
         return None
+    live, _ = load_live_model()
+    shadow = ShadowScorer(load_challengers(CHALLENGERS), ShadowLog(), live.current.version if live else None)
+    if live is not None:
+        live.add_listener(lambda deployment: setattr(shadow, 'champion_version', deployment.version))
+    return shadow
+
+# Histograms of the inputs and probabilities scored in this process, checked
+# for drift against the profile saved with the model (see malaria_drift)
+@st.cache_resource
+def load_drift_monitor():
+    from malaria_drift import start_monitor
+    live, _ = load_live_model()
+    if live is None:
+        return None
+    return start_monitor(live)
+
+# Serve the metrics in Prometheus text format when MALARIA_METRICS_PORT is set
+@st.cache_resource
+def start_metrics_server():
+    port = os.environ.get('MALARIA_METRICS_PORT')
+    if not port:
+        return None
+    return metrics.start_http_server(int(port))
 
 # Navigation
 def main():
+    start_model_warmup()
+    start_metrics_server()
    
     st.markdown('<h1 class="main-header">🩺 AI Malaria Scan Powered By MozBioMed AI!</h1>', unsafe_allow_html=True)
     st.markdown('<h2 class="sub-header"> Supporting Malaria Detection In Mozambique with Artificial Intelligence <img src="https://flagcdn.com/w40/mz.png" width="40" style="vertical-align: middle;"></h2>', unsafe_allow_html=True)
     
     # Sidebar navigation
     st.sidebar.markdown("### 🧭 Navigation")
+    pages = ["🏠 Home", "🔬 AI Malaria Scan", "📦 Batch Scan", "📊 Health Dashboard", "🧪 What-If Analysis",
+             "🗺️ Surveillance", "💡 Recommendations", "ℹ️ About Malaria"]
+    if os.environ.get('MALARIA_ADMIN') == '1':
+        pages.append("🛠️ Admin")
     page = st.sidebar.selectbox(
         "Choose a section:",
-        ["🏠 Home", "🔬 AI Malaria Scan", "📊 Health Dashboard", "💡 Recommendations", "ℹ️ About Malaria"]
+        pages
     )
     
     if page == "🏠 Home":
         show_home()
     elif page == "🔬 AI Malaria Scan":
         show_ai_scan()
+    elif page == "📦 Batch Scan":
+        show_batch_scan()
     elif page == "📊 Health Dashboard":
         show_dashboard()
+    elif page == "🧪 What-If Analysis":
+        show_what_if()
+    elif page == "🗺️ Surveillance":
+        show_surveillance()
     elif page == "💡 Recommendations":
         show_recommendations()
     elif page == "ℹ️ About Malaria":
         show_about_malaria()
+    elif page == "🛠️ Admin":
+        show_admin()
 
 def show_home():
-    logo = Image.open("Logo_MozBioMed.AI.jpg")
-    st.image(logo)
+    st.image("Logo_MozBioMed.AI.jpg")
     st.markdown("""
                 <h4>Mozambique is one of the countries most heavily burdened by Malaria, a life-
                 threatening disease caused by Plasmodium parasites transmitted through infected
@@ -252,11 +329,19 @@ def show_about_malaria():
         - Follow-up monitoring
         """)
 
+def field_input(name):
+    """Form widget for one field of the input schema."""
+    from malaria_schema import SCHEMA
+    field = SCHEMA[name]
+    if field.options is not None:
+        return st.selectbox(field.label, field.options)
+    return st.number_input(field.label, min_value=field.low, max_value=field.high, value=field.default,
+                           step=field.step)
+
 def show_ai_scan():
     st.markdown('<h2 class="sub-header">🔬 AI Malaria Scan</h2>', unsafe_allow_html=True)
     
-    model = load_model()
-    if model is None:
+    if current_deployment() is None:
         st.error("Model could not be loaded. Please check the model file.")
         return
     
@@ -268,65 +353,80 @@ def show_ai_scan():
         
         with col1:
             st.markdown("**🌡️ General Parameters**")
-            temperature = st.number_input("Temperature (°C)", min_value=20.0, max_value=50.0, value=37.0, step=0.1)
+            temperature = field_input('temperature')
             
             st.markdown("**🔴 Red Blood Cell Parameters**")
-            rbc_count = st.number_input("RBC Count (×10¹²/L)", min_value=1.0, max_value=10.0, value=4.5, step=0.1)
-            hb_level = st.number_input("Hemoglobin (g/dL)", min_value=5.0, max_value=20.0, value=12.0, step=0.1)
-            hematocrit = st.number_input("Hematocrit (%)", min_value=10.0, max_value=90.0, value=40.0, step=0.1)
-            mean_cell_volume = st.number_input("Mean Cell Volume (fL)", min_value=10.0, max_value=200.0, value=85.0, step=0.1)
-            mean_corp_hb = st.number_input("Mean Corpuscular Hb (pg)", min_value=10.0, max_value=60.0, value=30.0, step=0.1)
-            mean_cell_hb_conc = st.number_input("Mean Cell Hb Concentration (g/dL)", min_value=20.0, max_value=60.0, value=33.0, step=0.1)
-            rbc_dist_width = st.number_input("RBC Distribution Width (%)", min_value=4.0, max_value=20.0, value=13.0, step=0.1)
+            rbc_count = field_input('rbc_count')
+            hb_level = field_input('hb_level')
+            hematocrit = field_input('hematocrit')
+            mean_cell_volume = field_input('mean_cell_volume')
+            mean_corp_hb = field_input('mean_corp_hb')
+            mean_cell_hb_conc = field_input('mean_cell_hb_conc')
+            rbc_dist_width = field_input('RBC_dist_width_Percent')
         
         with col2:
             st.markdown("**⚪ White Blood Cell Parameters**")
-            wbc_count = st.number_input("WBC Count (×10⁹/L)", min_value=2.0, max_value=40.0, value=7.0, step=0.1)
-            neutrophils_percent = st.number_input("Neutrophils (%)", min_value=10.0, max_value=90.0, value=60.0, step=0.1)
-            lymphocytes_percent = st.number_input("Lymphocytes (%)", min_value=10.0, max_value=60.0, value=30.0, step=0.1)
-            mixed_cells_percent = st.number_input("Mixed Cells (%)", min_value=1.0, max_value=30.0, value=8.0, step=0.1)
-            neutrophils_count = st.number_input("Neutrophils Count (×10⁹/L)", min_value=1.0, max_value=15.0, value=4.0, step=0.1)
-            lymphocytes_count = st.number_input("Lymphocytes Count (×10⁹/L)", min_value=0.5, max_value=12.0, value=2.0, step=0.1)
-            mixed_cells_count = st.number_input("Mixed Cells Count (×10⁹/L)", min_value=0.1, max_value=2.0, value=0.5, step=0.1)
+            wbc_count = field_input('wbc_count')
+            neutrophils_percent = field_input('neutrophils_percent')
+            lymphocytes_percent = field_input('lymphocytes_percent')
+            mixed_cells_percent = field_input('mixed_cells_percent')
+            neutrophils_count = field_input('neutrophils_count')
+            lymphocytes_count = field_input('lymphocytes_count')
+            mixed_cells_count = field_input('mixed_cells_count')
         
         with col3:
             st.markdown("**🟡 Platelet Parameters**")
-            platelet_count = st.number_input("Platelet Count (×10⁹/L)", min_value=50.0, max_value=550.0, value=250.0, step=1.0)
-            platelet_distr_width = st.number_input("Platelet Distribution Width", min_value=3.0, max_value=30.0, value=12.0, step=0.1)
-            mean_platelet_vl = st.number_input("Mean Platelet Volume (fL)", min_value=6.0, max_value=15.0, value=9.0, step=0.1)
+            platelet_count = field_input('platelet_count')
+            platelet_distr_width = field_input('platelet_distr_width')
+            mean_platelet_vl = field_input('mean_platelet_vl')
             
             st.markdown("**📍 Additional Information**")
-            location = st.selectbox("Location", ["Urban", "Rural", "Suburban"])
-            bednet = st.selectbox("Bed Net Usage", ["Yes", "No"])
-            fever_symptom = st.selectbox("Fever Symptoms", ["Yes", "No"])
+            location = field_input('location')
+            bednet = field_input('bednet')
+            fever_symptom = field_input('fever_symptom')
+            patient_ref = st.text_input("Patient Reference (optional)")
         
         submitted = st.form_submit_button("🔍 Analyze for Malaria", use_container_width=True)
         
         if submitted:
             # Prepare input data
-            input_data = pd.DataFrame({
-                'location': [location],
-                'bednet': [bednet],
-                'fever_symptom': [fever_symptom],
-                'temperature': [temperature],
-                'wbc_count': [wbc_count],
-                'rbc_count': [rbc_count],
-                'hb_level': [hb_level],
-                'hematocrit': [hematocrit],
-                'mean_cell_volume': [mean_cell_volume],
-                'mean_corp_hb': [mean_corp_hb],
-                'mean_cell_hb_conc': [mean_cell_hb_conc],
-                'platelet_count': [platelet_count],
-                'platelet_distr_width': [platelet_distr_width],
-                'mean_platelet_vl': [mean_platelet_vl],
-                'neutrophils_percent': [neutrophils_percent],
-                'lymphocytes_percent': [lymphocytes_percent],
-                'mixed_cells_percent': [mixed_cells_percent],
-                'neutrophils_count': [neutrophils_count],
-                'lymphocytes_count': [lymphocytes_count],
-                'mixed_cells_count': [mixed_cells_count],
-                'RBC_dist_width_Percent': [rbc_dist_width]
-            })
+            with metrics.span('input_assembly'):
+                input_data = pd.DataFrame({
+                    'location': [location],
+                    'bednet': [bednet],
+                    'fever_symptom': [fever_symptom],
+                    'temperature': [temperature],
+                    'wbc_count': [wbc_count],
+                    'rbc_count': [rbc_count],
+                    'hb_level': [hb_level],
+                    'hematocrit': [hematocrit],
+                    'mean_cell_volume': [mean_cell_volume],
+                    'mean_corp_hb': [mean_corp_hb],
+                    'mean_cell_hb_conc': [mean_cell_hb_conc],
+                    'platelet_count': [platelet_count],
+                    'platelet_distr_width': [platelet_distr_width],
+                    'mean_platelet_vl': [mean_platelet_vl],
+                    'neutrophils_percent': [neutrophils_percent],
+                    'lymphocytes_percent': [lymphocytes_percent],
+                    'mixed_cells_percent': [mixed_cells_percent],
+                    'neutrophils_count': [neutrophils_count],
+                    'lymphocytes_count': [lymphocytes_count],
+                    'mixed_cells_count': [mixed_cells_count],
+                    'RBC_dist_width_Percent': [rbc_dist_width]
+                })
+            
+            # The widgets enforce each field's range, but not the differential
+            from malaria_scoring import VALIDATOR
+            validation = VALIDATOR.validate(input_data)
+            if not validation.valid[0]:
+                metrics.inc('scan_rejected_total')
+                if validation.failed[0, validation.checks.index('differential_sum')]:
+                    total = neutrophils_percent + lymphocytes_percent + mixed_cells_percent
+                    st.error(f"Neutrophils, lymphocytes and mixed cells add up to {total:.1f}%, but a white cell "
+                             f"differential should add up to about 100%. Please check the results.")
+                else:
+                    st.error(f"These results could not be analyzed: {validation.reasons()[0]}")
+                return
             
             # Make prediction
             try:
@@ -334,13 +434,42 @@ def show_ai_scan():
                 import warnings
                 warnings.filterwarnings('ignore')
                 
-                prediction = model.predict(input_data)[0]
-                prediction_proba = model.predict_proba(input_data)[0]
+                metrics.inc('scans_total')
+                # A model swapped in from here on only affects the next scan
+                deployment = current_deployment()
+                from malaria_cache import score_cached
+                from malaria_explain import contributions_cached, top_contributions
+                # Timed without the contributions, like the challengers' latency
+                start = time.perf_counter()
+                prediction, prediction_proba = score_cached(
+                    deployment.model, input_data, load_prediction_cache(), deployment.version
+                )
+                latency = time.perf_counter() - start
+                contributions = contributions_cached(
+                    deployment.model, input_data, load_contribution_cache(), deployment.version
+                )
+                shadow = load_shadow_scorer()
+                if shadow is not None:
+                    shadow.observe(validation.features, prediction_proba[:, 0], latency)
+                drift = load_drift_monitor()
+                if drift is not None:
+                    drift.update(input_data, prediction_proba[:, 0])
+                prediction = prediction[0]
+                prediction_proba = prediction_proba[0]
+                contributions = contributions[0]
                 
                 # Store results in session state
-                st.session_state.last_prediction = prediction
-                st.session_state.last_prediction_proba = prediction_proba
-                st.session_state.last_input_data = input_data
+                from malaria_session import ScanRecord
+                st.session_state.last_scan = ScanRecord.from_scan(input_data, prediction, prediction_proba[0],
+                                                                  deployment.version)
+                
+                history = load_scan_history()
+                if history is not None:
+                    try:
+                        history.append(input_data, [prediction_proba[0]], [prediction], deployment.version,
+                                       patient_ref=patient_ref.strip() or None)
+                    except Exception as e:
+                        st.warning(f"Scan could not be saved to the history: {e}")
                 
                 # Display results
                 st.markdown("---")
@@ -367,7 +496,9 @@ def show_ai_scan():
 
                         
                 
-                with col2:
+                with col2, metrics.span('chart_render'):
+                    import plotly.graph_objects as go
+
                     # Confidence gauge
                     confidence = max(prediction_proba) * 100
                     labels = ['No Malaria', 'Malaria']
@@ -394,176 +525,229 @@ def show_ai_scan():
                     ### ⚠️ Important Disclaimer !!
                     This tool is designed to assist healthcare professionals and should not replace professional medical advice, diagnosis, or treatment.
                     """)    
+
+                # Per-field contributions, in log-odds of malaria
+                with metrics.span('chart_render'):
+                    st.markdown("### 🔍 What Drove This Result")
+                    top = top_contributions(contributions)[::-1]
+                    fig = go.Figure(go.Bar(
+                        x=[value for _, value in top],
+                        y=[field.replace('_', ' ') for field, _ in top],
+                        orientation='h',
+                        marker_color=['salmon' if value > 0 else 'lightgreen' for _, value in top],
+                    ))
+                    fig.update_layout(
+                        xaxis_title="Contribution (towards malaria → / away from malaria ←)",
+                        height=350, margin=dict(t=20)
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                cache_stats = load_prediction_cache().stats()
+                st.caption(f"Model version {deployment.version} · "
+                           f"Prediction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
                 
                 
             except Exception as e:
+                metrics.inc('scan_errors_total')
                 st.error(f"Error during prediction: {e}")
 
+def show_batch_scan():
+    from malaria_schema import REASONS_COLUMN
+    from malaria_scoring import FEATURE_COLUMNS, read_batch_chunks, score_batch_chunk
+
+    st.markdown('<h2 class="sub-header">📦 Batch Malaria Scan</h2>', unsafe_allow_html=True)
+
+    # The whole file is scored by the model serving when it was submitted
+    deployment = current_deployment()
+    if deployment is None:
+        st.error("Model could not be loaded. Please check the model file.")
+        return
+
+    st.markdown("### Upload Laboratory Results")
+    st.markdown(
+        "Upload a CSV, Excel or Parquet file with one patient per row and the following columns: "
+        + ", ".join(f"`{c}`" for c in FEATURE_COLUMNS)
+    )
+
+    uploaded_file = st.file_uploader("Laboratory export", type=["csv", "xlsx", "xls", "parquet"])
+    if uploaded_file is None:
+        return
+
+    explain = st.selectbox(
+        "Feature contributions in the results",
+        ["None", "Approximate (fast)", "Exact (about 1 ms per row)"],
+        help="Adds one contribution column per input field, in log-odds of malaria."
+    )
+    explain = {"Approximate (fast)": 'approx', "Exact (about 1 ms per row)": 'exact'}.get(explain)
+
+    history = load_scan_history()
+    save_history = history is not None and st.checkbox(
+        "Save results to the scan history", value=True,
+        help="Rows are stored with their patient_ref column when the file has one."
+    )
+
+    if not st.button("🔍 Analyze File for Malaria", use_container_width=True):
+        return
+
+    import warnings
+    warnings.filterwarnings('ignore')
+    drift = load_drift_monitor()
+
+    # Scored chunks are encoded straight into the download buffer and dropped,
+    # so the full result set only ever exists once, as CSV bytes. Rows that
+    # fail validation go to a second buffer instead of failing the file.
+    output = io.BytesIO()
+    quarantine = io.BytesIO()
+    progress = st.progress(0.0, text="Scoring...")
+    total_rows = 0
+    malaria_rows = 0
+    rejected_rows = 0
+    rejection_counts = {}
+    preview = None
+
+    try:
+        for chunk in read_batch_chunks(uploaded_file):
+            with metrics.span('batch_chunk'):
+                scored, rejected = score_batch_chunk(deployment.model, chunk, explain=explain,
+                                                     model_version=deployment.version)
+            scored.to_csv(output, header=total_rows == 0, index=False)
+            metrics.inc('batch_rows_total', len(scored))
+            metrics.inc('batch_rejected_total', len(rejected))
+            if save_history:
+                history.append_scored(scored, deployment.version, source='batch')
+            if drift is not None:
+                drift.update(scored, scored['malaria_probability'])
+            if len(rejected):
+                rejected.to_csv(quarantine, header=rejected_rows == 0, index=False)
+                for reason, count in rejected[REASONS_COLUMN].str.split('; ').explode().value_counts().items():
+                    rejection_counts[reason] = rejection_counts.get(reason, 0) + count
+
+            total_rows += len(scored)
+            rejected_rows += len(rejected)
+            malaria_rows += int((scored['prediction'] == "Malaria").sum())
+            if preview is None and len(scored):
+                preview = scored.head(20)
+
+            done = min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0)
+            progress.progress(done, text=f"Scored {total_rows:,} rows")
+    except ValueError as e:
+        progress.empty()
+        st.error(f"Invalid file: {e}")
+        return
+    except Exception as e:
+        metrics.inc('scan_errors_total')
+        progress.empty()
+        st.error(f"Error during prediction: {e}")
+        return
+
+    progress.progress(1.0, text=f"Scored {total_rows:,} rows")
+
+    if rejected_rows:
+        st.warning(f"{rejected_rows:,} rows failed validation and were not scored. "
+                   "Download them below with their rejection reasons.")
+        st.dataframe(
+            pd.DataFrame(sorted(rejection_counts.items(), key=lambda item: -item[1]), columns=["Reason", "Rows"]),
+            hide_index=True
+        )
+        quarantine.seek(0)
+        st.download_button(
+            "⬇️ Download Rejected Rows",
+            data=quarantine,
+            file_name=os.path.splitext(uploaded_file.name)[0] + "_rejected.csv",
+            mime="text/csv"
+        )
+
+    if total_rows == 0:
+        if not rejected_rows:
+            st.warning("The uploaded file contains no rows.")
+        return
+
+    st.markdown("---")
+    st.markdown("### 🎯 Batch Results")
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Patients Scored", f"{total_rows:,}")
+    col2.metric("Malaria Detected", f"{malaria_rows:,}")
+    col3.metric("Positivity Rate", f"{malaria_rows / total_rows * 100:.1f}%")
+
+    st.markdown("**Preview**")
+    st.dataframe(preview, use_container_width=True)
+
+    output.seek(0)
+    st.download_button(
+        "⬇️ Download Scored File",
+        data=output,
+        file_name=os.path.splitext(uploaded_file.name)[0] + "_scored.csv",
+        mime="text/csv",
+        use_container_width=True
+    )
+
 def show_dashboard():
     st.markdown('<h2 class="sub-header">📊 Health Dashboard</h2>', unsafe_allow_html=True)
     
-    if 'last_input_data' not in st.session_state:
+    if 'last_scan' not in st.session_state:
         st.info("Please run an AI Malaria Scan first to see your health dashboard.")
+        show_scan_history()
         return
     
-    data = st.session_state.last_input_data.iloc[0]
+    from malaria_rules import MAX_RISK_SCORE, assess
+
+    data = st.session_state.last_scan
+    assessment = assess(data.columns())
     
     # Health indicators with normal ranges
     st.markdown("### Health Indicators Analysis")
     
-    col1, col2 = st.columns(2)
+    indicators = [
+        ("#### 🔴 Red Blood Cell Parameters", [
+            ('rbc_count', "RBC Count", "{:.1f} ×10¹²/L"),
+            ('hb_level', "Hemoglobin", "{:.1f} g/dL"),
+            ('platelet_count', "Platelet Count", "{:.0f} ×10⁹/L"),
+        ]),
+        ("#### ⚪ White Blood Cell Parameters", [
+            ('wbc_count', "WBC Count", "{:.1f} ×10⁹/L"),
+            ('temperature', "Temperature", "{:.1f} °C"),
+        ]),
+    ]
     
-    with col1:
-        st.markdown("#### 🔴 Red Blood Cell Parameters")
-        
-        # RBC Count
-        rbc_normal = (4.0, 5.5)  # Normal range for RBC
-        rbc_value = data['rbc_count']
-        rbc_status = "Normal" if rbc_normal[0] <= rbc_value <= rbc_normal[1] else "Abnormal"
-        rbc_color = "normal" if rbc_status == "Normal" else "inverse"
-        
-        st.metric("RBC Count", f"{rbc_value:.1f} ×10¹²/L", 
-                 delta=f"{rbc_status}", delta_color=rbc_color)
-        
-        if rbc_value < rbc_normal[0]:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Low RBC count detected. This may indicate anemia, which is
-                         common in malaria infections.
-            </div>
-            """, unsafe_allow_html=True)
-        elif rbc_value > rbc_normal[1]:
-            st.markdown("""
-            <div class="info-box">
-                ℹ️ Elevated RBC count detected. This may indicate dehydration or other conditions.
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Hemoglobin
-        hb_normal = (12.0, 16.0)  # Normal range for Hemoglobin
-        hb_value = data['hb_level']
-        hb_status = "Normal" if hb_normal[0] <= hb_value <= hb_normal[1] else "Abnormal"
-        hb_color = "normal" if hb_status == "Normal" else "inverse"
-        
-        st.metric("Hemoglobin", f"{hb_value:.1f} g/dL", 
-                 delta=f"{hb_status}", delta_color=hb_color)
-        
-        if hb_value < hb_normal[0]:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Low hemoglobin detected. This is a key indicator of anemia and potential malaria infection.
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Platelet Count
-        platelet_normal = (150, 400)  # Normal range for platelets
-        platelet_value = data['platelet_count']
-        platelet_status = "Normal" if platelet_normal[0] <= platelet_value <= platelet_normal[1] else "Abnormal"
-        platelet_color = "normal" if platelet_status == "Normal" else "inverse"
-        
-        st.metric("Platelet Count", f"{platelet_value:.0f} ×10⁹/L", 
-                 delta=f"{platelet_status}", delta_color=platelet_color)
-        
-        if platelet_value < platelet_normal[0]:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Low platelet count (thrombocytopenia) detected. This is commonly associated with malaria infections.
-            </div>
-            """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("#### ⚪ White Blood Cell Parameters")
-        
-        # WBC Count
-        wbc_normal = (4.0, 11.0)  # Normal range for WBC
-        wbc_value = data['wbc_count']
-        wbc_status = "Normal" if wbc_normal[0] <= wbc_value <= wbc_normal[1] else "Abnormal"
-        wbc_color = "normal" if wbc_status == "Normal" else "inverse"
-        
-        st.metric("WBC Count", f"{wbc_value:.1f} ×10⁹/L", 
-                 delta=f"{wbc_status}", delta_color=wbc_color)
-        
-        if wbc_value < wbc_normal[0]:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Low WBC count detected. This may indicate immune system suppression.
-            </div>
-            """, unsafe_allow_html=True)
-        elif wbc_value > wbc_normal[1]:
-            st.markdown("""
-            <div class="info-box">
-                ℹ️ Elevated WBC count detected. This may indicate an active infection or immune response.
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Temperature
-        temp_normal = (36.1, 37.2)  # Normal body temperature range
-        temp_value = data['temperature']
-        temp_status = "Normal" if temp_normal[0] <= temp_value <= temp_normal[1] else "Fever"
-        temp_color = "normal" if temp_status == "Normal" else "inverse"
-        
-        st.metric("Temperature", f"{temp_value:.1f} °C", 
-                 delta=f"{temp_status}", delta_color=temp_color)
-        
-        if temp_value > temp_normal[1]:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Fever detected. This is a primary symptom of malaria and requires immediate attention.
-            </div>
-            """, unsafe_allow_html=True)
+    for column, (heading, rows) in zip(st.columns(2), indicators):
+        with column:
+            st.markdown(heading)
+            
+            for col, label, value_format in rows:
+                normal = assessment.status[col][0] == "Normal"
+                if normal:
+                    status = "Normal"
+                else:
+                    status = "Fever" if col == 'temperature' else "Abnormal"
+                
+                st.metric(label, value_format.format(data[col]), 
+                         delta=status, delta_color="normal" if normal else "inverse")
+                
+                for rule in assessment.alerts(0, col):
+                    box, message = rule.alert
+                    st.markdown(f"""
+                    <div class="{box}-box">
+                        {message}
+                    </div>
+                    """, unsafe_allow_html=True)
     
     # Risk factors analysis
     st.markdown("---")
     st.markdown("### Risk Factors Analysis")
     
-    risk_score = 0
-    risk_factors = []
-    
-    if data['fever_symptom'] == 'Yes':
-        risk_score += 3
-        risk_factors.append("Fever symptoms present")
-    
-    if data['bednet'] == 'No':
-        risk_score += 2
-        risk_factors.append("No bed net protection")
-    
-    if data['location'] == 'Rural':
-        risk_score += 1
-        risk_factors.append("Rural location (higher mosquito exposure)")
-    
-    if rbc_value < rbc_normal[0]:
-        risk_score += 2
-        risk_factors.append("Low RBC count")
-    
-    if hb_value < hb_normal[0]:
-        risk_score += 2
-        risk_factors.append("Low hemoglobin")
-    
-    if platelet_value < platelet_normal[0]:
-        risk_score += 2
-        risk_factors.append("Low platelet count")
-    
-    if temp_value > temp_normal[1]:
-        risk_score += 3
-        risk_factors.append("Elevated temperature")
+    risk_score = int(assessment.score[0])
+    risk_level = assessment.level[0]
+    risk_factors = assessment.factors(0)
+    risk_color = {"High": "#C73E1D", "Moderate": "#F18F01"}.get(risk_level, "#2E8B57")
     
     col1, col2 = st.columns(2)
     
     with col1:
-        if risk_score >= 8:
-            risk_level = "High"
-            risk_color = "#C73E1D"
-        elif risk_score >= 4:
-            risk_level = "Moderate"
-            risk_color = "#F18F01"
-        else:
-            risk_level = "Low"
-            risk_color = "#2E8B57"
-        
         st.markdown(f"""
         <div style="background-color: {risk_color}; padding: 1rem; border-radius: 10px; color: white;">
             <h3>Risk Level: {risk_level}</h3>
-            <p>Risk Score: {risk_score}/15</p>
+            <p>Risk Score: {risk_score}/{MAX_RISK_SCORE}</p>
         </div>
         """, unsafe_allow_html=True)
     
@@ -574,16 +758,184 @@ def show_dashboard():
                 st.markdown(f"• {factor}")
         else:
             st.markdown("**No significant risk factors identified.**")
+    
+    show_scan_history()
+
+def show_scan_history():
+    history = load_scan_history()
+    if history is None:
+        return
+    
+    st.markdown("---")
+    st.markdown("### 🗂️ Scan History")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        location = st.selectbox("Filter by location", ["All"] + history.locations())
+    with col2:
+        patient_ref = st.text_input("Filter by patient reference").strip()
+    location = None if location == "All" else location
+    
+    # Pages are fetched by cursor; keep the cursors of the pages before this
+    # one so "Newer" can step back, and start over when the filters change
+    filters = (location, patient_ref)
+    if st.session_state.get('history_filters') != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_cursors = [None]
+    cursors = st.session_state.history_cursors
+    
+    page, next_cursor = history.page(before=cursors[-1], location=location, patient_ref=patient_ref or None)
+    if page.empty:
+        st.markdown("No scans recorded yet.")
+        return
+    
+    st.dataframe(page.drop(columns=['id']), use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        st.caption(f"Page {len(cursors)}")
+    with col3:
+        if st.button("Older ➡️", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+
+def show_what_if():
+    st.markdown('<h2 class="sub-header">🧪 What-If Analysis</h2>', unsafe_allow_html=True)
+    
+    if 'last_scan' not in st.session_state:
+        st.info("Please run an AI Malaria Scan first to explore how the result depends on the lab values.")
+        return
+    
+    deployment = current_deployment()
+    if deployment is None:
+        st.error("Model could not be loaded. Please check the model file.")
+        return
+    
+    import plotly.graph_objects as go
+    from malaria_scoring import DECISION_THRESHOLD, NUMERIC_COLUMNS
+    from malaria_whatif import POINTS_1D, POINTS_2D
+    
+    st.markdown("See how the malaria probability of your last scan changes as one or two lab values move "
+                "across their valid ranges, with every other input kept as entered.")
+    
+    base = st.session_state.last_scan.to_dict()
+    
+    def label(col):
+        return col.replace('_', ' ')
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        x = st.selectbox("Vary", NUMERIC_COLUMNS, index=NUMERIC_COLUMNS.index('hb_level'), format_func=label)
+    with col2:
+        y = st.selectbox("Against (optional)", [None] + [c for c in NUMERIC_COLUMNS if c != x],
+                         format_func=lambda col: "—" if col is None else label(col))
+    with col3:
+        points = st.select_slider("Points per axis", options=[25, 50, 100, 150, 200],
+                                  value=POINTS_2D if y else POINTS_1D)
+    
+    with metrics.span('what_if_sweep'):
+        result = run_sweep(base, x, y, points, deployment.version)
+    
+    with metrics.span('chart_render'):
+        if y is None:
+            x_values, probabilities = result
+            fig = go.Figure(go.Scatter(x=x_values, y=probabilities * 100, mode='lines', line=dict(color="#A23B72")))
+            fig.add_hline(y=DECISION_THRESHOLD * 100, line_dash='dot', line_color='grey', annotation_text="decision threshold")
+            fig.add_vline(x=base[x], line_dash='dash', line_color="#2E86AB", annotation_text="current value")
+            fig.update_layout(xaxis_title=label(x), yaxis_title="Malaria probability (%)", yaxis_range=[0, 100],
+                              height=450)
+        else:
+            x_values, y_values, probabilities = result
+            fig = go.Figure(go.Heatmap(x=x_values, y=y_values, z=probabilities * 100, zmin=0, zmax=100,
+                                       colorscale='RdYlGn_r', colorbar=dict(title="Malaria %")))
+            fig.add_trace(go.Scatter(x=[base[x]], y=[base[y]], mode='markers', name="current values",
+                                     marker=dict(color='black', size=12, symbol='x')))
+            fig.update_layout(xaxis_title=label(x), yaxis_title=label(y), height=550)
+        st.plotly_chart(fig, use_container_width=True)
+    
+    st.caption(f"{probabilities.size:,} inputs scored in one batch. This is a model sensitivity view, not a clinical prediction "
+               f"for other values.")
+
+def show_surveillance():
+    st.markdown('<h2 class="sub-header">🗺️ Surveillance Dashboard</h2>', unsafe_allow_html=True)
+    
+    history = load_scan_history()
+    if history is None:
+        st.info("Scan history is turned off (MALARIA_HISTORY_DB is empty) or could not be opened, so there is "
+                "nothing to aggregate.")
+        return
+    
+    import datetime
+    import plotly.graph_objects as go
+    from malaria_surveillance import DIMENSIONS, HISTOGRAM_FEATURES, Surveillance
+    
+    # Everything here is read from the rollup tables, never from raw scans
+    surveillance = Surveillance(history)
+    days = st.slider("Days to show", min_value=7, max_value=365, value=90)
+    since = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+    
+    over_time = surveillance.positivity_over_time(since)
+    if over_time.empty:
+        st.info("No scans recorded in this period.")
+        return
+    
+    scans = int(over_time['scans'].sum())
+    positives = int(over_time['positives'].sum())
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Scans", f"{scans:,}")
+    col2.metric("Malaria Detected", f"{positives:,}")
+    col3.metric("Positivity Rate", f"{positives / scans * 100:.1f}%")
+    
+    st.markdown("### 📈 Positivity Over Time")
+    fig = go.Figure(go.Scatter(x=over_time.index, y=over_time['positivity'] * 100, mode='lines+markers',
+                               line=dict(color="#C73E1D")))
+    fig.update_layout(yaxis_title="Positivity (%)", height=350, margin=dict(t=20))
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.markdown("### 🧭 Positivity by Group")
+    titles = {'location': "Location", 'bednet': "Bed Net Usage", 'fever_symptom': "Fever Symptoms"}
+    for column, dimension in zip(st.columns(len(DIMENSIONS)), DIMENSIONS):
+        by_group = surveillance.positivity_by(dimension, since)
+        with column:
+            fig = go.Figure(go.Bar(x=by_group.index, y=by_group['positivity'] * 100,
+                                   text=by_group['scans'].map("{:,} scans".format), marker_color="#2E86AB"))
+            fig.update_layout(title=titles[dimension], yaxis_title="Positivity (%)", height=350)
+            st.plotly_chart(fig, use_container_width=True)
+    
+    st.markdown("### 🩸 Lab Values: Positives vs Negatives (all time)")
+    titles = {'hb_level': "Hemoglobin (g/dL)", 'platelet_count': "Platelet Count (×10⁹/L)",
+              'temperature': "Temperature (°C)"}
+    colors = {"Malaria": "#C73E1D", "No Malaria": "#2E8B57"}
+    for column, feature in zip(st.columns(len(HISTOGRAM_FEATURES)), HISTOGRAM_FEATURES):
+        counts, means = surveillance.distribution(feature)
+        with column:
+            fig = go.Figure([
+                go.Bar(x=counts.index, y=counts[label], name=label, marker_color=colors[label], opacity=0.6)
+                for label in counts.columns
+            ])
+            fig.update_layout(title=titles[feature], barmode='overlay', height=350,
+                              legend=dict(orientation='h', y=-0.2))
+            st.plotly_chart(fig, use_container_width=True)
+            st.caption(" · ".join(
+                f"{label} mean: {mean:.1f}" for label, mean in means.items() if mean is not None
+            ))
 
 def show_recommendations():
     st.markdown('<h2 class="sub-header">💡 Health Recommendations</h2>', unsafe_allow_html=True)
     
-    if 'last_prediction' not in st.session_state:
+    if 'last_scan' not in st.session_state:
         st.info("Please run an AI Malaria Scan first to get personalized recommendations.")
         return
     
-    prediction = st.session_state.last_prediction
-    data = st.session_state.last_input_data.iloc[0]
+    from malaria_rules import assess
+
+    scan = st.session_state.last_scan
+    prediction = scan.label
+    recommendations = assess(scan.columns(), [prediction]).recommendations(0)
     
     if prediction == 0:
         st.markdown("""
@@ -618,24 +970,11 @@ def show_recommendations():
         """)
         
         # Additional recommendations based on specific parameters
-        if data['temperature'] > 38.5:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ High fever detected. Use cooling measures and fever reducers while seeking medical care.
-            </div>
-            """, unsafe_allow_html=True)
-        
-        if data['hb_level'] < 10:
-            st.markdown("""
+        for rule in recommendations:
+            _, message = rule.advice
+            st.markdown(f"""
             <div class="warning-box">
-                ⚠️ Severe anemia detected. This requires immediate medical intervention.
-            </div>
-            """, unsafe_allow_html=True)
-        
-        if data['platelet_count'] < 100:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ Severe thrombocytopenia detected. Risk of bleeding complications - seek immediate care.
+                {message}
             </div>
             """, unsafe_allow_html=True)
     
@@ -663,46 +1002,14 @@ def show_recommendations():
         - **Repeat testing** if symptoms develop
         """)
         
-        # Specific recommendations based on parameters
-        recommendations = []
-        
-        if data['hb_level'] < 12:
-            recommendations.append({
-                'title': '🍎 Address Mild Anemia',
-                'content': 'Your hemoglobin is slightly low. Consider iron-rich foods (spinach, red meat, beans) and consult a healthcare provider about iron supplements.'
-            })
-        
-        if data['platelet_count'] < 150:
-            recommendations.append({
-                'title': '🩸 Monitor Platelet Count',
-                'content': 'Your platelet count is below normal. Follow up with your healthcare provider to determine the cause and appropriate treatment.'
-            })
-        
-        if data['wbc_count'] < 4:
-            recommendations.append({
-                'title': '🛡️ Boost Immune System',
-                'content': 'Your white blood cell count is low. Focus on a healthy diet, adequate sleep, regular exercise, and stress management.'
-            })
-        
-        if data['temperature'] > 37.5:
-            recommendations.append({
-                'title': '🌡️ Monitor Temperature',
-                'content': 'You have a mild fever. Rest, stay hydrated, and monitor for other symptoms. Seek medical care if fever persists or worsens.'
-            })
-        
-        if data['bednet'] == 'No':
-            recommendations.append({
-                'title': '🛏️ Use Bed Nets',
-                'content': 'You indicated no bed net usage. This is crucial for malaria prevention. Obtain and use insecticide-treated bed nets immediately.'
-            })
-        
         if recommendations:
             st.markdown("### 🎯 Personalized Health Recommendations")
-            for rec in recommendations:
+            for rule in recommendations:
+                title, message = rule.advice
                 st.markdown(f"""
                 <div class="info-box">
-                    <h4>{rec['title']}</h4>
-                    <p>{rec['content']}</p>
+                    <h4>{title}</h4>
+                    <p>{message}</p>
                 </div>
                 """, unsafe_allow_html=True)
     
@@ -741,6 +1048,122 @@ def show_recommendations():
     
     """)
 
+def show_admin():
+    st.markdown('<h2 class="sub-header">🛠️ Admin: Performance Metrics</h2>', unsafe_allow_html=True)
+
+    show_model_deployments()
+    show_drift()
+
+    if not metrics.ENABLED:
+        st.info("Instrumentation is turned off (MALARIA_METRICS=0).")
+        return
+
+    data = metrics.snapshot()
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Scans", f"{data['counters'].get('scans_total', 0):,}")
+    col2.metric("Errors", f"{data['counters'].get('scan_errors_total', 0):,}")
+    col3.metric("Memory (RSS)", f"{data['gauges']['process_resident_memory_bytes'] / 2**20:.0f} MB")
+
+    st.markdown("### Latency by Stage")
+    if data['spans']:
+        st.dataframe(pd.DataFrame([
+            {
+                'stage': name,
+                'count': stats['count'],
+                'p50 (ms)': stats['p50'] * 1000,
+                'p95 (ms)': stats['p95'] * 1000,
+                'p99 (ms)': stats['p99'] * 1000,
+            }
+            for name, stats in data['spans'].items()
+        ]), use_container_width=True, hide_index=True)
+    else:
+        st.markdown("No timings recorded yet.")
+
+    shadow = load_shadow_scorer()
+    if shadow is not None:
+        st.markdown("### Champion / Challenger")
+        st.caption(f"Champion {shadow.champion_version} versus "
+                   + ", ".join(f"{c.name} ({c.version})" for c in shadow.challengers))
+        summary = shadow.log.summary()
+        if summary.empty:
+            st.markdown("No shadow comparisons logged yet.")
+        else:
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+            st.markdown("**Recent disagreements**")
+            disagreements = shadow.log.disagreements(50)
+            st.dataframe(disagreements.drop(columns=['inputs']).join(pd.json_normalize(disagreements['inputs'])),
+                         use_container_width=True, hide_index=True)
+
+    st.markdown("### Prometheus Export")
+    st.code(metrics.render(), language="text")
+
+def show_model_deployments():
+    live, watcher = load_live_model()
+    if live is None:
+        return
+
+    st.markdown("### Model")
+    current = live.current
+    st.markdown(f"Serving version **{current.version}**, loaded "
+                f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(current.loaded_at))}. "
+                + ("The artifact is checked for changes every "
+                   f"{watcher.interval:g} s." if watcher else "Hot reload is off (MALARIA_RELOAD_INTERVAL=0)."))
+    if live.previous:
+        st.caption("Kept for rollback: " + ", ".join(d.version for d in reversed(live.previous)))
+    if live.last_error:
+        st.warning(f"Last reload failed: {live.last_error}")
+
+    col1, col2 = st.columns(2)
+    if col1.button("↩️ Roll Back to Previous Model", disabled=not live.previous, use_container_width=True):
+        live.rollback()
+        st.rerun()
+    if watcher is not None and col2.button("🔄 Reload Model File Now", use_container_width=True):
+        with st.spinner("Loading and checking the model..."):
+            deployment = watcher.reload(force=True)
+        if deployment is not None:
+            st.success(f"Now serving version {deployment.version}.")
+        elif live.last_error:
+            st.error(f"Reload failed: {live.last_error}")
+        else:
+            st.info("The model file is already being served.")
+
+def show_drift():
+    drift = load_drift_monitor()
+    if drift is None:
+        return
+
+    from malaria_drift import PSI_ALERT, PSI_WARN
+
+    st.markdown("### Input Drift")
+    if drift.binning is None:
+        st.info("There is no drift reference profile for this model. Build one from the training data with "
+                "`python malaria_drift.py reference training.csv`.")
+        return
+    reference = drift.binning.profile
+    schedule = f"every {drift.interval:g} s" if drift.interval > 0 else "only on demand (MALARIA_DRIFT_INTERVAL=0)"
+    st.caption(f"Reference profile of {reference['rows']:,} rows, built with model version "
+               f"{reference.get('model_version')}. {drift.window_rows:,} rows scored since "
+               f"{time.strftime('%H:%M:%S', time.localtime(drift.window_started))}; checked {schedule} "
+               f"once at least {drift.min_rows:,} rows are in. Warning at PSI {PSI_WARN:g}, alert at {PSI_ALERT:g}.")
+    if st.button("📈 Check Drift Now", disabled=drift.window_rows < drift.min_rows, use_container_width=True):
+        drift.check()
+
+    if not drift.reports:
+        st.markdown("No drift checks yet.")
+        return
+    report = drift.reports[-1]
+    checked = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report.checked_at))
+    alerts = drift.alerts()
+    flagged = ", ".join(f"{row.column} (PSI {row.psi:.2f})" for row in alerts.itertuples())
+    if report.status == 'alert':
+        st.error(f"Drift alert at {checked} over {report.rows:,} rows: {flagged}")
+    elif report.status == 'warning':
+        st.warning(f"Possible drift at {checked} over {report.rows:,} rows: {flagged}")
+    else:
+        st.success(f"No drift at {checked} over {report.rows:,} rows.")
+    st.dataframe(report.scores, use_container_width=True, hide_index=True)
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,194 @@
+"""Build-once cache of the compiled model artifact.
+
+The first process to load a given .joblib file splits the pipeline into a
+pickled skeleton (preprocessing plus classifier parameters) and the booster
+in XGBoost's binary UBJSON format, and stores both under a cache key made
+from the file's content hash and the library versions. Later processes load
+straight from the cache.
+
+Cache entries are built in a private temporary directory and renamed into
+place, so concurrent readers only ever see complete entries and racing
+writers simply keep whichever entry landed first. An entry that can't be
+read (e.g. a pickle from an incompatible build) is moved aside, deleted and
+rebuilt. If the cache directory is not writable (e.g. a read-only
+container), the model is loaded without it, with a note on stderr.
+
+Measure cold-start load time with and without the cache:
+    python malaria_artifacts.py --measure
+"""
+import copy
+import hashlib
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import warnings
+
+import joblib
+import sklearn
+import xgboost as xgb
+from sklearn.pipeline import Pipeline
+
+MODEL_PATH = 'malaria_complete_model.joblib'
+CACHE_DIR = os.environ.get('MALARIA_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'malaria-scan')
+
+_SKELETON_FILE = 'pipeline.pkl'
+_BOOSTER_FILE = 'booster.ubj'
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_version(path=MODEL_PATH):
+    """Short content hash identifying a model artifact."""
+    return file_hash(path)[:12]
+
+
+def artifact_key(path=MODEL_PATH):
+    """Cache key for path: its content hash plus the versions that affect unpickling."""
+    versions = f"py{platform.python_version()}-sklearn{sklearn.__version__}-xgboost{xgb.__version__}"
+    return f"{file_hash(path)[:16]}-{hashlib.sha256(versions.encode()).hexdigest()[:8]}"
+
+
+def read_pipeline(path=MODEL_PATH):
+    """Unpickle the saved pipeline without going through the cache."""
+    return joblib.load(path)
+
+
+def _classifier(model):
+    if isinstance(model, Pipeline) and 'classifier' in model.named_steps:
+        return model.named_steps['classifier']
+    return None
+
+
+def _write_entry(model, entry_dir):
+    classifier = _classifier(model)
+    if classifier is None:
+        return
+
+    cache_dir = os.path.dirname(entry_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    try:
+        os.chmod(tmp_dir, 0o755)
+        # The skeleton keeps everything except the booster, which is stored
+        # separately in XGBoost's own binary format
+        shell = copy.copy(classifier)
+        shell._Booster = None
+        skeleton = Pipeline(model.steps[:-1] + [(model.steps[-1][0], shell)])
+        with open(os.path.join(tmp_dir, _SKELETON_FILE), 'wb') as f:
+            pickle.dump(skeleton, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        classifier.get_booster().save_model(os.path.join(tmp_dir, _BOOSTER_FILE))
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process published this entry first; anything else is a failure
+            if not os.path.isdir(entry_dir):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _discard_entry(entry_dir):
+    """Move entry_dir out of the way in one rename, then delete it."""
+    stale_dir = tempfile.mkdtemp(prefix='.stale-', dir=os.path.dirname(entry_dir))
+    try:
+        os.rename(entry_dir, os.path.join(stale_dir, 'entry'))
+    finally:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+
+
+def _read_entry(entry_dir):
+    with open(os.path.join(entry_dir, _SKELETON_FILE), 'rb') as f:
+        model = pickle.load(f)
+    booster = xgb.Booster()
+    booster.load_model(os.path.join(entry_dir, _BOOSTER_FILE))
+    model.named_steps['classifier']._Booster = booster
+    return model
+
+
+def load_pipeline(path=MODEL_PATH, cache_dir=CACHE_DIR):
+    """Load the model pipeline, from the artifact cache when possible.
+
+    Pass cache_dir=None to bypass the cache.
+    """
+    if cache_dir is None:
+        return read_pipeline(path)
+
+    entry_dir = os.path.join(cache_dir, artifact_key(path))
+    if os.path.isdir(entry_dir):
+        try:
+            return _read_entry(entry_dir)
+        except Exception as e:
+            # Unreadable entry, e.g. from an incompatible pickle: remove it, or
+            # publishing the rebuilt one below could never replace it
+            print(f"Artifact cache entry {entry_dir} is unreadable ({e}); rebuilding it", file=sys.stderr)
+            try:
+                _discard_entry(entry_dir)
+            except FileNotFoundError:
+                # Another process removed it first
+                pass
+            except OSError as e:
+                print(f"Could not remove {entry_dir} ({e}); loading without the artifact cache", file=sys.stderr)
+                return read_pipeline(path)
+
+    model = read_pipeline(path)
+    try:
+        _write_entry(model, entry_dir)
+    except OSError as e:
+        print(f"Could not write artifact cache entry {entry_dir} ({e}); loading without it", file=sys.stderr)
+    return model
+
+
+_MEASURE_SNIPPET = """
+import time, warnings
+warnings.filterwarnings('ignore')
+import malaria_artifacts
+start = time.perf_counter()
+malaria_artifacts.load_pipeline({path!r}, cache_dir={cache_dir!r})
+print(time.perf_counter() - start)
+"""
+
+
+def measure_cold_start(path=MODEL_PATH, runs=5):
+    """Time model loading in fresh processes, uncached versus from a warm cache.
+
+    Returns (uncached_seconds, cached_seconds) as the median over runs.
+    """
+    def run(cache_dir):
+        times = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, '-c', _MEASURE_SNIPPET.format(path=path, cache_dir=cache_dir)],
+                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            times.append(float(out.stdout.strip().splitlines()[-1]))
+        return sorted(times)[len(times) // 2]
+
+    cache_dir = tempfile.mkdtemp(prefix='malaria-cache-')
+    try:
+        warnings.filterwarnings('ignore')
+        load_pipeline(path, cache_dir)
+        return run(None), run(cache_dir)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if '--measure' in sys.argv[1:]:
+        uncached, cached = measure_cold_start()
+        print(f"Cold-start model load: uncached {uncached * 1000:.1f} ms, cached {cached * 1000:.1f} ms")
+    else:
+        print(f"{MODEL_PATH}: version {model_version()}, cache key {artifact_key()}")
@@ -0,0 +1,167 @@
+"""Headless batch scorer for laboratory exports.
+
+Streams a CSV or Parquet file through the malaria model in chunks, scoring
+them across a pool of worker processes, and writes the scored rows to a CSV or
+Parquet file in input order. Memory stays flat however large the input is.
+Rows that fail validation against the input schema (see malaria_schema) are
+not scored; they go to a quarantine CSV with a rejection_reasons column.
+
+Usage:
+    python malaria_batch.py lab_export.csv scored.csv --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from malaria_artifacts import model_version
+from malaria_encoder import BACKEND, BACKENDS, compile_scorer
+from malaria_explain import EXPLAIN_METHODS
+from malaria_scoring import (
+    BATCH_CHUNK_SIZE, DECISION_THRESHOLD, MODEL_PATH, load_pipeline, read_batch_chunks, score_batch_chunk
+)
+
+# Scorer and scoring options set once per worker process by _init_worker
+_worker_model = None
+_worker_threshold = DECISION_THRESHOLD
+_worker_explain = None
+_worker_version = None
+
+
+def _init_worker(model_path, threshold, backend=BACKEND, explain=None):
+    global _worker_model, _worker_threshold, _worker_explain, _worker_version
+    warnings.filterwarnings('ignore')
+    _worker_model = compile_scorer(load_pipeline(model_path), backend)
+    _worker_threshold = threshold
+    _worker_explain = explain
+    _worker_version = model_version(model_path)
+
+
+def _score_chunk(chunk):
+    return score_batch_chunk(_worker_model, chunk, _worker_threshold, explain=_worker_explain,
+                             model_version=_worker_version)
+
+
+class ChunkWriter:
+    """Append scored chunks to a CSV or Parquet file as they arrive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(('.parquet', '.pq'))
+        self._writer = None
+        self._started = False
+
+    def write(self, frame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def rejected_path_for(output_path):
+    """Default quarantine file next to output_path."""
+    return os.path.splitext(output_path)[0] + '_rejected.csv'
+
+
+def score_file(input_path, output_path, model_path=MODEL_PATH, workers=None,
+               chunk_size=BATCH_CHUNK_SIZE, threshold=DECISION_THRESHOLD, backend=BACKEND, explain=None,
+               rejected_path=None):
+    """Score input_path into output_path and return (rows, rejected_rows).
+
+    Chunks are dispatched to a process pool with at most two chunks per worker
+    in flight, and results are written back strictly in input order. Rejected
+    rows go to rejected_path (by default rejected_path_for(output_path)),
+    which is only created if there are any.
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = ChunkWriter(output_path)
+    quarantine = ChunkWriter(rejected_path or rejected_path_for(output_path))
+    rows = 0
+    rejected_rows = 0
+
+    def collect(result):
+        nonlocal rows, rejected_rows
+        scored, rejected = result
+        writer.write(scored)
+        if len(rejected):
+            quarantine.write(rejected)
+        rows += len(scored)
+        rejected_rows += len(rejected)
+
+    try:
+        chunks = read_batch_chunks(input_path, chunk_size=chunk_size)
+        if workers == 1:
+            _init_worker(model_path, threshold, backend, explain)
+            for chunk in chunks:
+                collect(_score_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(model_path, threshold, backend, explain)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(_score_chunk, chunk))
+                    if len(pending) >= workers * 2:
+                        collect(pending.popleft().result())
+                while pending:
+                    collect(pending.popleft().result())
+    finally:
+        writer.close()
+        quarantine.close()
+
+    return rows, rejected_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a laboratory export with the malaria model.")
+    parser.add_argument("input", help="CSV or Parquet file with the 21 scan columns")
+    parser.add_argument("output", help="CSV or Parquet file to write the scored rows to")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to the model .joblib file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE,
+                        help="Rows scored per model call")
+    parser.add_argument("--threshold", type=float, default=DECISION_THRESHOLD,
+                        help="Malaria probability at or above which a row is labelled malaria")
+    parser.add_argument("--backend", choices=BACKENDS, default=BACKEND,
+                        help="Tree ensemble evaluator (default: %(default)s)")
+    parser.add_argument("--explain", choices=EXPLAIN_METHODS,
+                        help="Add per-field contribution columns computed with this method (see malaria_explain)")
+    parser.add_argument("--rejected",
+                        help="CSV file for rows that fail validation (default: <output>_rejected.csv)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        rows, rejected_rows = score_file(args.input, args.output, args.model,
+                                         workers=args.workers, chunk_size=args.chunk_size,
+                                         threshold=args.threshold, backend=args.backend,
+                                         explain=args.explain, rejected_path=args.rejected)
+    except ValueError as e:
+        print(f"Invalid input: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    if rejected_rows:
+        print(f"{rejected_rows:,} rows failed validation and were written to "
+              f"{args.rejected or rejected_path_for(args.output)}.", file=sys.stderr)
+    print(f"Scored {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
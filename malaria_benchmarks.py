@@ -0,0 +1,310 @@
+"""Benchmark suite for the scoring paths.
+
+All inputs are synthetic, drawn with fixed seeds from the AI Scan form's
+ranges and options, so runs are comparable across machines and commits.
+The suite measures:
+
+  stages      DataFrame construction, pipeline preprocessing, booster
+              prediction and result post-processing, timed separately
+  load        cold model load (fresh process, with and without the
+              artifact cache) versus a warm in-process load
+  latency     end-to-end single-row score() percentiles
+  throughput  rows/s of the compiled scorer across batch sizes and
+              booster thread counts
+  encoder     compiled NumPy encoder versus Pipeline.predict_proba
+  trees       NumPy tree engine versus the XGBoost booster
+  rules       rows/s of the reference-range and risk rule table
+  validate    rows/s of the compiled input schema validator
+  drift       rows/s of the drift monitor's histogram updates
+  explain     compiled scoring alone versus scoring plus feature
+              contributions (exact and approximate)
+
+Results are flat metric names mapped to numbers: names ending in _s are
+seconds (lower is better), names ending in _rows_per_s are throughput
+(higher is better). Save them with --output and compare a later run with
+--baseline; any metric worse than the baseline by more than
+--max-regression (a fraction) fails the run.
+
+    python malaria_benchmarks.py --output baseline.json
+    python malaria_benchmarks.py --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+
+from malaria_artifacts import measure_cold_start
+from malaria_drift import DriftMonitor, build_reference
+from malaria_encoder import CompiledEncoder, CompiledScorer
+from malaria_explain import contributions
+from malaria_rules import assess
+from malaria_scoring import (
+    FEATURE_COLUMNS, MODEL_PATH, VALIDATOR, batch_risk_levels, labels_from_proba, load_pipeline, random_inputs,
+    score
+)
+from malaria_trees import FlatTreeEnsemble
+
+MAX_REGRESSION = 0.2
+
+
+def sample_call(func, *args, repeats=200):
+    """Wall-clock seconds of each of repeats calls to func(*args), after one warm-up call."""
+    func(*args)
+    times = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def time_call(func, *args, repeats=200):
+    """Median wall-clock seconds of func(*args) over repeats calls."""
+    return float(np.median(sample_call(func, *args, repeats=repeats)))
+
+
+def _repeats(n_rows, budget=20000, low=3, high=200):
+    return max(low, min(high, budget // n_rows))
+
+
+def percentiles(prefix, times):
+    return {f"{prefix}.p{p}_s": float(np.percentile(times, p)) for p in (50, 95, 99)}
+
+
+def bench_stages(model, batch_sizes=(1, 1000)):
+    """Percentiles of each stage of the pipeline path, timed separately."""
+    preprocessor = model.named_steps['preprocessor']
+    booster = model.named_steps['classifier'].get_booster()
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        columns = {col: frame[col].tolist() for col in FEATURE_COLUMNS}
+        matrix = preprocessor.transform(frame)
+        positive = booster.inplace_predict(matrix)
+
+        def postprocess():
+            prediction_proba = np.vstack((1 - positive, positive)).T
+            labels_from_proba(prediction_proba)
+            batch_risk_levels(frame)
+
+        repeats = _repeats(n_rows, high=500)
+        metrics.update(percentiles(f"stages.b{n_rows}.dataframe", sample_call(pd.DataFrame, columns, repeats=repeats)))
+        metrics.update(percentiles(f"stages.b{n_rows}.preprocess", sample_call(preprocessor.transform, frame, repeats=repeats)))
+        metrics.update(percentiles(f"stages.b{n_rows}.booster", sample_call(booster.inplace_predict, matrix, repeats=repeats)))
+        metrics.update(percentiles(f"stages.b{n_rows}.postprocess", sample_call(postprocess, repeats=repeats)))
+    return metrics
+
+
+def bench_load(model_path=MODEL_PATH, runs=5):
+    """Cold loads in fresh processes versus a warm in-process load."""
+    uncached, cached = measure_cold_start(model_path, runs=runs)
+    load_pipeline(model_path)
+    warm = time_call(load_pipeline, model_path, repeats=runs)
+    return {'load.cold_uncached_s': uncached, 'load.cold_cached_s': cached, 'load.warm_s': warm}
+
+
+def bench_latency(model, repeats=1000):
+    """End-to-end single-row score() latency, for the pipeline and the compiled scorer."""
+    frame = random_inputs(1, seed=11)
+    metrics = {}
+    metrics.update(percentiles("latency.pipeline", sample_call(score, model, frame, repeats=repeats)))
+    metrics.update(percentiles("latency.compiled", sample_call(score, CompiledScorer(model), frame, repeats=repeats)))
+    return metrics
+
+
+def bench_throughput(model, batch_sizes=(1, 100, 10000), thread_counts=None):
+    """Compiled-scorer rows/s for each batch size and booster thread count."""
+    thread_counts = thread_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+    thread_counts = [t for t in thread_counts if t <= (os.cpu_count() or 1)]
+    scorer = CompiledScorer(model)
+    metrics = {}
+    try:
+        for threads in thread_counts:
+            scorer.booster.set_param({'nthread': threads})
+            for n_rows in batch_sizes:
+                frame = random_inputs(n_rows, seed=n_rows)
+                seconds = time_call(scorer.predict_proba, frame, repeats=_repeats(n_rows))
+                metrics[f"throughput.b{n_rows}.t{threads}_rows_per_s"] = n_rows / seconds
+    finally:
+        scorer.booster.set_param({'nthread': 0})
+    return metrics
+
+
+def bench_compiled_encoder(model, batch_sizes=(1, 10, 100, 1000, 10000)):
+    """Pipeline.predict_proba on a DataFrame versus CompiledScorer on plain columns."""
+    scorer = CompiledScorer(model)
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        columns = {col: frame[col].tolist() for col in FEATURE_COLUMNS}
+        repeats = _repeats(n_rows, low=5)
+        metrics[f"encoder.b{n_rows}.pipeline_s"] = time_call(model.predict_proba, frame, repeats=repeats)
+        metrics[f"encoder.b{n_rows}.compiled_s"] = time_call(scorer.predict_proba, columns, repeats=repeats)
+    return metrics
+
+
+def bench_tree_engine(model, batch_sizes=(1, 10, 100, 1000, 10000, 100000, 1000000)):
+    """Booster.inplace_predict versus FlatTreeEnsemble on an encoded matrix."""
+    encoder = CompiledEncoder(model.named_steps['preprocessor'])
+    booster = model.named_steps['classifier'].get_booster()
+    trees = FlatTreeEnsemble.from_booster(booster)
+    matrix = encoder.encode(random_inputs(max(batch_sizes), seed=7))
+    metrics = {}
+    for n_rows in batch_sizes:
+        batch = matrix[:n_rows]
+        repeats = _repeats(n_rows)
+        metrics[f"trees.b{n_rows}.xgboost_s"] = time_call(booster.inplace_predict, batch, repeats=repeats)
+        metrics[f"trees.b{n_rows}.numpy_s"] = time_call(trees.predict, batch, repeats=repeats)
+    return metrics
+
+
+def bench_rules(batch_sizes=(1, 5000, 100000)):
+    """malaria_rules.assess() rows/s, with predictions so advice is evaluated too."""
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        prediction = np.arange(n_rows) % 2
+        seconds = time_call(assess, frame, prediction, repeats=_repeats(n_rows, budget=200000))
+        metrics[f"rules.b{n_rows}_rows_per_s"] = n_rows / seconds
+    return metrics
+
+
+def bench_validate(batch_sizes=(1, 5000, 100000)):
+    """SchemaValidator.validate() rows/s on clean rows and with one row in ten rejected."""
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        repeats = _repeats(n_rows, budget=200000)
+        metrics[f"validate.b{n_rows}_rows_per_s"] = n_rows / time_call(VALIDATOR.validate, frame, repeats=repeats)
+        frame.loc[::10, 'hb_level'] = 99.0
+        metrics[f"validate.b{n_rows}.rejecting_rows_per_s"] = n_rows / time_call(
+            lambda: VALIDATOR.validate(frame).reasons(), repeats=repeats)
+    return metrics
+
+
+def bench_drift(batch_sizes=(1, 5000, 100000)):
+    """DriftMonitor.update() rows/s against a profile of random inputs."""
+    reference = random_inputs(20000, seed=7)
+    rng = np.random.default_rng(7)
+    monitor = DriftMonitor(build_reference(reference, rng.random(len(reference))), interval=0)
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        probability = rng.random(n_rows)
+        metrics[f"drift.b{n_rows}_rows_per_s"] = n_rows / time_call(
+            monitor.update, frame, probability, repeats=_repeats(n_rows, budget=200000))
+    return metrics
+
+
+def bench_explain(model, batch_sizes=(1, 100, 1000)):
+    """Compiled-scorer scoring versus scoring plus contributions, per method."""
+    scorer = CompiledScorer(model)
+    metrics = {}
+    for n_rows in batch_sizes:
+        frame = random_inputs(n_rows, seed=n_rows)
+        repeats = _repeats(n_rows, budget=2000, high=50)
+        metrics[f"explain.b{n_rows}.score_s"] = time_call(score, scorer, frame, repeats=repeats)
+        for method in ('approx', 'exact'):
+            metrics[f"explain.b{n_rows}.{method}_s"] = time_call(
+                lambda: (score(scorer, frame), contributions(scorer, frame, method)), repeats=repeats)
+    return metrics
+
+
+def run_suite(model_path=MODEL_PATH, quick=False):
+    """Run every benchmark and return {'environment': ..., 'metrics': ...}."""
+    model = load_pipeline(model_path)
+    metrics = {}
+    metrics.update(bench_stages(model))
+    metrics.update(bench_load(model_path, runs=3 if quick else 5))
+    metrics.update(bench_latency(model, repeats=200 if quick else 1000))
+    metrics.update(bench_throughput(model, batch_sizes=(1, 100, 1000) if quick else (1, 100, 10000)))
+    metrics.update(bench_compiled_encoder(model, batch_sizes=(1, 100, 1000) if quick else (1, 10, 100, 1000, 10000)))
+    metrics.update(bench_tree_engine(
+        model, batch_sizes=(1, 100, 10000) if quick else (1, 10, 100, 1000, 10000, 100000, 1000000)))
+    metrics.update(bench_rules(batch_sizes=(1, 5000) if quick else (1, 5000, 100000)))
+    metrics.update(bench_validate(batch_sizes=(1, 5000) if quick else (1, 5000, 100000)))
+    metrics.update(bench_drift(batch_sizes=(1, 5000) if quick else (1, 5000, 100000)))
+    metrics.update(bench_explain(model, batch_sizes=(1, 100) if quick else (1, 100, 1000)))
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'xgboost': xgb.__version__,
+        'quick': quick,
+    }
+    return {'environment': environment, 'metrics': metrics}
+
+
+def compare(metrics, baseline, max_regression=MAX_REGRESSION):
+    """Metrics that got worse than baseline by more than max_regression.
+
+    Returns a list of (name, baseline_value, value, relative_change), where a
+    positive change is always a regression.
+    """
+    regressions = []
+    for name, old in baseline.items():
+        new = metrics.get(name)
+        if new is None or old <= 0:
+            continue
+        if name.endswith('_rows_per_s'):
+            change = (old - new) / old
+        else:
+            change = (new - old) / old
+        if change > max_regression:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def print_metrics(metrics):
+    for name, value in metrics.items():
+        if name.endswith('_rows_per_s'):
+            print(f"  {name:<44} {value:>14,.0f} rows/s")
+        else:
+            print(f"  {name:<44} {value * 1000:>14.3f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the malaria scoring paths.")
+    parser.add_argument("--model", default=MODEL_PATH, help="Path to the model .joblib file")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --output")
+    parser.add_argument("--max-regression", type=float, default=MAX_REGRESSION,
+                        help="Allowed relative slowdown per metric (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="Smaller batches and fewer repeats")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    results = run_suite(args.model, quick=args.quick)
+    print_metrics(results['metrics'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results['metrics'], baseline['metrics'], args.max_regression)
+        print()
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.max_regression:.0%}:")
+            for name, old, new, change in regressions:
+                print(f"  {name:<44} {old:.6g} -> {new:.6g} ({change:+.0%})")
+            return 1
+        print(f"No metric regressed by more than {args.max_regression:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Bounded LRU memoization of scan results.
+
+Results are keyed on a canonical encoding of the 21 inputs (numeric values
+rounded to 4 decimals, categorical values stripped) plus the model
+version, so a re-submitted form or a rescored patient hits the cache and a
+new model never sees stale entries. The cache stores the predict_proba row;
+labels are derived from it with the caller's threshold, so changing the
+threshold does not invalidate anything.
+
+One PredictionCache is meant to be shared by every session in a process. It
+is bounded both by entry count and by an estimate of its memory use, evicts
+least-recently-used entries first, and counts hits and misses.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import malaria_metrics as metrics
+from malaria_scoring import CATEGORICAL_COLUMNS, DECISION_THRESHOLD, canonical_numeric, labels_from_proba, score
+
+MAX_ENTRIES = 10000
+MAX_BYTES = 8 * 1024 * 1024
+
+# Approximate per-entry cost on top of the key bytes and the cached array's
+# data: OrderedDict slot, bytes object header and the array's header
+_ENTRY_OVERHEAD = 250
+
+
+def _entry_bytes(key, value):
+    return len(key) + _ENTRY_OVERHEAD + getattr(value, 'nbytes', 0)
+
+
+def canonical_keys(features, version):
+    """One hashable cache key per row of features."""
+    numeric = canonical_numeric(features)
+    categorical = features[CATEGORICAL_COLUMNS].astype(str).apply(lambda col: col.str.strip())
+    prefix = f"{version}|".encode()
+    return [
+        prefix + row.tobytes() + "|".join(cats).encode()
+        for row, cats in zip(numeric, categorical.itertuples(index=False, name=None))
+    ]
+
+
+class PredictionCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = value
+            self.nbytes += _entry_bytes(key, value)
+            while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+                old_key, old_value = self._entries.popitem(last=False)
+                self.nbytes -= _entry_bytes(old_key, old_value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def score_cached(model, features, cache, version, threshold=DECISION_THRESHOLD):
+    """score() with results looked up in, and added to, cache.
+
+    Only the rows that miss are sent to the model, in one call.
+    """
+    keys = canonical_keys(features, version)
+    prediction_proba = np.empty((len(keys), 2), dtype=np.float32)
+    missing = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            prediction_proba[i] = cached
+
+    metrics.inc('cache_hits_total', len(keys) - len(missing))
+    metrics.inc('cache_misses_total', len(missing))
+    if missing:
+        _, fresh = score(model, features.iloc[missing], threshold)
+        prediction_proba[missing] = fresh
+        for i, row in zip(missing, fresh):
+            cache.put(keys[i], row.copy())
+
+    return labels_from_proba(prediction_proba, threshold), prediction_proba
@@ -0,0 +1,327 @@
+"""Consistency checks for the scoring paths.
+
+Each check scores random inputs drawn from the AI Scan form's ranges and
+compares a fast path against the pipeline it replaces. Run before deploying
+a new model or library version:
+
+    python malaria_checks.py
+"""
+import asyncio
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from malaria_api import MicroBatcher
+from malaria_drift import DriftMonitor, build_reference
+from malaria_encoder import CompiledEncoder, CompiledScorer
+from malaria_evaluate import evaluate
+from malaria_explain import contributions
+from malaria_rules import assess
+from malaria_trees import FlatTreeEnsemble
+from malaria_reload import Deployment, ReloadError, sanity_check
+from malaria_schema import DIFFERENTIAL, DIFFERENTIAL_TOLERANCE, FIELDS
+from malaria_scoring import MALARIA, MODEL_PATH, VALIDATOR, labels_from_proba, load_pipeline, random_inputs, score
+from malaria_session import ScanRecord
+
+
+def check_label_parity(model, n_rows=20000, seed=0):
+    """score() labels must match the pipeline's predict() at the default threshold."""
+    features = random_inputs(n_rows, seed)
+    prediction, _ = score(model, features, threshold=0.5)
+    expected = model.predict(features)
+    mismatches = int((prediction != expected).sum())
+    assert mismatches == 0, f"{mismatches} of {n_rows} labels differ from predict()"
+
+
+def check_encoder_parity(model, n_rows=20000, seed=1):
+    """CompiledScorer probabilities must match the pipeline's predict_proba."""
+    features = random_inputs(n_rows, seed)
+    # Include unknown and missing categories, which take different codes
+    features.loc[0, 'location'] = None
+    features.loc[1, 'bednet'] = np.nan
+    features.loc[2, 'fever_symptom'] = "Unknown"
+    features.loc[3, 'hb_level'] = np.nan
+    expected = model.predict_proba(features)
+    actual = CompiledScorer(model).predict_proba(features)
+    diff = float(np.abs(actual - expected).max())
+    assert diff <= 1e-6, f"max probability difference {diff:.3g}"
+
+
+def check_tree_engine_parity(model, n_rows=20000, seed=2, missing_rate=0.1):
+    """FlatTreeEnsemble margins must match the booster's, including missing-value routing."""
+    encoder = CompiledEncoder(model.named_steps['preprocessor'])
+    matrix = encoder.encode(random_inputs(n_rows, seed))
+    rng = np.random.default_rng(seed)
+    matrix[rng.random(matrix.shape) < missing_rate] = np.nan
+
+    booster = model.named_steps['classifier'].get_booster()
+    expected = booster.inplace_predict(matrix, predict_type='margin')
+    actual = FlatTreeEnsemble.from_booster(booster).predict_margin(matrix)
+    # XGBoost accumulates leaf values in float32
+    diff = float(np.abs(actual - expected).max())
+    assert diff <= 1e-4, f"max margin difference {diff:.3g}"
+
+
+def _scalar_risk_score(row):
+    """The Health Dashboard's original per-row risk score."""
+    return (
+        3 * (row['fever_symptom'] == 'Yes') + 2 * (row['bednet'] == 'No') + 1 * (row['location'] == 'Rural')
+        + 2 * (row['rbc_count'] < 4.0) + 2 * (row['hb_level'] < 12.0) + 2 * (row['platelet_count'] < 150)
+        + 3 * (row['temperature'] > 37.2)
+    )
+
+
+def check_risk_rules(model, n_rows=2000, seed=3):
+    """The vectorized rule table must reproduce the per-row risk scores and advice."""
+    features = random_inputs(n_rows, seed)
+    prediction = np.arange(n_rows) % 2
+    assessment = assess(features, prediction)
+    expected = np.array([_scalar_risk_score(row) for _, row in features.iterrows()])
+    mismatches = int((assessment.score != expected).sum())
+    assert mismatches == 0, f"{mismatches} of {n_rows} risk scores differ"
+
+    row = features.iloc[0].copy()
+    row[['hb_level', 'platelet_count', 'temperature']] = [9.0, 90.0, 39.0]
+    row[['fever_symptom', 'bednet', 'location', 'rbc_count']] = ['Yes', 'No', 'Rural', 3.0]
+    assessment = assess(row.to_frame().T, [0])
+    codes = assessment.recommendation_codes()[0]
+    assert codes == "HIGH_FEVER;SEVERE_ANEMIA;SEVERE_THROMBOCYTOPENIA", f"unexpected advice {codes!r}"
+    factors = assessment.factors(0)
+    expected_factors = ["Fever symptoms present", "No bed net protection", "Rural location (higher mosquito exposure)",
+                        "Low RBC count", "Low hemoglobin", "Low platelet count", "Elevated temperature"]
+    assert factors == expected_factors, f"unexpected risk factor order {factors}"
+    codes = assess(row.to_frame().T, [1]).recommendation_codes()[0]
+    assert codes == "LOW_HB;LOW_PLATELETS;MILD_FEVER;NO_BEDNET", f"unexpected advice {codes!r}"
+
+
+def check_contribution_additivity(model, n_rows=500, seed=4):
+    """Each row's contributions must add up to the logit of its malaria probability."""
+    features = random_inputs(n_rows, seed)
+    features.loc[0, 'bednet'] = np.nan
+    _, prediction_proba = score(model, features)
+    logit = np.log(prediction_proba[:, 0] / prediction_proba[:, 1])
+    for method in ('exact', 'approx'):
+        diff = float(np.abs(contributions(model, features, method).sum(axis=1) - logit).max())
+        assert diff <= 1e-3, f"{method}: contributions differ from the logit by up to {diff:.3g}"
+
+
+def _scalar_rejection_reasons(row):
+    """Rejection reasons of one row, checked field by field."""
+    reasons = []
+    for field in FIELDS:
+        value = row[field.name]
+        if field.options is not None and isinstance(value, (dict, list)):
+            reasons.append(f"not_scalar:{field.name}")
+        elif value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == '':
+            reasons.append(f"missing:{field.name}")
+        elif field.options is not None:
+            if str(value).strip() not in field.options:
+                reasons.append(f"unknown:{field.name}")
+        else:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                reasons.append(f"not_numeric:{field.name}")
+                continue
+            if not field.low <= number <= field.high:
+                reasons.append(f"out_of_range:{field.name}")
+    try:
+        total = sum(float(row[col]) for col in DIFFERENTIAL)
+        if abs(total - 100) > DIFFERENTIAL_TOLERANCE:
+            reasons.append("differential_sum")
+    except (TypeError, ValueError):
+        pass
+    return sorted(reasons)
+
+
+def check_schema_validator(model, n_rows=2000, seed=5):
+    """The compiled validator must reject exactly the rows a field-by-field check rejects, for the same reasons."""
+    features = random_inputs(n_rows, seed).astype(object)
+    rng = np.random.default_rng(seed)
+    for col, bad in [('hb_level', 99.0), ('hb_level', 'n/a'), ('temperature', ' '), ('platelet_count', None),
+                     ('location', 'Mars'), ('bednet', np.nan), ('fever_symptom', ' Yes '),
+                     ('neutrophils_percent', 20.0)]:
+        features.loc[rng.choice(n_rows, n_rows // 20, replace=False), col] = bad
+    # JSON objects and arrays, as an API request can carry them
+    for col, bad in [('location', {'a': 1}), ('bednet', ['Yes']), ('hb_level', {'value': 12.0})]:
+        for i in rng.choice(n_rows, n_rows // 20, replace=False):
+            features.at[i, col] = bad
+    validation = VALIDATOR.validate(features)
+    reasons = validation.reasons()
+    expected = [_scalar_rejection_reasons(row) for _, row in features.iterrows()]
+    mismatches = sum(sorted(filter(None, got.split('; '))) != want for got, want in zip(reasons, expected))
+    assert mismatches == 0, f"{mismatches} of {n_rows} rows have different rejection reasons"
+    assert (validation.valid == [not want for want in expected]).all(), "valid mask disagrees with the reasons"
+
+
+def check_single_row_validation(model, n_rows=300, seed=6):
+    """Validating one row on its own must give the same checks and cleaned features as validating it in a chunk."""
+    records = random_inputs(n_rows, seed).to_dict(orient='records')
+    rng = np.random.default_rng(seed)
+    for col, bad in [('hb_level', 99.0), ('hb_level', 'n/a'), ('platelet_count', 250), ('temperature', np.nan),
+                     ('location', 'Mars'), ('bednet', ''), ('fever_symptom', ' Yes '), ('bednet', None),
+                     ('neutrophils_percent', 20.0), ('location', {'a': 1})]:
+        for i in rng.choice(n_rows, n_rows // 10, replace=False):
+            records[i][col] = bad
+    for record in records:
+        row = pd.DataFrame([record])
+        single = VALIDATOR.validate(row)
+        # Two rows take the column-wide path
+        chunk = VALIDATOR.validate(pd.concat([row, row]))
+        assert (single.failed == chunk.failed[:1]).all(), f"different checks failed for {record}"
+        pd.testing.assert_frame_equal(single.features, chunk.features.iloc[:1])
+
+
+class _FlippedLabels:
+    """A model that swaps the class columns, like one trained with malaria as class 1."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict_proba(self, features):
+        return self.model.predict_proba(features)[:, ::-1]
+
+
+class _Poisoned:
+    """A model that raises on any batch containing a row with hemoglobin POISON."""
+
+    POISON = 13.37
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict_proba(self, features):
+        if (features['hb_level'] == self.POISON).any():
+            raise ValueError("poisoned row")
+        return self.model.predict_proba(features)
+
+
+class _Live:
+    def __init__(self, deployment):
+        self.current = deployment
+
+
+def check_api_batch_isolation(model, n_good=5, seed=9):
+    """Concurrent requests coalesced into one batch must not fail because one of them is bad."""
+    records = random_inputs(n_good + 2, seed).to_dict(orient='records')
+    records[-2]['location'] = {'a': 1}
+    records[-1]['hb_level'] = _Poisoned.POISON
+
+    async def run():
+        live = _Live(Deployment(_Poisoned(CompiledScorer(model)), 'check', None, 0.0))
+        batcher = MicroBatcher(live, window_ms=200)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(record) for record in records), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = asyncio.run(run())
+    good, not_scalar, poisoned = results[:n_good], results[-2], results[-1]
+    assert all(isinstance(r, dict) and 'prediction' in r for r in good), f"good records failed: {good}"
+    assert isinstance(not_scalar, dict) and not_scalar.get('reasons') == ['not_scalar:location'], \
+        f"dict-valued record not quarantined: {not_scalar!r}"
+    assert isinstance(poisoned, ValueError), f"the failing record did not fail on its own: {poisoned!r}"
+
+
+def check_reload_sanity(model):
+    """The hot-reload probe must accept the model itself and reject it with its labels flipped."""
+    current = Deployment(CompiledScorer(model), 'current', None, 0.0)
+    agreement = sanity_check(Deployment(model, 'same', None, 0.0), current)
+    assert agreement == 1.0, f"the same model agrees on only {agreement:.1%} of the probe set"
+    try:
+        sanity_check(Deployment(_FlippedLabels(model), 'flipped', None, 0.0), current)
+    except ReloadError:
+        return
+    raise AssertionError("a model with flipped labels passed the probe")
+
+
+def check_drift_monitor(model, n_rows=20000, seed=6):
+    """Fresh draws from the reference population must not alert; a shifted temperature must, and only it."""
+    reference = random_inputs(n_rows, seed)
+    _, proba = score(model, reference)
+    monitor = DriftMonitor(build_reference(reference, proba[:, 0]), interval=0, min_rows=1000)
+    window_bytes = monitor.window.nbytes
+
+    same = random_inputs(n_rows // 4, seed + 1)
+    monitor.update(same, score(model, same)[1][:, 0])
+    report = monitor.check()
+    assert report.status == 'ok', f"same population flagged: {monitor.alerts().to_dict(orient='records')}"
+
+    shifted = random_inputs(n_rows // 4, seed + 2)
+    shifted['temperature'] = np.clip(shifted['temperature'] + 5, None, 50.0)
+    for start in range(0, len(shifted), 100):
+        monitor.update(shifted.iloc[start:start + 100], score(model, shifted.iloc[start:start + 100])[1][:, 0])
+    assert monitor.window.nbytes == window_bytes, "the histograms grew with the rows"
+    report = monitor.check()
+    flagged = set(monitor.alerts()['column'])
+    assert report.status == 'alert' and 'temperature' in flagged, f"shifted temperature not flagged: {flagged}"
+    assert flagged <= {'temperature', 'malaria_probability'}, f"unshifted inputs flagged: {flagged}"
+
+
+def check_evaluation_metrics(model, n_rows=20000, seed=7):
+    """The grouped-count metrics must match scikit-learn and labels_from_proba() at every threshold."""
+    from sklearn.metrics import average_precision_score, roc_auc_score
+
+    _, proba = score(model, random_inputs(n_rows, seed))
+    rng = np.random.default_rng(seed)
+    labels = np.where(rng.random(n_rows) < proba[:, MALARIA], MALARIA, 1)
+    summary, sweep = evaluate(proba, labels, resamples=0)
+    estimates = dict(zip(summary['metric'], summary['estimate']))
+    malaria = labels == MALARIA
+    expected = {
+        'roc_auc': roc_auc_score(malaria, -proba[:, 1]),
+        'pr_auc': average_precision_score(malaria, -proba[:, 1]),
+    }
+    for threshold, row in zip(sweep['threshold'], sweep.itertuples()):
+        called = labels_from_proba(proba, threshold) == MALARIA
+        expected[f'sensitivity@{threshold}'] = (called & malaria).sum() / malaria.sum()
+        expected[f'specificity@{threshold}'] = (~called & ~malaria).sum() / (~malaria).sum()
+        estimates[f'sensitivity@{threshold}'] = row.sensitivity
+        estimates[f'specificity@{threshold}'] = row.specificity
+    wrong = {name: (estimates[name], value) for name, value in expected.items()
+             if not np.isclose(estimates[name], value, rtol=0, atol=1e-9)}
+    assert not wrong, f"metrics differ from the reference: {wrong}"
+
+
+def check_scan_record(model, n_rows=200, seed=8):
+    """A session's ScanRecord must give back the scanned inputs and the same rule assessment."""
+    features = random_inputs(n_rows, seed)
+    prediction, proba = score(model, features)
+    for i in range(n_rows):
+        row = features.iloc[[i]]
+        record = ScanRecord.from_scan(row, prediction[i], proba[i, MALARIA], 'check')
+        expected = row.iloc[0].to_dict()
+        assert record.to_dict() == expected, f"row {i} changed: {record.to_dict()} != {expected}"
+        assert record.label == prediction[i] and record.probability == proba[i, MALARIA]
+        from_record = assess(record.columns(), [record.label])
+        from_frame = assess(row, prediction[i:i + 1])
+        assert from_record.recommendations(0) == from_frame.recommendations(0), f"row {i} assessed differently"
+        assert from_record.factors(0) == from_frame.factors(0), f"row {i} has different risk factors"
+
+
+CHECKS = [
+    check_label_parity, check_encoder_parity, check_tree_engine_parity, check_risk_rules,
+    check_contribution_additivity, check_schema_validator, check_single_row_validation, check_reload_sanity,
+    check_drift_monitor, check_evaluation_metrics, check_scan_record, check_api_batch_isolation,
+]
+
+
+def main(model_path=MODEL_PATH):
+    warnings.filterwarnings('ignore')
+    model = load_pipeline(model_path)
+    failed = 0
+    for check in CHECKS:
+        try:
+            check(model)
+            print(f"PASS {check.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
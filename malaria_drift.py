@@ -0,0 +1,344 @@
+"""Input and prediction drift monitoring.
+
+The model was trained on one population; seasonal transmission, new
+analysers and new clinic sites shift what it is asked to score. The
+DriftMonitor keeps a fixed-bin histogram of each of the 21 inputs and of
+the malaria probability, updated with every scan, batch chunk and API batch
+as it is scored, and on a schedule compares them against a reference
+profile saved with the model:
+
+  - numeric inputs and the probability are binned at the reference's
+    deciles, so every bin held about a tenth of the reference rows; values
+    beyond the reference's range land in the two open-ended end bins
+  - categorical inputs get one bin per form option plus one for anything else
+
+Each column gets a population stability index (PSI) and a Kolmogorov-Smirnov
+distance between the binned distributions (the largest gap between their
+cumulative shares). A column with PSI >= PSI_WARN is a warning and one with
+PSI >= PSI_ALERT an alert; alerts are counted in malaria_drift_alerts_total
+and every check sets malaria_drift_psi_<column> gauges. The histograms are a
+tumbling window: a check that has at least MIN_ROWS rows to go on resets
+them, otherwise they keep filling until the next check. Memory use is the
+same after ten scans or ten million.
+
+The reference profile is a JSON file next to the artifact
+(malaria_complete_model.drift.json for malaria_complete_model.joblib).
+Build it from the data the model was trained or validated on, which is
+scored with the model for the probability reference:
+
+    python malaria_drift.py reference training.csv
+
+and compare any file against it offline:
+
+    python malaria_drift.py compare scans.csv
+
+A profile built with another model version is still used for the inputs,
+but not for the probability. Configuration: MALARIA_DRIFT_INTERVAL (seconds
+between checks, default 300; 0 checks only on demand) and
+MALARIA_DRIFT_MIN_ROWS (default 200). Each process monitors the traffic it
+scores itself.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import malaria_metrics as metrics
+from malaria_scoring import CATEGORICAL_COLUMNS, FEATURE_COLUMNS, FORM_OPTIONS, MALARIA, MODEL_PATH
+
+DRIFT_INTERVAL = float(os.environ.get('MALARIA_DRIFT_INTERVAL', 300))
+MIN_ROWS = int(os.environ.get('MALARIA_DRIFT_MIN_ROWS', 200))
+QUANTILE_BINS = 10
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+KEEP_REPORTS = 48
+
+PROBABILITY = 'malaria_probability'
+COLUMNS = [*FEATURE_COLUMNS, PROBABILITY]
+# Shares below this count as this in PSI, so an empty bin doesn't make it infinite
+_SHARE_FLOOR = 1e-4
+_OTHER = '(other)'
+
+DriftReport = namedtuple('DriftReport', ['checked_at', 'rows', 'scores', 'status', 'model_version'])
+
+
+def reference_path_for(model_path=MODEL_PATH):
+    """Where the reference profile of the artifact at model_path is saved."""
+    return os.path.splitext(model_path)[0] + '.drift.json'
+
+
+def build_reference(features, malaria_probability, model_version=None, bins=QUANTILE_BINS):
+    """A reference profile: per column, its bins and how many rows fell in each.
+
+    features are validated inputs (a DataFrame with the 21 columns) and
+    malaria_probability the model's malaria probabilities for them.
+    """
+    frame = features[FEATURE_COLUMNS].assign(**{PROBABILITY: np.asarray(malaria_probability, dtype=np.float64)})
+    columns = {}
+    for col in COLUMNS:
+        if col in CATEGORICAL_COLUMNS:
+            columns[col] = {'categories': [*FORM_OPTIONS[col], _OTHER]}
+        else:
+            values = frame[col].to_numpy(dtype=np.float64)
+            cuts = np.quantile(values[~np.isnan(values)], np.linspace(0, 1, bins + 1)[1:-1])
+            columns[col] = {'cuts': np.unique(cuts).tolist()}
+    profile = {'model_version': model_version, 'created_at': time.time(), 'rows': len(frame), 'columns': columns}
+    binning = Binning(profile)
+    counts = binning.count(frame, frame[PROBABILITY])
+    for j, col in enumerate(COLUMNS):
+        columns[col]['counts'] = counts[j, :binning.sizes[j]].tolist()
+    return profile
+
+
+def save_reference(profile, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(profile, f)
+    os.replace(tmp, path)
+
+
+def load_reference(path):
+    """The profile saved at path, or None if there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class Binning:
+    """A reference profile's bins, compiled for counting whole frames at once."""
+
+    def __init__(self, profile, model_version=None):
+        self.profile = profile
+        self.columns = [col for col in COLUMNS if col in profile['columns']]
+        # The probability reference only describes the model it was built with
+        if model_version is not None and profile.get('model_version') not in (None, model_version):
+            self.columns.remove(PROBABILITY)
+        specs = [profile['columns'][col] for col in self.columns]
+        self.sizes = np.array([len(s['categories']) if 'categories' in s else len(s['cuts']) + 1 for s in specs])
+        self.width = int(self.sizes.max())
+        self.cuts = {col: np.asarray(s['cuts'], dtype=np.float64) for col, s in zip(self.columns, specs)
+                     if 'cuts' in s}
+        self.categories = {col: s['categories'] for col, s in zip(self.columns, specs) if 'categories' in s}
+        self._lookups = {col: {value: i for i, value in enumerate(categories[:-1])}
+                         for col, categories in self.categories.items()}
+        self.reference = np.zeros((len(self.columns), self.width), dtype=np.int64)
+        for j, spec in enumerate(specs):
+            if 'counts' in spec:
+                self.reference[j, :self.sizes[j]] = spec['counts']
+
+    def count(self, features, malaria_probability):
+        """Rows per bin of every column, as a (columns, width) array."""
+        index = np.empty((len(self.columns), len(features)), dtype=np.int64)
+        for j, col in enumerate(self.columns):
+            if col in self.categories:
+                lookup, other = self._lookups[col], len(self.categories[col]) - 1
+                index[j] = [lookup.get(value, other) for value in features[col].to_numpy(dtype=object)]
+            else:
+                # NaN sorts past every cut, into the top bin
+                values = malaria_probability if col == PROBABILITY else features[col].to_numpy()
+                index[j] = np.searchsorted(self.cuts[col], np.asarray(values, dtype=np.float64), side='right')
+        index += np.arange(len(self.columns))[:, None] * self.width
+        return np.bincount(index.ravel(), minlength=len(self.columns) * self.width).reshape(
+            len(self.columns), self.width)
+
+
+def drift_scores(reference, current, sizes):
+    """PSI and KS distance of each row of current against the same row of reference."""
+    in_range = np.arange(reference.shape[1]) < sizes[:, None]
+    expected = reference / np.maximum(reference.sum(axis=1, keepdims=True), 1)
+    actual = current / np.maximum(current.sum(axis=1, keepdims=True), 1)
+    e = np.maximum(expected, _SHARE_FLOOR)
+    a = np.maximum(actual, _SHARE_FLOOR)
+    psi = np.where(in_range, (a - e) * np.log(a / e), 0.0).sum(axis=1)
+    ks = np.abs(np.cumsum(actual - expected, axis=1)).max(axis=1)
+    return psi, ks
+
+
+def status_of(psi):
+    return np.where(psi >= PSI_ALERT, 'alert', np.where(psi >= PSI_WARN, 'warning', 'ok'))
+
+
+class DriftMonitor:
+    """Streaming histograms of scored traffic, checked against a reference profile."""
+
+    def __init__(self, reference=None, model_version=None, interval=DRIFT_INTERVAL, min_rows=MIN_ROWS):
+        self.interval = interval
+        self.min_rows = min_rows
+        self.reports = deque(maxlen=KEEP_REPORTS)
+        self.total_rows = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.set_reference(reference, model_version)
+
+    def set_reference(self, profile, model_version=None):
+        """Compare against profile from now on; the window starts over."""
+        with self._lock:
+            self.model_version = model_version
+            self.binning = Binning(profile, model_version) if profile is not None else None
+            self.window = np.zeros_like(self.binning.reference) if self.binning is not None else None
+            self.window_rows = 0
+            self.window_started = time.time()
+
+    def follow(self, deployment):
+        """LiveModel listener: switch to the profile saved with the new deployment."""
+        self.set_reference(load_reference(reference_path_for(deployment.path)), deployment.version)
+
+    def update(self, features, malaria_probability):
+        """Add scored rows: their 21 inputs and malaria probabilities."""
+        binning = self.binning
+        if binning is None or not len(features):
+            return
+        counts = binning.count(features, malaria_probability)
+        with self._lock:
+            if binning is self.binning:
+                self.window += counts
+                self.window_rows += len(features)
+                self.total_rows += len(features)
+
+    def check(self, force=False):
+        """Score the window against the reference and start a new one.
+
+        Returns the DriftReport, or None without a reference or, unless force
+        is set, with fewer than min_rows rows in the window (which then keeps
+        filling).
+        """
+        with self._lock:
+            if self.binning is None or not self.window_rows or (self.window_rows < self.min_rows and not force):
+                return None
+            binning, window, rows = self.binning, self.window, self.window_rows
+            self.window = np.zeros_like(window)
+            self.window_rows = 0
+            self.window_started = time.time()
+
+        psi, ks = drift_scores(binning.reference, window, binning.sizes)
+        status = status_of(psi)
+        scores = pd.DataFrame({'column': binning.columns, 'psi': psi, 'ks': ks, 'status': status})
+        scores = scores.sort_values('psi', ascending=False, ignore_index=True)
+        overall = 'alert' if (status == 'alert').any() else 'warning' if (status == 'warning').any() else 'ok'
+        report = DriftReport(time.time(), rows, scores, overall, self.model_version)
+        self.reports.append(report)
+
+        metrics.inc('drift_checks_total')
+        metrics.inc('drift_alerts_total', int((status == 'alert').sum()))
+        metrics.set_gauge('drift_psi_max', float(psi.max()))
+        for col, value in zip(binning.columns, psi):
+            metrics.set_gauge(f'drift_psi_{col}', float(value))
+        return report
+
+    def alerts(self):
+        """Columns at warning or alert level in the latest report."""
+        if not self.reports:
+            return pd.DataFrame(columns=['column', 'psi', 'ks', 'status'])
+        scores = self.reports[-1].scores
+        return scores[scores['status'] != 'ok']
+
+    def start(self):
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                metrics.inc('drift_check_errors_total')
+
+    def describe(self):
+        """The monitor's state as plain values, for the API and the Admin page."""
+        last = self.reports[-1] if self.reports else None
+        return {
+            'reference': None if self.binning is None else {
+                'model_version': self.binning.profile.get('model_version'),
+                'rows': self.binning.profile.get('rows'),
+                'created_at': self.binning.profile.get('created_at'),
+            },
+            'window_rows': self.window_rows,
+            'window_started': self.window_started,
+            'total_rows': self.total_rows,
+            'last_check': None if last is None else {
+                'checked_at': last.checked_at,
+                'rows': last.rows,
+                'status': last.status,
+                'scores': last.scores.to_dict(orient='records'),
+            },
+        }
+
+
+def start_monitor(live, interval=DRIFT_INTERVAL):
+    """A DriftMonitor for a LiveModel's deployments, checking every interval seconds."""
+    current = live.current
+    monitor = DriftMonitor(load_reference(reference_path_for(current.path)), current.version, interval)
+    live.add_listener(monitor.follow)
+    return monitor.start()
+
+
+def _score_file(model, path):
+    from malaria_scoring import read_batch_chunks, score, validate_batch_chunk
+
+    features, probabilities = [], []
+    for chunk in read_batch_chunks(path):
+        valid, _ = validate_batch_chunk(chunk)
+        if len(valid):
+            features.append(valid)
+            probabilities.append(score(model, valid)[1][:, MALARIA])
+    if not features:
+        raise ValueError(f"{path} has no valid rows")
+    return pd.concat(features, ignore_index=True), np.concatenate(probabilities)
+
+
+def main(argv=None):
+    from malaria_artifacts import model_version
+    from malaria_reload import load_deployment
+
+    parser = argparse.ArgumentParser(description="Build a drift reference profile or compare a file against it.")
+    parser.add_argument("command", choices=['reference', 'compare'])
+    parser.add_argument("input", help="CSV, Parquet or Excel file of scan inputs")
+    parser.add_argument("--model", default=os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH))
+    parser.add_argument("--profile", help="Reference profile (default: next to the model)")
+    args = parser.parse_args(argv)
+
+    import warnings
+    warnings.filterwarnings('ignore')
+    profile_path = args.profile or reference_path_for(args.model)
+    deployment = load_deployment(args.model)
+    try:
+        features, probability = _score_file(deployment.model, args.input)
+    except ValueError as e:
+        print(f"Invalid input: {e}", file=sys.stderr)
+        return 2
+
+    if args.command == 'reference':
+        save_reference(build_reference(features, probability, model_version(args.model)), profile_path)
+        print(f"Saved the reference profile of {len(features):,} rows to {profile_path}")
+        return 0
+
+    reference = load_reference(profile_path)
+    if reference is None:
+        print(f"No reference profile at {profile_path}; build one with the reference command.", file=sys.stderr)
+        return 2
+    monitor = DriftMonitor(reference, deployment.version, interval=0)
+    monitor.update(features, probability)
+    report = monitor.check(force=True)
+    print(f"{report.rows:,} rows against a reference of {reference['rows']:,}: {report.status}")
+    print(report.scores.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    return 1 if report.status == 'alert' else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Pandas-free fast path for the model pipeline.
+
+CompiledEncoder reads the fitted ColumnTransformer of the loaded pipeline
+(ordinal encoding of the categorical columns, passthrough of the numeric
+ones) and reproduces it with plain NumPy, writing straight into a float32
+matrix. CompiledScorer hands that matrix to the tree ensemble, skipping the
+DataFrame checks and conversions the sklearn Pipeline does on every call.
+The ensemble is evaluated by one of two backends, chosen with
+MALARIA_BACKEND or the backend argument:
+
+    xgboost  the booster's inplace_predict (default)
+    numpy    the flattened pure-NumPy evaluator in malaria_trees
+
+compile_scorer() falls back to the pipeline itself if it contains steps the
+encoder does not know how to reproduce.
+"""
+import os
+
+import numpy as np
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer, OrdinalEncoder
+
+import malaria_metrics as metrics
+from malaria_trees import FlatTreeEnsemble
+
+BACKENDS = ('xgboost', 'numpy')
+BACKEND = os.environ.get('MALARIA_BACKEND', 'xgboost')
+
+
+class CompiledEncoder:
+    """NumPy reimplementation of a fitted ColumnTransformer.
+
+    Supports OrdinalEncoder with handle_unknown='use_encoded_value',
+    passthrough columns and a dropped remainder, which is what the malaria
+    pipeline uses. Raises ValueError for anything else.
+    """
+
+    def __init__(self, preprocessor):
+        if not isinstance(preprocessor, ColumnTransformer):
+            raise ValueError(f"Unsupported preprocessor: {type(preprocessor).__name__}")
+
+        # (column, output index, categories -> code, unknown code, missing code)
+        self.categorical = []
+        # (column, output index)
+        self.numeric = []
+        n_out = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or len(columns) == 0:
+                continue
+            if isinstance(columns[0], (int, np.integer)) or isinstance(columns, slice):
+                raise ValueError(f"Transformer {name!r} selects columns by position")
+
+            if isinstance(transformer, OrdinalEncoder):
+                if transformer.handle_unknown != 'use_encoded_value':
+                    raise ValueError(f"Transformer {name!r} does not encode unknown categories")
+                if getattr(transformer, '_infrequent_enabled', False):
+                    raise ValueError(f"Transformer {name!r} groups infrequent categories")
+                for i, (col, categories) in enumerate(zip(columns, transformer.categories_)):
+                    codes = {}
+                    has_missing = False
+                    for code, category in enumerate(categories):
+                        if category is None or (isinstance(category, float) and np.isnan(category)):
+                            has_missing = True
+                        else:
+                            codes[category] = code
+                    # Missing values only get encoded_missing_value when they were
+                    # seen during fit; otherwise they are treated as unknown
+                    unknown = transformer.unknown_value
+                    missing = transformer.encoded_missing_value if has_missing else unknown
+                    self.categorical.append((col, n_out + i, codes, unknown, missing))
+                n_out += len(columns)
+            elif transformer == 'passthrough' or (
+                    isinstance(transformer, FunctionTransformer) and transformer.func is None):
+                self.numeric.extend((col, n_out + i) for i, col in enumerate(columns))
+                n_out += len(columns)
+            else:
+                raise ValueError(f"Unsupported transformer {name!r}: {type(transformer).__name__}")
+
+        self.n_features = n_out
+
+    def encode(self, features, out=None):
+        """Encode features into a float32 matrix.
+
+        features maps each input column to a sequence of values (a dict of
+        lists or arrays, or a DataFrame). out may be a preallocated
+        (n_rows, n_features) float32 array to write into.
+        """
+        first = self.numeric[0][0] if self.numeric else self.categorical[0][0]
+        n_rows = len(features[first])
+        if out is None:
+            out = np.empty((n_rows, self.n_features), dtype=np.float32)
+
+        for col, index, codes, unknown, missing in self.categorical:
+            values = np.asarray(features[col], dtype=object)
+            encoded = out[:, index]
+            encoded.fill(unknown)
+            is_missing = (values == None) | (values != values)  # noqa: E711 - elementwise on object arrays
+            encoded[is_missing] = missing
+            for category, code in codes.items():
+                encoded[values == category] = code
+
+        for col, index in self.numeric:
+            out[:, index] = features[col]
+
+        return out
+
+
+class CompiledScorer:
+    """Drop-in replacement for the pipeline's predict_proba on the fast path."""
+
+    def __init__(self, model, backend=BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        if not (isinstance(model, Pipeline) and len(model.steps) == 2):
+            raise ValueError("Expected a preprocessor + classifier pipeline")
+        classifier = model.steps[-1][1]
+        if getattr(classifier, 'n_classes_', None) != 2:
+            raise ValueError("Expected a binary XGBoost classifier")
+
+        self.model = model
+        self.backend = backend
+        self.encoder = CompiledEncoder(model.steps[0][1])
+        self.booster = classifier.get_booster()
+        self.trees = FlatTreeEnsemble.from_booster(self.booster) if backend == 'numpy' else None
+
+    def predict_proba(self, features):
+        with metrics.span('preprocess'):
+            matrix = self.encoder.encode(features)
+        with metrics.span('booster'):
+            if self.trees is not None:
+                positive = self.trees.predict(matrix)
+            else:
+                positive = self.booster.inplace_predict(matrix, predict_type='value')
+        # Same layout as XGBClassifier.predict_proba for a binary model
+        return np.vstack((1 - positive, positive)).T
+
+
+def compile_scorer(model, backend=BACKEND):
+    """Return a CompiledScorer for model, or model itself if it can't be compiled."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    try:
+        return CompiledScorer(model, backend)
+    except ValueError:
+        return model
@@ -0,0 +1,245 @@
+"""Offline evaluation of the model on a labeled file, with bootstrap confidence intervals.
+
+The file (the 21 inputs plus a label column, see
+malaria_scoring.read_labeled) is scored once with the compiled scorer the
+app serves, malaria being class 0. Every metric is then computed from two
+small arrays: the rows are grouped by distinct no-malaria probability,
+most malaria-like first, and each group counts its malaria and no-malaria
+rows. From their cumulative sums come
+
+  - sensitivity, specificity, PPV and NPV at any threshold (a row is
+    called malaria when its malaria probability is at least the threshold,
+    exactly as labels_from_proba() decides)
+  - ROC-AUC, with ties counted half
+  - PR-AUC of malaria as average precision, as scikit-learn defines it
+
+A bootstrap resample only changes the counts, so it is one np.bincount of
+the resampled rows' (group, outcome) cells plus the cumulative sums, with no re-sorting and no
+re-scoring. The resamples are spread over a process pool and give
+percentile confidence intervals for the metrics at the decision threshold
+and for every operating point of the threshold sweep.
+
+    python malaria_evaluate.py labeled.csv --resamples 2000 --sweep-csv sweep.csv
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from malaria_encoder import compile_scorer
+from malaria_scoring import (
+    DECISION_THRESHOLD, LABEL_COLUMN, MALARIA, MODEL_PATH, NO_MALARIA, load_pipeline, read_labeled
+)
+
+RESAMPLES = 2000
+CONFIDENCE = 0.95
+SWEEP_STEP = 0.05
+OPERATING_METRICS = ['sensitivity', 'specificity', 'ppv', 'npv', 'flagged']
+
+# Set once per bootstrap worker process by _init_worker
+_codes = None
+_n_groups = 0
+_cuts = None
+
+
+def group_rows(no_malaria_probability, malaria):
+    """Cell code of every row, and the distinct no-malaria probabilities in ascending order.
+
+    A row's group is the index of its probability among those; its cell code
+    is twice that, plus 1 if the row is not malaria.
+    """
+    values, groups = np.unique(np.asarray(no_malaria_probability), return_inverse=True)
+    return 2 * groups.astype(np.int64) + ~malaria, values
+
+
+def threshold_cuts(values, thresholds):
+    """For each malaria threshold, how many groups (from the first) are called malaria.
+
+    labels_from_proba() calls a row no malaria when its no-malaria
+    probability is above 1 - threshold.
+    """
+    limits = 1 - np.asarray(thresholds, dtype=values.dtype)
+    return np.searchsorted(values, limits, side='right')
+
+
+def group_counts(codes, n_groups, rows=None):
+    """Malaria and no-malaria rows per group, optionally over a resample of row indices."""
+    if rows is not None:
+        codes = codes[rows]
+    counts = np.bincount(codes, minlength=2 * n_groups).reshape(n_groups, 2)
+    return counts[:, 0], counts[:, 1]
+
+
+def metrics_from_counts(positives, negatives, cuts):
+    """ROC-AUC, PR-AUC and the operating metrics at each cut, from per-group counts.
+
+    Returns (roc_auc, pr_auc, operating) with operating shaped
+    (len(OPERATING_METRICS), len(cuts)); undefined ratios are NaN.
+    """
+    n_pos, n_neg = positives.sum(), negatives.sum()
+    tp = np.cumsum(positives)
+    fp = np.cumsum(negatives)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # A malaria row outranks the no-malaria rows of later groups, and ties with half of its own
+        roc_auc = (positives * (n_neg - fp + 0.5 * negatives)).sum() / (n_pos * n_neg)
+        has_pos = positives > 0
+        pr_auc = (positives[has_pos] / n_pos * tp[has_pos] / (tp[has_pos] + fp[has_pos])).sum()
+
+        tp_at = np.concatenate([[0], tp])[cuts]
+        fp_at = np.concatenate([[0], fp])[cuts]
+        fn_at = n_pos - tp_at
+        tn_at = n_neg - fp_at
+        operating = np.array([
+            tp_at / n_pos,
+            tn_at / n_neg,
+            tp_at / (tp_at + fp_at),
+            tn_at / (tn_at + fn_at),
+            (tp_at + fp_at) / (n_pos + n_neg),
+        ])
+    return float(roc_auc), float(pr_auc) if n_pos else np.nan, operating
+
+
+def _init_worker(codes, n_groups, cuts):
+    global _codes, _n_groups, _cuts
+    _codes, _n_groups, _cuts = codes, n_groups, cuts
+
+
+def _resample(seed, n_resamples):
+    """n_resamples bootstrap replicates as rows of [roc_auc, pr_auc, operating metrics...]."""
+    rng = np.random.default_rng(seed)
+    n_rows = len(_codes)
+    out = np.empty((n_resamples, 2 + len(OPERATING_METRICS) * len(_cuts)))
+    for i in range(n_resamples):
+        rows = rng.integers(0, n_rows, n_rows)
+        roc_auc, pr_auc, operating = metrics_from_counts(*group_counts(_codes, _n_groups, rows), _cuts)
+        out[i, 0], out[i, 1] = roc_auc, pr_auc
+        out[i, 2:] = operating.ravel()
+    return out
+
+
+def bootstrap(codes, n_groups, cuts, resamples=RESAMPLES, workers=None, seed=0):
+    """Bootstrap replicates of metrics_from_counts(), computed across a process pool."""
+    workers = workers or os.cpu_count() or 1
+    n_tasks = min(resamples, workers * 4)
+    sizes = np.full(n_tasks, resamples // n_tasks)
+    sizes[:resamples % n_tasks] += 1
+    seeds = np.random.SeedSequence(seed).spawn(n_tasks)
+    if workers == 1:
+        _init_worker(codes, n_groups, cuts)
+        return np.vstack([_resample(s, n) for s, n in zip(seeds, sizes)])
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(codes, n_groups, cuts)) as pool:
+        return np.vstack(list(pool.map(_resample, seeds, sizes)))
+
+
+def evaluate(proba, labels, threshold=DECISION_THRESHOLD, sweep_step=SWEEP_STEP, resamples=RESAMPLES,
+             confidence=CONFIDENCE, workers=None, seed=0):
+    """Metrics of predict_proba rows against class indices, with bootstrap intervals.
+
+    Returns (summary, sweep): summary has one row per metric at threshold
+    with its estimate and interval; sweep one row per threshold from
+    sweep_step to 1 - sweep_step, with every operating metric and its
+    interval. resamples=0 skips the bootstrap.
+    """
+    malaria = np.asarray(labels) == MALARIA
+    codes, values = group_rows(proba[:, NO_MALARIA], malaria)
+    thresholds = np.round(np.arange(sweep_step, 1 - sweep_step / 2, sweep_step), 6)
+    all_thresholds = np.concatenate([[threshold], thresholds])
+    cuts = threshold_cuts(values, all_thresholds)
+
+    roc_auc, pr_auc, operating = metrics_from_counts(*group_counts(codes, len(values)), cuts)
+    estimates = np.concatenate([[roc_auc, pr_auc], operating.ravel()])
+    if resamples:
+        replicates = bootstrap(codes, len(values), cuts, resamples, workers, seed)
+        alpha = (1 - confidence) / 2
+        low, high = np.nanquantile(replicates, [alpha, 1 - alpha], axis=0)
+    else:
+        low = high = np.full_like(estimates, np.nan)
+
+    def operating_view(values):
+        return values[2:].reshape(len(OPERATING_METRICS), len(all_thresholds))
+
+    summary = pd.DataFrame({
+        'metric': ['roc_auc', 'pr_auc', *OPERATING_METRICS],
+        'estimate': np.concatenate([estimates[:2], operating_view(estimates)[:, 0]]),
+        'ci_low': np.concatenate([low[:2], operating_view(low)[:, 0]]),
+        'ci_high': np.concatenate([high[:2], operating_view(high)[:, 0]]),
+    })
+    sweep = pd.DataFrame({'threshold': thresholds})
+    for i, name in enumerate(OPERATING_METRICS):
+        sweep[name] = operating_view(estimates)[i, 1:]
+        sweep[f'{name}_ci_low'] = operating_view(low)[i, 1:]
+        sweep[f'{name}_ci_high'] = operating_view(high)[i, 1:]
+    return summary, sweep
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the malaria model on a labeled file.")
+    parser.add_argument("input", help="CSV, Parquet or Excel file with the 21 inputs and a label column")
+    parser.add_argument("--model", default=os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH))
+    parser.add_argument("--label-column", default=LABEL_COLUMN,
+                        help="'Malaria'/'No Malaria', or 0 for malaria and 1 for no malaria")
+    parser.add_argument("--threshold", type=float, default=DECISION_THRESHOLD, help="Malaria probability threshold")
+    parser.add_argument("--resamples", type=int, default=RESAMPLES, help="Bootstrap resamples (0 for none)")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--step", type=float, default=SWEEP_STEP, help="Threshold sweep step")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Bootstrap processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sweep-csv", help="Also write the threshold sweep to this CSV file")
+    parser.add_argument("--json", action='store_true', help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    timings = {}
+    start = time.perf_counter()
+    try:
+        features, labels, skipped = read_labeled(args.input, args.label_column)
+    except ValueError as e:
+        print(f"Invalid input: {e}", file=sys.stderr)
+        return 2
+    if len(np.unique(labels)) < 2:
+        print("Invalid input: the labeled rows need both malaria and no-malaria outcomes", file=sys.stderr)
+        return 2
+    timings['read_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proba = compile_scorer(load_pipeline(args.model)).predict_proba(features)
+    timings['score_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary, sweep = evaluate(proba, labels, args.threshold, args.step, args.resamples, args.confidence,
+                              args.workers, args.seed)
+    timings['metrics_s'] = time.perf_counter() - start
+
+    if args.sweep_csv:
+        sweep.to_csv(args.sweep_csv, index=False)
+    if args.json:
+        print(json.dumps({
+            'rows': len(labels), 'malaria_rows': int((labels == MALARIA).sum()), 'skipped': skipped,
+            'threshold': args.threshold, 'resamples': args.resamples, 'confidence': args.confidence,
+            'summary': summary.to_dict(orient='records'), 'sweep': sweep.to_dict(orient='records'),
+            'timings': timings,
+        }, indent=2))
+        return 0
+
+    print(f"{len(labels):,} labeled rows ({int((labels == MALARIA).sum()):,} malaria, {skipped:,} skipped), "
+          f"{args.resamples:,} bootstrap resamples, {args.confidence:.0%} intervals")
+    print(f"\nAt threshold {args.threshold:g}:")
+    print(summary.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print("\nThreshold sweep:")
+    table = sweep[['threshold']].copy()
+    for name in OPERATING_METRICS:
+        table[name] = [f"{v:.3f} [{lo:.3f}, {hi:.3f}]" if args.resamples else f"{v:.3f}"
+                       for v, lo, hi in zip(sweep[name], sweep[f'{name}_ci_low'], sweep[f'{name}_ci_high'])]
+    print(table.to_string(index=False))
+    print("\nTime: " + ", ".join(f"{name[:-2]} {seconds:.2f}s" for name, seconds in timings.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Per-feature explanations of malaria predictions.
+
+contributions() asks the XGBoost booster for per-feature contributions
+(pred_contribs) for a whole batch in one call and maps them from the
+encoded matrix back to the 21 input fields, summing every encoded column
+that came from the same field. Two methods are available:
+
+    exact   TreeSHAP values, about 1 ms per row on one core
+    approx  the booster's approx_contribs (Saabas path attribution),
+            roughly 100x faster, for large batch exports
+
+Values are in log-odds of malaria: positive values push a row towards
+"Malaria", negative ones away from it, and each row's contributions plus
+BIAS add up to the logit of its malaria probability.
+
+explain_cached() memoizes contributions in a PredictionCache of their own,
+next to the one holding the probabilities, so redrawing a result or
+exporting it again does not recompute them, and the prediction cache's
+hit and miss counts still count each scan once.
+"""
+import numpy as np
+import xgboost as xgb
+from sklearn.pipeline import Pipeline
+
+import malaria_metrics as metrics
+from malaria_cache import canonical_keys, score_cached
+from malaria_encoder import CompiledEncoder, CompiledScorer
+from malaria_scoring import DECISION_THRESHOLD, FEATURE_COLUMNS
+
+EXPLAIN_METHODS = ('exact', 'approx')
+BIAS = 'bias'
+CONTRIBUTION_COLUMNS = [*FEATURE_COLUMNS, BIAS]
+
+
+def _encoder_and_booster(model):
+    if isinstance(model, CompiledScorer):
+        return model.encoder, model.booster
+    if isinstance(model, Pipeline) and len(model.steps) == 2:
+        return CompiledEncoder(model.steps[0][1]), model.steps[-1][1].get_booster()
+    raise ValueError(f"Cannot explain a {type(model).__name__}")
+
+
+def contributions(model, features, method='exact'):
+    """Per-field contributions to the malaria log-odds, shape (rows, len(CONTRIBUTION_COLUMNS))."""
+    if method not in EXPLAIN_METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {', '.join(EXPLAIN_METHODS)}")
+    encoder, booster = _encoder_and_booster(model)
+    with metrics.span('explain'):
+        matrix = encoder.encode(features)
+        # The booster's positive class is NO_MALARIA; flip the sign so the
+        # values explain the malaria log-odds instead
+        encoded = -booster.predict(xgb.DMatrix(matrix), pred_contribs=True, approx_contribs=method == 'approx')
+
+        # Encoded column -> input field, so one-hot style encodings sum up too
+        field_of = np.empty(encoder.n_features, dtype=np.intp)
+        for col, index, *_ in encoder.categorical:
+            field_of[index] = FEATURE_COLUMNS.index(col)
+        for col, index in encoder.numeric:
+            field_of[index] = FEATURE_COLUMNS.index(col)
+
+        out = np.zeros((len(matrix), len(CONTRIBUTION_COLUMNS)), dtype=np.float32)
+        np.add.at(out.T, field_of, encoded[:, :-1].T)
+        out[:, -1] = encoded[:, -1]
+    return out
+
+
+def top_contributions(row, n=8):
+    """The n largest contributions of one row (bias excluded) as [(field, value)], largest effect first."""
+    order = np.argsort(-np.abs(row[:-1]))[:n]
+    return [(FEATURE_COLUMNS[i], float(row[i])) for i in order]
+
+
+def explain_cached(model, features, cache, contribution_cache, version, threshold=DECISION_THRESHOLD):
+    """score_cached() on cache plus contributions_cached() on contribution_cache.
+
+    Returns (prediction, prediction_proba, contributions).
+    """
+    prediction, prediction_proba = score_cached(model, features, cache, version, threshold)
+    return prediction, prediction_proba, contributions_cached(model, features, contribution_cache, version)
+
+
+def contributions_cached(model, features, contribution_cache, version):
+    """contributions(), looked up in and added to contribution_cache."""
+    keys = canonical_keys(features, version)
+    out = np.empty((len(keys), len(CONTRIBUTION_COLUMNS)), dtype=np.float32)
+    missing = []
+    for i, key in enumerate(keys):
+        cached = contribution_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            out[i] = cached
+    metrics.inc('explain_cache_hits_total', len(keys) - len(missing))
+    metrics.inc('explain_cache_misses_total', len(missing))
+
+    if missing:
+        fresh = contributions(model, features.iloc[missing])
+        out[missing] = fresh
+        for i, row in zip(missing, fresh):
+            contribution_cache.put(keys[i], row.copy())
+    return out
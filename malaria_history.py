@@ -0,0 +1,201 @@
+"""Persistent scan history in SQLite.
+
+Every scored row is appended to one `scans` table with its 21 inputs, the
+malaria probability, the predicted class, the model version, a timestamp,
+an optional patient reference and where it came from (scan, batch or api).
+Each call to ScanHistory.append() writes its rows, and their contribution
+to the surveillance rollups (see malaria_surveillance), in a single
+transaction, so batch and API callers pass whole chunks rather than single
+rows.
+
+Reads are keyset-paginated on (scanned_at, id) and served from the indexes
+on time, location and patient reference, so a page costs the same with a
+thousand rows or with millions.
+
+The database lives at MALARIA_HISTORY_DB (default malaria_history.db in
+MALARIA_DATA_DIR, ~/.local/share/malaria-scan, rather than the working
+directory, which may be read-only in a container); set it to an empty string
+to turn history off. The connection runs in WAL mode, so the Streamlit app
+and API worker processes can share one file.
+
+History is never worth failing a scan for: open_history() returns None, and
+the app and API run without history, if the database can't be opened, and a
+ScanHistory that fails to write stops recording. Both say why on stderr.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from malaria_scoring import CATEGORICAL_COLUMNS, FEATURE_COLUMNS, LABELS, MALARIA, NO_MALARIA, NUMERIC_COLUMNS
+from malaria_surveillance import SCHEMA as ROLLUP_SCHEMA, day_of, update_rollups
+
+DATA_DIR = os.environ.get('MALARIA_DATA_DIR') or os.path.join(os.path.expanduser('~'), '.local', 'share',
+                                                               'malaria-scan')
+HISTORY_DB = os.environ.get('MALARIA_HISTORY_DB', os.path.join(DATA_DIR, 'malaria_history.db'))
+PAGE_SIZE = 50
+
+_COLUMNS = [
+    'scanned_at', 'patient_ref', 'source', *FEATURE_COLUMNS,
+    'malaria_probability', 'prediction', 'model_version',
+]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    scanned_at REAL NOT NULL,
+    patient_ref TEXT,
+    source TEXT NOT NULL,
+    {', '.join(f'{col} TEXT' for col in CATEGORICAL_COLUMNS)},
+    {', '.join(f'{col} REAL' for col in NUMERIC_COLUMNS)},
+    malaria_probability REAL NOT NULL,
+    prediction INTEGER NOT NULL,
+    model_version TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_time ON scans (scanned_at);
+CREATE INDEX IF NOT EXISTS scans_location_time ON scans (location, scanned_at);
+CREATE INDEX IF NOT EXISTS scans_patient_time ON scans (patient_ref, scanned_at);
+"""
+
+_INSERT = f"INSERT INTO scans ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+
+def _text(values, n_rows):
+    """Values as a list of str with missing values as None (SQL NULL)."""
+    if values is None or isinstance(values, str):
+        return [values] * n_rows
+    values = pd.Series(values, dtype=object)
+    return values.astype(str).where(values.notna(), None).tolist()
+
+
+def _real(values):
+    values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def open_history(path=HISTORY_DB):
+    """A ScanHistory at path, or None if history is off (path empty) or the database can't be opened."""
+    if not path:
+        return None
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return ScanHistory(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Scan history {path} could not be opened ({e}); running without history", file=sys.stderr)
+        return None
+
+
+class ScanHistory:
+    """Append-only store of scored scans, safe to share between threads."""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA + ROLLUP_SCHEMA)
+        self._lock = threading.Lock()
+        # Cleared by the first failed write, after which append() records nothing
+        self.writable = True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """The connection, held exclusively and committed (or rolled back) on exit."""
+        with self._lock, self._conn:
+            yield self._conn
+
+    def query(self, sql, params=()):
+        """All rows of a read-only query."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def append(self, features, malaria_probability, prediction, model_version=None,
+               patient_ref=None, source='scan', scanned_at=None):
+        """Add one row per row of features in a single transaction.
+
+        patient_ref may be one value for every row or one per row. Returns
+        the number of rows written. If the write fails (e.g. a read-only or
+        full disk), history stops recording instead of failing the caller.
+        """
+        n_rows = len(features)
+        if not n_rows or not self.writable:
+            return 0
+        scanned_at = time.time() if scanned_at is None else scanned_at
+        columns = [
+            [scanned_at] * n_rows,
+            _text(patient_ref, n_rows),
+            [source] * n_rows,
+        ]
+        for col in CATEGORICAL_COLUMNS:
+            columns.append(_text(features[col], n_rows))
+        for col in NUMERIC_COLUMNS:
+            columns.append(_real(features[col]))
+        malaria_probability = np.asarray(malaria_probability, dtype=np.float64)
+        prediction = np.asarray(prediction, dtype=np.int64)
+        columns.append(malaria_probability.tolist())
+        columns.append(prediction.tolist())
+        columns.append([model_version] * n_rows)
+
+        try:
+            with self.transaction() as conn:
+                conn.executemany(_INSERT, zip(*columns))
+                update_rollups(conn, day_of(scanned_at), features, malaria_probability, prediction, features)
+        except sqlite3.Error as e:
+            self.writable = False
+            print(f"Scan history {self.path} could not be written ({e}); no longer recording scans", file=sys.stderr)
+            return 0
+        return n_rows
+
+    def append_scored(self, scored, model_version=None, source='batch', scanned_at=None):
+        """append() for the output of score_batch_chunk, with patient_ref taken from its column if any."""
+        prediction = np.where(scored['prediction'] == LABELS[MALARIA], MALARIA, NO_MALARIA)
+        return self.append(scored, scored['malaria_probability'], prediction, model_version,
+                           scored.get('patient_ref'), source, scanned_at)
+
+    def page(self, limit=PAGE_SIZE, before=None, location=None, patient_ref=None):
+        """One page of scans, newest first.
+
+        before is the cursor returned with the previous page. Returns
+        (DataFrame, cursor for the next page or None on the last page).
+        """
+        clauses, params = [], []
+        if location:
+            clauses.append("location = ?")
+            params.append(location)
+        if patient_ref:
+            clauses.append("patient_ref = ?")
+            params.append(patient_ref)
+        if before is not None:
+            clauses.append("(scanned_at, id) < (?, ?)")
+            params.extend(before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"SELECT id, {', '.join(_COLUMNS)} FROM scans {where} ORDER BY scanned_at DESC, id DESC LIMIT ?"
+        rows = self.query(query, (*params, limit + 1))
+
+        frame = pd.DataFrame(rows[:limit], columns=['id', *_COLUMNS])
+        frame['scanned_at'] = pd.to_datetime(frame['scanned_at'], unit='s')
+        frame.insert(frame.columns.get_loc('prediction'), 'label',
+                     np.where(frame['prediction'] == MALARIA, LABELS[MALARIA], LABELS[NO_MALARIA]))
+        cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            cursor = (last[1], last[0])
+        return frame, cursor
+
+    def locations(self):
+        """Distinct locations in the history, from the location index."""
+        rows = self.query("SELECT DISTINCT location FROM scans WHERE location IS NOT NULL ORDER BY location")
+        return [row[0] for row in rows]
@@ -0,0 +1,384 @@
+"""Load test: simulated clinicians scanning against a local app or API instance.
+
+Each virtual user loops: think for a while (exponentially distributed, mean
+--think seconds), then submit one scan with random inputs from the form's
+ranges (malaria_scoring.random_inputs) and wait for the result.
+
+  app   drives the AI Scan page of a `streamlit run malaria_app.py` server
+        the way a browser does: one websocket session per user, which opens
+        the page, fills in the form and presses Analyze; a scan's latency
+        runs until the server reports the script run finished, so it
+        includes every chart and table on the results page
+  api   posts single records to POST /predict of the HTTP service
+
+Users are added in stages (--users 1,2,4,8: one stage per count, each
+--duration seconds long), to find the point where adding users stops adding
+throughput and latency climbs instead. Per stage it reports throughput,
+latency percentiles, error rate and the server's CPU use and resident
+memory; --timeline-csv also writes them per --interval seconds.
+
+Without --url a server is started on a free localhost port with this
+Python and stopped at the end, so its CPU and memory can be sampled; with
+--url, pass --server-pid to sample an already running server (its worker
+processes are included). The generator runs on the same host, so its own
+CPU use is reported too: if it is high, the client is part of the limit.
+
+    python malaria_loadtest.py app --users 1,2,4,8 --duration 30 --think 2
+    python malaria_loadtest.py api --users 1,8,32,128 --duration 20 --think 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from malaria_schema import FIELDS
+from malaria_scoring import random_inputs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGE_USERS = '1,2,4,8'
+STAGE_SECONDS = 30.0
+THINK_SECONDS = 2.0
+SAMPLE_SECONDS = 1.0
+REQUEST_TIMEOUT = 60.0
+# Inputs drawn per user up front, so the generator spends its CPU on requests
+INPUT_POOL = 256
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def _descendants(pid):
+    pids = [pid]
+    for pid in pids:
+        try:
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def process_usage(pid, descendants=True):
+    """CPU seconds used so far and resident bytes of pid and (by default) all its descendants."""
+    cpu, rss = 0.0, 0
+    for p in _descendants(pid) if descendants else [pid]:
+        try:
+            with open(f'/proc/{p}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{p}/statm') as f:
+                rss += int(f.read().split()[1]) * _PAGE_SIZE
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    return cpu, rss
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(target, port):
+    """Start the app or API on localhost:port; returns (process, base URL)."""
+    if target == 'app':
+        command = [sys.executable, '-m', 'streamlit', 'run', os.path.join(HERE, 'malaria_app.py'),
+                   '--server.port', str(port), '--server.headless', 'true']
+        health = '/_stcore/health'
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'malaria_api:app', '--port', str(port), '--log-level', 'warning']
+        health = '/health'
+    process = subprocess.Popen(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the {target} server exited with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(url + health, timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"the {target} server did not become healthy within 120 s")
+
+
+class ApiUser:
+    """A client of POST /predict."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/') + '/predict'
+        self.client = None
+
+    async def open(self):
+        import httpx
+        self.client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+
+    async def scan(self, row):
+        response = await self.client.post(self.url, json=row)
+        return response.status_code == 200
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class AppUser:
+    """A browser session of the Streamlit app, speaking its websocket protocol."""
+
+    PAGE = "🔬 AI Malaria Scan"
+
+    def __init__(self, url):
+        self.url = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        self.ws = None
+        self.navigation = None
+        self.fields = {}
+        self.submit = None
+        self.extra = []
+
+    async def _run(self, states):
+        """Rerun the script with the given widget states; returns the elements it drew."""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.widget_states.widgets.extend(states)
+        await self.ws.write_message(message.SerializeToString(), binary=True)
+        elements = []
+        while True:
+            raw = await self.ws.read_message()
+            if raw is None:
+                raise ConnectionError("the app closed the websocket")
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                elements.append(forward.delta.new_element)
+            elif kind == 'script_finished' and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return elements
+
+    async def open(self):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        from tornado.websocket import websocket_connect
+
+        self.ws = await websocket_connect(self.url, subprotocols=['streamlit'])
+        elements = await self._run([])
+        selectbox = next(e.selectbox for e in elements if e.WhichOneof('type') == 'selectbox')
+        self.navigation = WidgetState(id=selectbox.id, string_value=self.PAGE)
+
+        labels = {field.label: field.name for field in FIELDS}
+        for element in await self._run([self.navigation]):
+            kind = element.WhichOneof('type')
+            widget = getattr(element, kind) if kind in ('number_input', 'selectbox', 'text_input', 'button') else None
+            if widget is None or not widget.form_id:
+                continue
+            if kind == 'button' and widget.is_form_submitter:
+                self.submit = WidgetState(id=widget.id, trigger_value=True)
+            elif widget.label in labels:
+                self.fields[labels[widget.label]] = (kind, widget.id)
+            elif kind == 'text_input':
+                self.extra.append(WidgetState(id=widget.id, string_value=''))
+        missing = [field.name for field in FIELDS if field.name not in self.fields]
+        if missing or self.submit is None:
+            raise RuntimeError(f"AI Scan form not found (missing {', '.join(missing) or 'the submit button'})")
+
+    async def scan(self, row):
+        from streamlit.proto.Alert_pb2 import Alert
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        states = [self.navigation, *self.extra, self.submit]
+        for name, (kind, widget_id) in self.fields.items():
+            if kind == 'number_input':
+                states.append(WidgetState(id=widget_id, double_value=float(row[name])))
+            else:
+                states.append(WidgetState(id=widget_id, string_value=str(row[name])))
+        elements = await self._run(states)
+        return not any(
+            e.WhichOneof('type') == 'exception' or (e.WhichOneof('type') == 'alert' and e.alert.format == Alert.ERROR)
+            for e in elements)
+
+    async def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+
+class LoadTest:
+    """Staged virtual users against one server, with latency and resource samples."""
+
+    def __init__(self, make_user, stages, duration, think, server_pid=None, interval=SAMPLE_SECONDS, seed=0):
+        self.make_user = make_user
+        self.stages = stages
+        self.duration = duration
+        self.think = think
+        self.server_pid = server_pid
+        self.interval = interval
+        self.seed = seed
+        # (finished at, latency seconds, ok) per scan
+        self.results = []
+        self.samples = []
+        self.stage_windows = []
+        self._users = 0
+
+    async def _user(self, index, stop):
+        rng = np.random.default_rng([self.seed, index])
+        user = self.make_user()
+        try:
+            await user.open()
+        except Exception:
+            self.results.append((time.time(), float('nan'), False))
+            return
+        # Spread the first scans out instead of starting every user at once
+        await asyncio.sleep(rng.uniform(0, self.think))
+        rows = random_inputs(INPUT_POOL, seed=[self.seed, index]).to_dict(orient='records')
+        n = 0
+        try:
+            while not stop.is_set():
+                row = rows[n % len(rows)]
+                n += 1
+                start = time.perf_counter()
+                try:
+                    ok = await asyncio.wait_for(user.scan(row), REQUEST_TIMEOUT)
+                except Exception:
+                    ok = False
+                self.results.append((time.time(), time.perf_counter() - start, ok))
+                if not ok and isinstance(user, AppUser) and user.ws.protocol is None:
+                    break
+                if self.think > 0:
+                    try:
+                        await asyncio.wait_for(stop.wait(), rng.exponential(self.think))
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await user.close()
+
+    async def _sample(self, stop):
+        server = process_usage(self.server_pid) if self.server_pid else None
+        client = process_usage(os.getpid(), descendants=False)
+        last = time.time()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            now = time.time()
+            elapsed = max(now - last, 1e-9)
+            sample = {'time': now, 'users': self._users}
+            if self.server_pid:
+                cpu, rss = process_usage(self.server_pid)
+                sample['server_cpu_percent'] = (cpu - server[0]) / elapsed * 100
+                sample['server_rss_mb'] = rss / 2**20
+                server = (cpu, rss)
+            cpu, rss = process_usage(os.getpid(), descendants=False)
+            sample['client_cpu_percent'] = (cpu - client[0]) / elapsed * 100
+            client = (cpu, rss)
+            self.samples.append(sample)
+            last = now
+
+    async def run(self):
+        stop_sampling = asyncio.Event()
+        stop_users = asyncio.Event()
+        sampler = asyncio.create_task(self._sample(stop_sampling))
+        tasks = []
+        for users in self.stages:
+            start = time.time()
+            while len(tasks) < users:
+                tasks.append(asyncio.create_task(self._user(len(tasks), stop_users)))
+            self._users = users
+            await asyncio.sleep(self.duration)
+            self.stage_windows.append((users, start, time.time()))
+        stop_users.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        stop_sampling.set()
+        await sampler
+
+    def _window(self, start, end):
+        results = [(latency, ok) for finished, latency, ok in self.results if start <= finished < end]
+        samples = [s for s in self.samples if start < s['time'] <= end]
+        latencies = np.array([latency for latency, ok in results if ok], dtype=np.float64)
+        row = {
+            'scans': len(results),
+            'throughput_per_s': len(results) / max(end - start, 1e-9),
+            'error_rate': sum(not ok for _, ok in results) / len(results) if results else np.nan,
+        }
+        for p in (50, 95, 99):
+            row[f'p{p}_ms'] = np.percentile(latencies, p) * 1000 if len(latencies) else np.nan
+        for key in ('server_cpu_percent', 'client_cpu_percent'):
+            values = [s[key] for s in samples if key in s]
+            row[key] = float(np.mean(values)) if values else np.nan
+        values = [s['server_rss_mb'] for s in samples if 'server_rss_mb' in s]
+        row['server_rss_mb'] = max(values) if values else np.nan
+        return row
+
+    def report(self):
+        """One row per stage, with saturated set where more users stopped adding throughput."""
+        rows = [{'users': users, **self._window(start, end)} for users, start, end in self.stage_windows]
+        frame = pd.DataFrame(rows)
+        previous = frame['throughput_per_s'].shift()
+        frame['saturated'] = (frame['throughput_per_s'] < previous * 1.1) | (frame['p95_ms'] > 2 * frame['p95_ms'].iloc[0])
+        frame.loc[0, 'saturated'] = False
+        return frame
+
+    def timeline(self):
+        """The same measures per sampling interval."""
+        rows = []
+        start = self.stage_windows[0][1] if self.stage_windows else time.time()
+        for previous, sample in zip([{'time': start}, *self.samples], self.samples):
+            rows.append({'elapsed_s': sample['time'] - start, 'users': sample['users'],
+                         **self._window(previous['time'], sample['time'])})
+        return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the malaria app or API with simulated clinicians.")
+    parser.add_argument("target", choices=['app', 'api'])
+    parser.add_argument("--users", default=STAGE_USERS, help="Concurrent users per stage, comma-separated")
+    parser.add_argument("--duration", type=float, default=STAGE_SECONDS, help="Seconds per stage")
+    parser.add_argument("--think", type=float, default=THINK_SECONDS, help="Mean think time between scans (s)")
+    parser.add_argument("--url", help="Server to test (default: start one on localhost)")
+    parser.add_argument("--server-pid", type=int, help="Process to sample CPU and memory of, with --url")
+    parser.add_argument("--interval", type=float, default=SAMPLE_SECONDS, help="Sampling interval (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeline-csv", help="Also write the per-interval measures to this CSV file")
+    parser.add_argument("--json", action='store_true', help="Print the stage report as JSON")
+    args = parser.parse_args(argv)
+
+    stages = [int(users) for users in args.users.split(',')]
+    process = None
+    url, server_pid = args.url, args.server_pid
+    if url is None:
+        print(f"Starting the {args.target} server...", file=sys.stderr)
+        process, url = start_server(args.target, _free_port())
+        server_pid = process.pid
+    make_user = (lambda: AppUser(url)) if args.target == 'app' else (lambda: ApiUser(url))
+    test = LoadTest(make_user, stages, args.duration, args.think, server_pid, args.interval, args.seed)
+    try:
+        asyncio.run(test.run())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = test.report()
+    if args.timeline_csv:
+        test.timeline().to_csv(args.timeline_csv, index=False)
+    if args.json:
+        print(json.dumps(report.to_dict(orient='records'), indent=2))
+        return 0
+    print(f"{args.target} at {url}: stages of {args.duration:g} s, mean think time {args.think:g} s")
+    print(report.to_string(index=False, float_format=lambda v: f"{v:.1f}"))
+    saturated = report[report['saturated']]
+    if len(saturated):
+        print(f"Throughput stopped scaling (or p95 latency doubled) at {saturated['users'].iloc[0]} users")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
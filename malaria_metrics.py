@@ -0,0 +1,221 @@
+"""Low-overhead latency and throughput instrumentation.
+
+Code wraps the stages it wants timed in span("name"); durations go into
+fixed log-spaced bucket histograms, from which p50/p95/p99 are estimated
+(to within about 10%). Counters and gauges cover scans, errors, cache hits,
+the loaded model version and process memory.
+
+render() produces the Prometheus text exposition format, served on /metrics
+by the HTTP API and, for the Streamlit app, by start_http_server() when
+MALARIA_METRICS_PORT is set.
+
+Set MALARIA_METRICS=0 (or call set_enabled(False)) to turn instrumentation
+off: span() then returns a shared no-op context manager and inc() and
+observe() return immediately.
+"""
+import bisect
+import contextlib
+import math
+import os
+import resource
+import threading
+import time
+
+ENABLED = os.environ.get('MALARIA_METRICS', '1') != '0'
+
+PREFIX = 'malaria'
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Bucket upper bounds in seconds: 10 us to ~100 s, four buckets per doubling
+_BUCKETS = [1e-5 * 2 ** (i / 4) for i in range(int(4 * math.log2(1e7)) + 1)]
+
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(_BUCKETS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Estimated q-quantile: the geometric middle of the bucket it falls in."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= target and n:
+                    break
+        if index >= len(_BUCKETS):
+            return _BUCKETS[-1]
+        lower = _BUCKETS[index - 1] if index else 0.0
+        return math.sqrt(lower * _BUCKETS[index]) if lower else _BUCKETS[index]
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.labels = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def set_info(self, name, **labels):
+        self.labels[name] = labels
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+REGISTRY = Registry()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.histogram(self.name).observe(time.perf_counter() - self.start)
+        return False
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = enabled
+
+
+def span(name):
+    """Context manager timing its body into the histogram for name."""
+    if not ENABLED:
+        return _NOOP
+    return _Span(name)
+
+
+def observe(name, seconds):
+    if ENABLED:
+        REGISTRY.histogram(name).observe(seconds)
+
+
+def inc(name, amount=1):
+    if ENABLED:
+        REGISTRY.inc(name, amount)
+
+
+def set_gauge(name, value):
+    if ENABLED:
+        REGISTRY.set_gauge(name, value)
+
+
+def set_model_version(version):
+    REGISTRY.set_info('model', version=version)
+
+
+def process_memory_bytes():
+    """Resident set size of this process, or its peak where the current value isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def snapshot():
+    """Current spans (count, sum and quantiles), counters and gauges as plain dicts."""
+    spans = {
+        name: {
+            'count': histogram.count,
+            'sum': histogram.sum,
+            **{f"p{round(q * 100)}": histogram.quantile(q) for q in QUANTILES},
+        }
+        for name, histogram in sorted(REGISTRY.histograms.items())
+    }
+    gauges = dict(REGISTRY.gauges)
+    gauges['process_resident_memory_bytes'] = process_memory_bytes()
+    return {
+        'spans': spans,
+        'counters': dict(sorted(REGISTRY.counters.items())),
+        'gauges': gauges,
+        'info': dict(REGISTRY.labels),
+    }
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = [
+        f"# HELP {PREFIX}_span_seconds Duration of instrumented stages.",
+        f"# TYPE {PREFIX}_span_seconds summary",
+    ]
+    for name, stats in data['spans'].items():
+        for q in QUANTILES:
+            lines.append(f'{PREFIX}_span_seconds{{span="{name}",quantile="{q}"}} {stats[f"p{round(q * 100)}"]:.6g}')
+        lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {stats["sum"]:.6g}')
+        lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {stats["count"]}')
+    for name, value in data['counters'].items():
+        lines.append(f"# TYPE {PREFIX}_{name} counter")
+        lines.append(f"{PREFIX}_{name} {value}")
+    for name, value in data['gauges'].items():
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        lines.append(f"{PREFIX}_{name} {value}")
+    for name, labels in data['info'].items():
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines.append(f"# TYPE {PREFIX}_{name}_info gauge")
+        lines.append(f"{PREFIX}_{name}_info{{{label_text}}} 1")
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """Serve render() on http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,274 @@
+"""Pre-fork launcher: load the model once and fork the workers from it.
+
+Started the usual way (`uvicorn --workers N`, or one `streamlit run` per
+port), every worker process imports NumPy, pandas, scikit-learn and XGBoost,
+unpickles its own copy of the pipeline and warms it up. This launcher does
+the imports and the loading once in a parent process, freezes the parent's
+objects out of the garbage collector (gc.freeze(), so collections in the
+workers don't write to, and un-share, the inherited pages) and then forks
+the workers. They share the parent's memory copy-on-write and answer their
+first request without loading anything. The parent never predicts: the
+first booster call starts XGBoost's OpenMP thread pool, which a forked
+child cannot use safely, so each worker starts its own. The parent only
+supervises: it restarts workers that die and stops them all on SIGINT or
+SIGTERM.
+
+    python malaria_prefork.py api --workers 4 --port 8000
+    python malaria_prefork.py app --workers 2 --port 8501
+
+API workers share one listening socket, as with uvicorn's own --workers.
+Streamlit workers each listen on their own port (8501, 8502, ...) behind a
+load balancer with sticky sessions. Each worker still watches the artifact
+and hot-reloads on its own (see malaria_reload); a reloaded model is private
+to the worker that loaded it, until the launcher is restarted.
+
+Compare per-worker memory and time-to-first-prediction of both ways of
+starting workers:
+
+    python malaria_prefork.py measure --workers 4
+"""
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+_IMPORTED_AT = time.time()
+
+
+def preload(model_path):
+    """Import the scoring stack and load model_path, without predicting, for the workers to inherit."""
+    import warnings
+    warnings.filterwarnings('ignore')
+    import malaria_api  # noqa: F401 -- imported for the workers to inherit
+    from malaria_reload import preload as preload_model
+    preload_model(model_path)
+    gc.collect()
+    gc.freeze()
+
+
+def memory_of(pid):
+    """RSS, PSS and USS (private memory) of a process in bytes, from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+class Supervisor:
+    """Fork workers from this process, restart them when they die, stop them on a signal."""
+
+    def __init__(self, n_workers, run_worker):
+        self.n_workers = n_workers
+        self.run_worker = run_worker
+        self.workers = {}
+        self.stopping = False
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 1
+            try:
+                self.run_worker(index)
+                code = 0
+            finally:
+                os._exit(code)
+        self.workers[pid] = index
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        for index in range(self.n_workers):
+            self._spawn(index)
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.workers.pop(pid, None)
+            if index is not None and not self.stopping:
+                print(f"Worker {index} (pid {pid}) exited with status {status}; restarting it", file=sys.stderr)
+                time.sleep(1)
+                self._spawn(index)
+
+
+def serve_api(model_path, n_workers, host, port):
+    import uvicorn
+    from malaria_api import create_app
+
+    preload(model_path)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"Serving the API on http://{host}:{port} with {n_workers} pre-forked workers", file=sys.stderr)
+
+    def run_worker(index):
+        config = uvicorn.Config(create_app(model_path), log_level='warning')
+        uvicorn.Server(config).run(sockets=[sock])
+
+    Supervisor(n_workers, run_worker).run()
+
+
+def serve_app(model_path, n_workers, port):
+    import streamlit.web.cli as streamlit_cli
+
+    import plotly.graph_objects  # noqa: F401 -- imported by the app's chart pages
+    preload(model_path)
+    app_path = os.path.join(HERE, 'malaria_app.py')
+    print(f"Serving the app on ports {port}-{port + n_workers - 1} with {n_workers} pre-forked workers",
+          file=sys.stderr)
+
+    def run_worker(index):
+        streamlit_cli.main(args=['run', app_path, '--server.port', str(port + index), '--server.headless', 'true'],
+                           prog_name='streamlit')
+
+    Supervisor(n_workers, run_worker).run()
+
+
+_FIRST_PREDICTION = """
+import sys, time, warnings
+warnings.filterwarnings('ignore')
+import malaria_api
+from malaria_reload import start_live_model
+from malaria_scoring import random_inputs, score_batch_chunk
+live, _ = start_live_model({model_path!r}, interval=0)
+score_batch_chunk(live.current.model, random_inputs(1))
+print(time.time(), flush=True)
+sys.stdin.read()
+"""
+
+
+def _first_prediction_in_child(model_path, write_fd):
+    from malaria_reload import start_live_model
+    from malaria_scoring import random_inputs, score_batch_chunk
+    live, _ = start_live_model(model_path, interval=0)
+    score_batch_chunk(live.current.model, random_inputs(1))
+    os.write(write_fd, f"{time.time()}\n".encode())
+
+
+def measure(model_path, n_workers):
+    """Per-worker memory and time-to-first-prediction, started independently versus pre-forked.
+
+    Every worker imports what the API imports, loads the model and scores
+    one row, then waits while its memory is read. Times are from the moment
+    the worker was started; the pre-fork parent's own startup, counted from
+    when this module was imported, is reported separately.
+    """
+    results = {}
+
+    # Pre-forked from a parent that loaded everything once
+    preload(model_path)
+    parent_seconds = time.time() - _IMPORTED_AT
+    pids, reads, started = [], [], []
+    for _ in range(n_workers):
+        read_fd, write_fd = os.pipe()
+        release_read, release_write = os.pipe()
+        started.append(time.time())
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.close(release_write)
+            _first_prediction_in_child(model_path, write_fd)
+            os.read(release_read, 1)
+            os._exit(0)
+        os.close(write_fd)
+        os.close(release_read)
+        pids.append(pid)
+        reads.append((read_fd, release_write))
+    first = []
+    for (read_fd, _), start in zip(reads, started):
+        with os.fdopen(read_fd) as f:
+            first.append(float(f.readline()) - start)
+    memory = [memory_of(pid) for pid in pids]
+    for pid, (_, release_write) in zip(pids, reads):
+        os.write(release_write, b'x')
+        os.close(release_write)
+        os.waitpid(pid, 0)
+    results['prefork'] = _summary(first, memory)
+    results['prefork']['parent_startup_s'] = parent_seconds
+    results['prefork']['parent'] = memory_of(os.getpid())
+
+    # Independent processes, as uvicorn --workers or separate streamlit runs start them
+    snippet = _FIRST_PREDICTION.format(model_path=model_path)
+    started, procs = [], []
+    for _ in range(n_workers):
+        started.append(time.time())
+        procs.append(subprocess.Popen([sys.executable, '-c', snippet], cwd=HERE, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, text=True))
+    first = [float(proc.stdout.readline()) - start for proc, start in zip(procs, started)]
+    memory = [memory_of(proc.pid) for proc in procs]
+    for proc in procs:
+        proc.communicate('')
+    results['independent'] = _summary(first, memory)
+    return results
+
+
+def _summary(first, memory):
+    return {
+        'first_prediction_s': sorted(first)[len(first) // 2],
+        'rss_mb': sum(m['rss'] for m in memory) / len(memory) / 2**20,
+        'pss_mb': sum(m['pss'] for m in memory) / len(memory) / 2**20,
+        'uss_mb': sum(m['uss'] for m in memory) / len(memory) / 2**20,
+        'total_pss_mb': sum(m['pss'] for m in memory) / 2**20,
+    }
+
+
+def main(argv=None):
+    from malaria_artifacts import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Run pre-forked malaria workers that share one loaded model.")
+    parser.add_argument("mode", choices=['api', 'app', 'measure'])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--host", default='0.0.0.0')
+    parser.add_argument("--port", type=int, help="Port (default 8000 for the API, 8501 for the app)")
+    parser.add_argument("--model", default=os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH))
+    parser.add_argument("--json", action='store_true', help="Print the measurements as JSON")
+    args = parser.parse_args(argv)
+
+    if args.mode == 'api':
+        serve_api(args.model, args.workers, args.host, args.port or 8000)
+    elif args.mode == 'app':
+        serve_app(args.model, args.workers, args.port or 8501)
+    else:
+        results = measure(args.model, args.workers)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return 0
+        print(f"{args.workers} workers       first prediction   RSS/worker   PSS/worker   USS/worker   total PSS")
+        for mode in ('independent', 'prefork'):
+            r = results[mode]
+            print(f"{mode:<18} {r['first_prediction_s'] * 1000:>11.0f} ms {r['rss_mb']:>9.0f} MB "
+                  f"{r['pss_mb']:>9.0f} MB {r['uss_mb']:>9.0f} MB {r['total_pss_mb']:>8.0f} MB")
+        print(f"Pre-fork parent: {results['prefork']['parent_startup_s'] * 1000:.0f} ms to import and load, "
+              f"{results['prefork']['parent']['pss'] / 2**20:.0f} MB PSS")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""Hot reload of the model artifact without restarting the app or API.
+
+A LiveModel holds the current Deployment: the compiled scorer, the artifact's
+version and when it was loaded. Deployments are never modified, so a scan
+reads LiveModel.current once and finishes on that model even if a new one is
+swapped in halfway through; the swap itself is a single attribute
+assignment.
+
+ModelWatcher polls the artifact file in a background thread. When the file
+changes and has stopped changing, it loads the new version off the request
+path, warms it with a first prediction, and runs a sanity check on a fixed
+probe set before swapping it in:
+
+  - probabilities have the expected shape, are finite and sum to 1
+  - the model does not give every probe row the same label
+  - at least MIN_PROBE_AGREEMENT of the probe labels agree with the current
+    model, which catches e.g. an artifact trained with the opposite label
+    convention (class 0 is malaria here)
+
+A version that fails the check is logged and not retried until the file
+changes again. LiveModel keeps the last KEEP_PREVIOUS deployments it
+replaced in memory, so rollback() is instant; a version rolled back from is not
+reloaded by the watcher until the file changes again.
+
+Configuration: MALARIA_RELOAD_INTERVAL (seconds between polls, default 5;
+0 turns the watcher off) and MALARIA_RELOAD_MIN_AGREEMENT (default 0.5).
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import malaria_metrics as metrics
+from malaria_artifacts import MODEL_PATH, load_pipeline, model_version
+from malaria_encoder import compile_scorer
+from malaria_scoring import MALARIA, labels_from_proba, random_inputs, score
+
+RELOAD_INTERVAL = float(os.environ.get('MALARIA_RELOAD_INTERVAL', 5))
+MIN_PROBE_AGREEMENT = float(os.environ.get('MALARIA_RELOAD_MIN_AGREEMENT', 0.5))
+KEEP_PREVIOUS = 2
+PROBE_ROWS = 512
+PROBE_SEED = 19
+
+Deployment = namedtuple('Deployment', ['model', 'version', 'path', 'loaded_at'])
+
+# Deployments loaded by preload(), by absolute path
+_preloaded = {}
+
+
+class ReloadError(Exception):
+    """A new artifact could not be loaded or failed its sanity check."""
+
+
+def load_deployment(path=MODEL_PATH, warm=True):
+    """Load, compile and (unless warm is False) warm the artifact at path."""
+    version = model_version(path)
+    with metrics.span('model_load'):
+        model = compile_scorer(load_pipeline(path))
+    if warm:
+        score(model, random_inputs(1))
+    if model_version(path) != version:
+        raise ReloadError(f"{path} changed while it was being loaded")
+    return Deployment(model, version, path, time.time())
+
+
+def probe_inputs():
+    """The fixed probe set every new model is checked on."""
+    return random_inputs(PROBE_ROWS, seed=PROBE_SEED)
+
+
+def sanity_check(candidate, current=None, probe=None, min_agreement=MIN_PROBE_AGREEMENT):
+    """Raise ReloadError if candidate's probe predictions look wrong.
+
+    Returns the fraction of probe labels that agree with current (None
+    without a current deployment).
+    """
+    probe = probe_inputs() if probe is None else probe
+    _, proba = score(candidate.model, probe)
+    if proba.shape != (len(probe), 2):
+        raise ReloadError(f"predict_proba returned shape {proba.shape}, expected {(len(probe), 2)}")
+    if not np.isfinite(proba).all() or np.abs(proba.sum(axis=1) - 1).max() > 1e-4:
+        raise ReloadError("probabilities are not finite or do not sum to 1")
+    labels = labels_from_proba(proba)
+    if (labels == labels[0]).all():
+        raise ReloadError(f"every probe row gets the same label ({labels[0]})")
+    if current is None:
+        return None
+
+    _, current_proba = score(current.model, probe)
+    agreement = float((labels == labels_from_proba(current_proba)).mean())
+    if agreement < min_agreement:
+        raise ReloadError(
+            f"only {agreement:.1%} of probe labels agree with version {current.version} "
+            f"(mean malaria probability {proba[:, MALARIA].mean():.3f} versus "
+            f"{current_proba[:, MALARIA].mean():.3f})")
+    return agreement
+
+
+class LiveModel:
+    """The deployment currently serving predictions, swappable at any time."""
+
+    def __init__(self, deployment=None, keep=KEEP_PREVIOUS):
+        self.current = deployment
+        self.keep = keep
+        # Up to keep older deployments, most recent last, for rollback and
+        # for looking up the model a cached result was computed with
+        self.previous = []
+        # Versions the watcher must not deploy: failed checks and rollbacks
+        self.blocked = set()
+        self.last_error = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        if deployment is not None:
+            metrics.set_model_version(deployment.version)
+
+    def add_listener(self, callback):
+        """Call callback(deployment) after every swap."""
+        self._listeners.append(callback)
+
+    def get(self, version):
+        """The retained deployment of version, or None."""
+        for deployment in [self.current, *self.previous]:
+            if deployment is not None and deployment.version == version:
+                return deployment
+        return None
+
+    def swap(self, deployment):
+        """Make deployment current; returns the one it replaced."""
+        with self._lock:
+            old = self.current
+            if old is not None and old.version != deployment.version:
+                previous = [d for d in self.previous if d.version != deployment.version] + [old]
+                self.previous = previous[-self.keep:]
+            self.current = deployment
+        metrics.set_model_version(deployment.version)
+        metrics.inc('model_swaps_total')
+        for callback in self._listeners:
+            callback(deployment)
+        return old
+
+    def deploy(self, deployment, check=True):
+        """Sanity-check deployment against the current one, then swap it in."""
+        if check:
+            sanity_check(deployment, self.current)
+        return self.swap(deployment)
+
+    def rollback(self):
+        """Swap back to the previous deployment and block the current version.
+
+        Returns the deployment now serving, or None if there is nothing to
+        roll back to.
+        """
+        with self._lock:
+            if not self.previous:
+                return None
+            target = self.previous.pop()
+            self.blocked.add(self.current.version)
+            self.current, replaced = target, self.current
+            self.previous = [d for d in self.previous if d.version != replaced.version]
+        metrics.set_model_version(target.version)
+        metrics.inc('model_rollbacks_total')
+        for callback in self._listeners:
+            callback(target)
+        return target
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class ModelWatcher:
+    """Poll an artifact file and deploy new versions into a LiveModel."""
+
+    def __init__(self, live, path=MODEL_PATH, interval=RELOAD_INTERVAL):
+        self.live = live
+        self.path = path
+        self.interval = interval
+        self._seen = _signature(path)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='model-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.live.last_error = f"{type(e).__name__}: {e}"
+
+    def poll(self):
+        """Deploy the artifact if it changed and settled since the last poll.
+
+        Returns the new Deployment, or None if nothing was deployed.
+        """
+        signature = _signature(self.path)
+        if signature is None or signature == self._seen:
+            return None
+        # Wait for writers to finish: the file must look the same twice in a row
+        time.sleep(min(self.interval, 1.0))
+        if _signature(self.path) != signature:
+            return None
+        self._seen = signature
+        return self.reload()
+
+    def reload(self, force=False):
+        """Load and deploy the artifact now, unless it is already current or blocked.
+
+        force=True also deploys a blocked version, e.g. to undo a rollback.
+        """
+        self.live.last_error = None
+        version = model_version(self.path)
+        current = self.live.current
+        if current is not None and version == current.version:
+            return None
+        if version in self.live.blocked:
+            if not force:
+                return None
+            self.live.blocked.discard(version)
+        try:
+            deployment = load_deployment(self.path)
+            self.live.deploy(deployment)
+        except Exception as e:
+            self.live.blocked.add(version)
+            self.live.last_error = f"version {version}: {e}"
+            metrics.inc('model_reload_failures_total')
+            return None
+        return deployment
+
+
+def preload(path=MODEL_PATH):
+    """Load path now, for start_live_model() in this process or ones forked from it to reuse.
+
+    The model is not warmed: a prediction would start XGBoost's OpenMP
+    thread pool, which does not survive os.fork(), and a forked worker
+    could hang on its own first prediction.
+    """
+    _preloaded[os.path.abspath(path)] = load_deployment(path, warm=False)
+
+
+def start_live_model(path=MODEL_PATH, interval=RELOAD_INTERVAL):
+    """Load path into a LiveModel and, unless interval is 0, start watching it.
+
+    A deployment from preload() is used as is if the file hasn't changed
+    since. Returns (live, watcher or None).
+    """
+    deployment = _preloaded.get(os.path.abspath(path))
+    if deployment is None or model_version(path) != deployment.version:
+        deployment = load_deployment(path)
+    live = LiveModel(deployment)
+    watcher = ModelWatcher(live, path, interval).start() if interval > 0 else None
+    return live, watcher
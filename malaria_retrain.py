@@ -0,0 +1,256 @@
+"""Incremental retraining from confirmed outcomes.
+
+As microscopy or RDT results come back for scored patients, they can be
+used to update the model without retraining it from scratch. retrain()
+keeps the current pipeline's fitted preprocessing as is, so categories
+encode exactly as before, and continues boosting from its booster on the
+new labeled rows with XGBoost's multi-threaded histogram tree method:
+
+  1. read the labeled file (the 21 inputs plus a label column, see
+     malaria_scoring.read_labeled), skipping invalid or unlabeled rows
+  2. hold out a stratified share of it for validation, and split a
+     further share of the remaining training rows off for early stopping
+  3. add up to --rounds trees, stopping early when the log loss on the
+     early-stopping rows stops improving, and keep the best round
+  4. compare the holdout log loss, ROC-AUC and accuracy of the current and
+     the updated model, and keep the update only if its log loss is no
+     worse (unless --force), and if it passes the hot-reload sanity check
+     against the current model (see malaria_reload); training never sees
+     the holdout, not even to pick the round, so these numbers are not
+     biased in the update's favour
+  5. write the updated pipeline to a new versioned artifact,
+     <out-dir>/malaria_model-<date>-<version>.joblib, with a JSON file of
+     its lineage and metrics and a drift reference profile built from the
+     labeled rows (see malaria_drift)
+
+    python malaria_retrain.py confirmed.csv --rounds 50 --out-dir models
+
+--deploy then copies the artifact and its drift profile over the serving
+model file (MALARIA_MODEL_PATH), which the app and API pick up with their
+hot-reload watcher. Wall-clock time per step and the peak memory of the
+process are printed at the end.
+"""
+import argparse
+import copy
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import joblib
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import log_loss, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from malaria_artifacts import MODEL_PATH, model_version, read_pipeline
+from malaria_drift import build_reference, reference_path_for, save_reference
+from malaria_reload import Deployment, ReloadError, sanity_check
+from malaria_scoring import DECISION_THRESHOLD, LABEL_COLUMN, MALARIA, labels_from_proba, read_labeled
+
+ROUNDS = 50
+LEARNING_RATE = 0.05
+HOLDOUT = 0.2
+# Share of the training rows (after the holdout) used to pick the best round
+EARLY_STOPPING_SHARE = 0.1
+EARLY_STOPPING_ROUNDS = 10
+OUT_DIR = 'models'
+
+
+class RetrainError(Exception):
+    """The updated model was not kept."""
+
+
+def peak_memory_bytes():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def holdout_metrics(proba, labels, threshold=DECISION_THRESHOLD):
+    """Log loss, ROC-AUC (of malaria) and accuracy of predict_proba rows against class indices."""
+    return {
+        'log_loss': float(log_loss(labels, proba, labels=[0, 1])),
+        'roc_auc': float(roc_auc_score(labels == MALARIA, proba[:, MALARIA])) if len(set(labels)) == 2 else None,
+        'accuracy': float((labels_from_proba(proba, threshold) == labels).mean()),
+    }
+
+
+def continue_training(pipeline, train, train_labels, early_stop, early_stop_labels, rounds=ROUNDS,
+                      learning_rate=LEARNING_RATE, nthread=None, early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    """A copy of pipeline whose booster has up to rounds more trees fitted on train.
+
+    The round is picked by the log loss on early_stop, which should not be
+    the rows the result is then evaluated on. The label is the class index,
+    so the booster keeps predicting the probability of class 1 (no
+    malaria). Returns (pipeline, trees added).
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    classifier = pipeline.named_steps['classifier']
+    booster = classifier.get_booster()
+    start_rounds = booster.num_boosted_rounds()
+
+    params = {
+        'objective': 'binary:logistic',
+        'tree_method': 'hist',
+        'nthread': nthread or os.cpu_count() or 1,
+        'eta': learning_rate,
+        'max_depth': classifier.get_params().get('max_depth') or 6,
+        'eval_metric': 'logloss',
+        'seed': 0,
+    }
+    dtrain = xgb.QuantileDMatrix(preprocessor.transform(train), label=train_labels)
+    dearly_stop = xgb.DMatrix(preprocessor.transform(early_stop), label=early_stop_labels)
+    updated = xgb.train(params, dtrain, num_boost_round=rounds, xgb_model=booster.copy(),
+                        evals=[(dearly_stop, 'early_stop')], early_stopping_rounds=early_stopping_rounds,
+                        verbose_eval=False)
+    best = getattr(updated, 'best_iteration', None)
+    if best is not None and best + 1 < updated.num_boosted_rounds():
+        updated = updated[:best + 1]
+
+    new_pipeline = copy.deepcopy(pipeline)
+    new_classifier = new_pipeline.named_steps['classifier']
+    new_classifier._Booster = updated
+    new_classifier.set_params(n_estimators=updated.num_boosted_rounds())
+    return new_pipeline, updated.num_boosted_rounds() - start_rounds
+
+
+def write_artifact(pipeline, out_dir, metadata):
+    """Save pipeline as a new versioned artifact in out_dir; returns its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.joblib', dir=out_dir)
+    os.close(fd)
+    try:
+        joblib.dump(pipeline, tmp)
+        version = model_version(tmp)
+        path = os.path.join(out_dir, f"malaria_model-{time.strftime('%Y%m%d-%H%M%S')}-{version}.joblib")
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump({**metadata, 'version': version}, f, indent=2)
+    return path
+
+
+def deploy(path, model_path=MODEL_PATH):
+    """Replace the serving artifact (and its drift profile) with path, atomically."""
+    for source, target in [(reference_path_for(path), reference_path_for(model_path)), (path, model_path)]:
+        if not os.path.exists(source):
+            continue
+        tmp = f"{target}.tmp"
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+
+
+def retrain(labeled_path, model_path=MODEL_PATH, out_dir=OUT_DIR, label_column=LABEL_COLUMN, rounds=ROUNDS,
+            learning_rate=LEARNING_RATE, holdout=HOLDOUT, nthread=None, force=False, seed=0):
+    """Continue training the model at model_path on labeled_path and write the result to out_dir.
+
+    Returns a report dict with the new artifact's path, the holdout metrics
+    of both models and the time each step took. Raises RetrainError if the
+    update is worse on the holdout (and force is not set) or fails the
+    sanity check, and ValueError if the file has too few usable rows.
+    """
+    timings = {}
+    start = time.perf_counter()
+    features, labels, skipped = read_labeled(labeled_path, label_column)
+    if len(features) < 20 or len(np.unique(labels)) < 2:
+        raise ValueError(f"{len(features)} usable labeled rows with {len(np.unique(labels))} classes; "
+                         f"need at least 20 rows covering both")
+    train, test, train_labels, test_labels = train_test_split(
+        features, labels, test_size=holdout, stratify=labels, random_state=seed)
+    train, early_stop, train_labels, early_stop_labels = train_test_split(
+        train, train_labels, test_size=EARLY_STOPPING_SHARE, stratify=train_labels, random_state=seed)
+    timings['read_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    current = read_pipeline(model_path)
+    timings['load_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    updated, added = continue_training(current, train, train_labels, early_stop, early_stop_labels, rounds,
+                                       learning_rate, nthread)
+    timings['train_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    before = holdout_metrics(current.predict_proba(test), test_labels)
+    after = holdout_metrics(updated.predict_proba(test), test_labels)
+    report = {
+        'parent_version': model_version(model_path),
+        'labeled_file': os.path.abspath(labeled_path),
+        'rows': {'train': len(train), 'early_stopping': len(early_stop), 'holdout': len(test), 'skipped': skipped},
+        'trees_added': added,
+        'learning_rate': learning_rate,
+        'holdout': {'current': before, 'updated': after},
+    }
+    if after['log_loss'] > before['log_loss'] and not force:
+        raise RetrainError(f"holdout log loss got worse: {before['log_loss']:.4f} -> {after['log_loss']:.4f}")
+    try:
+        sanity_check(Deployment(updated, 'updated', None, 0.0),
+                     Deployment(current, report['parent_version'], None, 0.0))
+    except ReloadError as e:
+        raise RetrainError(f"the updated model failed the reload sanity check: {e}") from e
+    timings['validate_s'] = time.perf_counter() - start
+
+    report['timings'] = timings
+    start = time.perf_counter()
+    path = write_artifact(updated, out_dir, report)
+    version = model_version(path)
+    save_reference(build_reference(features, updated.predict_proba(features)[:, MALARIA], version),
+                   reference_path_for(path))
+    timings['write_s'] = time.perf_counter() - start
+
+    report.update(path=path, version=version, peak_memory_bytes=peak_memory_bytes())
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Continue training the malaria model on newly confirmed outcomes.")
+    parser.add_argument("input", help="CSV, Parquet or Excel file with the 21 inputs and a label column")
+    parser.add_argument("--model", default=os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH))
+    parser.add_argument("--out-dir", default=OUT_DIR, help="Directory for the new artifact")
+    parser.add_argument("--label-column", default=LABEL_COLUMN,
+                        help="'Malaria'/'No Malaria', or 0 for malaria and 1 for no malaria")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="Most trees to add")
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument("--holdout", type=float, default=HOLDOUT, help="Share of rows held out for validation")
+    parser.add_argument("--threads", type=int, help="Training threads (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action='store_true', help="Keep the update even if the holdout got worse")
+    parser.add_argument("--deploy", action='store_true', help="Copy the new artifact over --model")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    start = time.perf_counter()
+    try:
+        report = retrain(args.input, args.model, args.out_dir, args.label_column, args.rounds, args.learning_rate,
+                         args.holdout, args.threads, args.force, args.seed)
+    except (ValueError, RetrainError) as e:
+        print(f"Not retrained: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+
+    rows = report['rows']
+    print(f"Added {report['trees_added']} trees to {report['parent_version']} on {rows['train']:,} rows "
+          f"({rows['skipped']:,} skipped), stopped early on {rows['early_stopping']:,}, "
+          f"validated on {rows['holdout']:,}")
+    for name in ('log_loss', 'roc_auc', 'accuracy'):
+        before, after = report['holdout']['current'][name], report['holdout']['updated'][name]
+        if before is not None:
+            print(f"  holdout {name:<9} {before:.4f} -> {after:.4f}")
+    print(f"Wrote version {report['version']} to {report['path']}")
+    print("Time: " + ", ".join(f"{name[:-2]} {seconds:.2f}s" for name, seconds in report['timings'].items())
+          + f"; total {elapsed:.2f}s. Peak memory {report['peak_memory_bytes'] / 2**20:.0f} MB")
+    if args.deploy:
+        deploy(report['path'], args.model)
+        print(f"Deployed to {args.model}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Reference ranges, risk factors and recommendations as one rule table.
+
+Each Rule is a condition on one input column (`column op value`). A row that
+meets it can add to the risk score (weight), be listed as a risk factor
+(factor), raise a note next to the indicator on the Health Dashboard
+(alert) and trigger a recommendation (advice), either for every row or only
+for rows with a given prediction (when).
+
+assess() evaluates the whole table over any number of rows with one NumPy
+comparison per rule, so the Health Dashboard, the Recommendations page and
+batch scoring all render the same results.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from malaria_scoring import FEATURE_COLUMNS, MALARIA, NO_MALARIA
+
+# Normal adult ranges (low, high) shown on the Health Dashboard
+REFERENCE_RANGES = {
+    'rbc_count': (4.0, 5.5),
+    'hb_level': (12.0, 16.0),
+    'platelet_count': (150.0, 400.0),
+    'wbc_count': (4.0, 11.0),
+    'temperature': (36.1, 37.2),
+}
+
+# Minimum risk score of each level, highest first; anything lower is Low
+RISK_LEVELS = [(8, "High"), (4, "Moderate")]
+DEFAULT_RISK_LEVEL = "Low"
+
+# alert is (box style, message); advice is (title, message), title None for
+# the short notes shown under an urgent malaria result
+Rule = namedtuple(
+    'Rule', ['code', 'column', 'op', 'value', 'weight', 'factor', 'alert', 'advice', 'when'],
+    defaults=[0, None, None, None, None],
+)
+
+_LOW = {col: low for col, (low, _) in REFERENCE_RANGES.items()}
+_HIGH = {col: high for col, (_, high) in REFERENCE_RANGES.items()}
+
+# Listed in the order the Health Dashboard has always shown risk factors:
+# exposure first, then lab findings
+RULES = [
+    Rule('FEVER_SYMPTOMS', 'fever_symptom', '==', 'Yes', weight=3, factor="Fever symptoms present"),
+    Rule('NO_BEDNET', 'bednet', '==', 'No', weight=2, factor="No bed net protection",
+         advice=("🛏️ Use Bed Nets", "You indicated no bed net usage. This is crucial for malaria prevention. "
+                 "Obtain and use insecticide-treated bed nets immediately."),
+         when=NO_MALARIA),
+    Rule('RURAL', 'location', '==', 'Rural', weight=1, factor="Rural location (higher mosquito exposure)"),
+    Rule('LOW_RBC', 'rbc_count', '<', _LOW['rbc_count'], weight=2, factor="Low RBC count",
+         alert=('warning', "⚠️ Low RBC count detected. This may indicate anemia, which is common in "
+                           "malaria infections.")),
+    Rule('HIGH_RBC', 'rbc_count', '>', _HIGH['rbc_count'],
+         alert=('info', "ℹ️ Elevated RBC count detected. This may indicate dehydration or other conditions.")),
+    Rule('LOW_HB', 'hb_level', '<', _LOW['hb_level'], weight=2, factor="Low hemoglobin",
+         alert=('warning', "⚠️ Low hemoglobin detected. This is a key indicator of anemia and potential "
+                           "malaria infection."),
+         advice=("🍎 Address Mild Anemia", "Your hemoglobin is slightly low. Consider iron-rich foods (spinach, "
+                 "red meat, beans) and consult a healthcare provider about iron supplements."),
+         when=NO_MALARIA),
+    Rule('SEVERE_ANEMIA', 'hb_level', '<', 10.0,
+         advice=(None, "⚠️ Severe anemia detected. This requires immediate medical intervention."),
+         when=MALARIA),
+    Rule('LOW_PLATELETS', 'platelet_count', '<', _LOW['platelet_count'], weight=2, factor="Low platelet count",
+         alert=('warning', "⚠️ Low platelet count (thrombocytopenia) detected. This is commonly associated "
+                           "with malaria infections."),
+         advice=("🩸 Monitor Platelet Count", "Your platelet count is below normal. Follow up with your "
+                 "healthcare provider to determine the cause and appropriate treatment."),
+         when=NO_MALARIA),
+    Rule('SEVERE_THROMBOCYTOPENIA', 'platelet_count', '<', 100.0,
+         advice=(None, "⚠️ Severe thrombocytopenia detected. Risk of bleeding complications - seek "
+                       "immediate care."),
+         when=MALARIA),
+    Rule('LOW_WBC', 'wbc_count', '<', _LOW['wbc_count'],
+         alert=('warning', "⚠️ Low WBC count detected. This may indicate immune system suppression."),
+         advice=("🛡️ Boost Immune System", "Your white blood cell count is low. Focus on a healthy diet, "
+                 "adequate sleep, regular exercise, and stress management."),
+         when=NO_MALARIA),
+    Rule('HIGH_WBC', 'wbc_count', '>', _HIGH['wbc_count'],
+         alert=('info', "ℹ️ Elevated WBC count detected. This may indicate an active infection or immune "
+                        "response.")),
+    Rule('FEVER', 'temperature', '>', _HIGH['temperature'], weight=3, factor="Elevated temperature",
+         alert=('warning', "⚠️ Fever detected. This is a primary symptom of malaria and requires immediate "
+                           "attention.")),
+    Rule('MILD_FEVER', 'temperature', '>', 37.5,
+         advice=("🌡️ Monitor Temperature", "You have a mild fever. Rest, stay hydrated, and monitor for other "
+                 "symptoms. Seek medical care if fever persists or worsens."),
+         when=NO_MALARIA),
+    Rule('HIGH_FEVER', 'temperature', '>', 38.5,
+         advice=(None, "⚠️ High fever detected. Use cooling measures and fever reducers while seeking "
+                       "medical care."),
+         when=MALARIA),
+]
+
+MAX_RISK_SCORE = sum(rule.weight for rule in RULES)
+
+# The order the Recommendations page has always listed advice in, which
+# differs from the risk factor order above
+ADVICE_ORDER = [
+    'HIGH_FEVER', 'SEVERE_ANEMIA', 'SEVERE_THROMBOCYTOPENIA',
+    'LOW_HB', 'LOW_PLATELETS', 'LOW_WBC', 'MILD_FEVER', 'NO_BEDNET',
+]
+
+_OPS = {'<': np.less, '>': np.greater, '==': np.equal}
+_WEIGHTS = np.array([rule.weight for rule in RULES], dtype=np.int64)
+_ADVICE_INDEX = [[rule.code for rule in RULES].index(code) for code in ADVICE_ORDER]
+assert sorted(RULES[j].code for j in _ADVICE_INDEX) == sorted(rule.code for rule in RULES if rule.advice)
+
+
+class RiskAssessment:
+    """The rule table evaluated over a batch of rows.
+
+    flags is a (rows, rules) boolean matrix in RULES order and advised the
+    subset of it whose advice applies to each row's prediction. score and
+    level are per-row arrays; status maps each REFERENCE_RANGES column to
+    "Low", "Normal", "High" or "Unknown" (missing) per row.
+    """
+
+    def __init__(self, flags, advised, score, level, status):
+        self.flags = flags
+        self.advised = advised
+        self.score = score
+        self.level = level
+        self.status = status
+
+    def __len__(self):
+        return len(self.score)
+
+    def factors(self, row):
+        """Risk factor descriptions for one row."""
+        return [rule.factor for rule, hit in zip(RULES, self.flags[row]) if hit and rule.factor]
+
+    def alerts(self, row, column=None):
+        """Rules with a dashboard alert that fired for one row, optionally for one column."""
+        return [
+            rule for rule, hit in zip(RULES, self.flags[row])
+            if hit and rule.alert and (column is None or rule.column == column)
+        ]
+
+    def recommendations(self, row):
+        """Rules whose advice applies to one row, in ADVICE_ORDER."""
+        return [RULES[j] for j in _ADVICE_INDEX if self.advised[row, j]]
+
+    def recommendation_codes(self):
+        """Per row, the codes of the applicable recommendations in ADVICE_ORDER, joined with ';'."""
+        codes = np.array(ADVICE_ORDER, dtype=object)
+        return [";".join(codes[row]) for row in self.advised[:, _ADVICE_INDEX]]
+
+
+def _column(features, col, numeric):
+    values = features[col]
+    if numeric:
+        return np.asarray(values, dtype=np.float64)
+    return np.asarray(values, dtype=object)
+
+
+def assess(features, prediction=None, columns=FEATURE_COLUMNS):
+    """Evaluate RULES over every row of features.
+
+    features is a DataFrame, a dict of columns or a 2-D array whose columns
+    are in the order of columns. prediction holds the class of each row;
+    without it no prediction-specific advice applies.
+    """
+    if isinstance(features, np.ndarray):
+        features = dict(zip(columns, features.T))
+    values = {}
+    for rule in RULES:
+        if rule.column not in values:
+            values[rule.column] = _column(features, rule.column, not isinstance(rule.value, str))
+    n_rows = len(next(iter(values.values())))
+
+    flags = np.empty((n_rows, len(RULES)), dtype=bool)
+    for j, rule in enumerate(RULES):
+        flags[:, j] = _OPS[rule.op](values[rule.column], rule.value)
+
+    applies = np.zeros_like(flags)
+    if prediction is not None:
+        prediction = np.asarray(prediction)
+    for j, rule in enumerate(RULES):
+        if rule.advice is None:
+            continue
+        if rule.when is None:
+            applies[:, j] = True
+        elif prediction is not None:
+            applies[:, j] = prediction == rule.when
+    advised = flags & applies
+
+    score = flags @ _WEIGHTS
+    level = np.select([score >= minimum for minimum, _ in RISK_LEVELS],
+                      [name for _, name in RISK_LEVELS], default=DEFAULT_RISK_LEVEL)
+
+    status = {}
+    for col, (low, high) in REFERENCE_RANGES.items():
+        column = values[col] if col in values else _column(features, col, True)
+        status[col] = np.select(
+            [column < low, column > high, (column >= low) & (column <= high)],
+            ["Low", "High", "Normal"], default="Unknown")
+
+    return RiskAssessment(flags, advised, score, level, status)
@@ -0,0 +1,239 @@
+"""Input schema of a malaria scan, and its compiled validator.
+
+FIELDS is the one place the scan inputs are described: the form label,
+range, default and step of every numeric field and the options of every
+categorical one. The AI Scan form is built from it, and batch and API rows
+are checked against it by SchemaValidator, which compiles the schema into
+NumPy arrays once and then validates a whole chunk with a few column-wide
+masks:
+
+    missing:<field>        no value, or an empty string
+    not_numeric:<field>    a numeric field that cannot be read as a number
+    out_of_range:<field>   a number outside the field's range
+    unknown:<field>        a categorical value that is not one of its options
+    not_scalar:<field>     a categorical value that is a list, mapping or other
+                           unhashable object (e.g. a JSON array or object)
+    differential_sum       neutrophils + lymphocytes + mixed cells % is more
+                           than DIFFERENTIAL_TOLERANCE away from 100
+
+Rows that fail any check are quarantined with their reasons instead of
+being scored, so one bad row never fails a whole file or request.
+
+A single row whose categoricals are strings and whose numerics are numbers,
+as the scan form and most API records send them, is checked value by value
+instead: building the masks costs several times what scoring one row does.
+"""
+from collections import namedtuple
+from collections.abc import Hashable
+from numbers import Real
+
+import numpy as np
+import pandas as pd
+
+Field = namedtuple('Field', ['name', 'label', 'low', 'high', 'default', 'step', 'options'],
+                   defaults=[None, None, None, None, None, None])
+
+# In the order the scan form builds them
+FIELDS = [
+    Field('location', "Location", options=["Urban", "Rural", "Suburban"]),
+    Field('bednet', "Bed Net Usage", options=["Yes", "No"]),
+    Field('fever_symptom', "Fever Symptoms", options=["Yes", "No"]),
+    Field('temperature', "Temperature (°C)", 20.0, 50.0, 37.0, 0.1),
+    Field('wbc_count', "WBC Count (×10⁹/L)", 2.0, 40.0, 7.0, 0.1),
+    Field('rbc_count', "RBC Count (×10¹²/L)", 1.0, 10.0, 4.5, 0.1),
+    Field('hb_level', "Hemoglobin (g/dL)", 5.0, 20.0, 12.0, 0.1),
+    Field('hematocrit', "Hematocrit (%)", 10.0, 90.0, 40.0, 0.1),
+    Field('mean_cell_volume', "Mean Cell Volume (fL)", 10.0, 200.0, 85.0, 0.1),
+    Field('mean_corp_hb', "Mean Corpuscular Hb (pg)", 10.0, 60.0, 30.0, 0.1),
+    Field('mean_cell_hb_conc', "Mean Cell Hb Concentration (g/dL)", 20.0, 60.0, 33.0, 0.1),
+    Field('platelet_count', "Platelet Count (×10⁹/L)", 50.0, 550.0, 250.0, 1.0),
+    Field('platelet_distr_width', "Platelet Distribution Width", 3.0, 30.0, 12.0, 0.1),
+    Field('mean_platelet_vl', "Mean Platelet Volume (fL)", 6.0, 15.0, 9.0, 0.1),
+    Field('neutrophils_percent', "Neutrophils (%)", 10.0, 90.0, 60.0, 0.1),
+    Field('lymphocytes_percent', "Lymphocytes (%)", 10.0, 60.0, 30.0, 0.1),
+    Field('mixed_cells_percent', "Mixed Cells (%)", 1.0, 30.0, 8.0, 0.1),
+    Field('neutrophils_count', "Neutrophils Count (×10⁹/L)", 1.0, 15.0, 4.0, 0.1),
+    Field('lymphocytes_count', "Lymphocytes Count (×10⁹/L)", 0.5, 12.0, 2.0, 0.1),
+    Field('mixed_cells_count', "Mixed Cells Count (×10⁹/L)", 0.1, 2.0, 0.5, 0.1),
+    Field('RBC_dist_width_Percent', "RBC Distribution Width (%)", 4.0, 20.0, 13.0, 0.1),
+]
+SCHEMA = {field.name: field for field in FIELDS}
+
+# The white cell differential percentages should add up to 100, give or
+# take rounding and the cells the analyser could not classify
+DIFFERENTIAL = ['neutrophils_percent', 'lymphocytes_percent', 'mixed_cells_percent']
+DIFFERENTIAL_TOLERANCE = 5.0
+
+REASONS_COLUMN = 'rejection_reasons'
+
+
+class Validation:
+    """Outcome of SchemaValidator.validate() for one chunk."""
+
+    def __init__(self, features, failed, checks):
+        self.features = features
+        self.failed = failed
+        self.checks = checks
+        self.valid = ~failed.any(axis=1)
+
+    def reasons(self):
+        """Per row, the failed check codes joined with '; ' ('' for valid rows)."""
+        out = np.full(len(self.failed), '', dtype=object)
+        seen = np.zeros(len(self.failed), dtype=bool)
+        for j in np.flatnonzero(self.failed.any(axis=0)):
+            column = self.failed[:, j]
+            out[column & seen] += '; '
+            out[column] += self.checks[j]
+            seen |= column
+        return out
+
+    def counts(self):
+        """Number of rows failing each check, for the checks that failed at all."""
+        totals = self.failed.sum(axis=0)
+        return {self.checks[j]: int(totals[j]) for j in np.flatnonzero(totals)}
+
+
+class SchemaValidator:
+    """FIELDS compiled into the arrays validate() compares whole chunks against."""
+
+    def __init__(self, fields=FIELDS, tolerance=DIFFERENTIAL_TOLERANCE):
+        self.columns = [field.name for field in fields]
+        self.categorical = [(field.name, list(field.options)) for field in fields if field.options is not None]
+        numeric = [field for field in fields if field.options is None]
+        self.numeric = [field.name for field in numeric]
+        self.low = np.array([field.low for field in numeric], dtype=np.float64)
+        self.high = np.array([field.high for field in numeric], dtype=np.float64)
+        self.differential = [self.numeric.index(col) for col in DIFFERENTIAL if col in self.numeric]
+        self.tolerance = tolerance
+
+        categorical = [col for col, _ in self.categorical]
+        self.checks = [
+            *[f'missing:{col}' for col in categorical],
+            *[f'unknown:{col}' for col in categorical],
+            *[f'not_scalar:{col}' for col in categorical],
+            *[f'missing:{col}' for col in self.numeric],
+            *[f'not_numeric:{col}' for col in self.numeric],
+            *[f'out_of_range:{col}' for col in self.numeric],
+        ]
+        if len(self.differential) == len(DIFFERENTIAL):
+            self.checks.append('differential_sum')
+        self._check_index = {check: j for j, check in enumerate(self.checks)}
+
+    def validate(self, chunk):
+        """Check every row of chunk; returns a Validation.
+
+        Its features are chunk restricted to the schema's columns, with
+        categoricals stripped and numerics coerced to float (unreadable
+        values become NaN). Raises ValueError if a column is missing
+        altogether, since then no row can be scored.
+        """
+        missing = [c for c in self.columns if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        if len(chunk) == 1:
+            validation = self._validate_row(chunk)
+            if validation is not None:
+                return validation
+
+        n_rows = len(chunk)
+        columns = {}
+        cat_missing = np.empty((n_rows, len(self.categorical)), dtype=bool, order='F')
+        cat_unknown = np.empty_like(cat_missing)
+        cat_not_scalar = np.zeros_like(cat_missing)
+        for j, (col, options) in enumerate(self.categorical):
+            # Categoricals have a handful of distinct values, so clean those
+            # and map the results back to the rows through the codes
+            raw_values = chunk[col].to_numpy(dtype=object)
+            try:
+                codes, uniques = pd.factorize(raw_values)
+            except TypeError:
+                # A list or dict (a JSON array or object) can't be factorized;
+                # blank those rows out and reject them for it
+                cat_not_scalar[:, j] = [not isinstance(value, Hashable) for value in raw_values]
+                codes, uniques = pd.factorize(np.where(cat_not_scalar[:, j], None, raw_values))
+            cleaned = np.array([*(str(value).strip() for value in uniques), ''], dtype=object)
+            blank = cleaned == ''
+            unknown = ~blank & ~np.isin(cleaned, options)
+            cat_missing[:, j] = blank[codes] & ~cat_not_scalar[:, j]
+            cat_unknown[:, j] = unknown[codes]
+            columns[col] = cleaned[codes]
+
+        raw = chunk[self.numeric]
+        values = np.empty((n_rows, len(self.numeric)), dtype=np.float64, order='F')
+        is_number = np.array([dtype.kind in 'biuf' for dtype in raw.dtypes], dtype=bool)
+        if is_number.any():
+            values[:, is_number] = raw.iloc[:, is_number].to_numpy(dtype=np.float64, na_value=np.nan)
+        raw_missing = np.isnan(values, where=is_number, out=np.zeros_like(values, dtype=bool))
+        # Columns read as text (e.g. with a stray "n/a") are parsed one by one
+        for j in np.flatnonzero(~is_number):
+            column = raw.iloc[:, j]
+            values[:, j] = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            raw_missing[:, j] = column.isna().to_numpy()
+            # Only values that failed to parse can be blank strings
+            unparsed = np.isnan(values[:, j]) & ~raw_missing[:, j]
+            if unparsed.any():
+                raw_missing[unparsed, j] = (column[unparsed].astype(str).str.strip() == '').to_numpy()
+        for j, col in enumerate(self.numeric):
+            columns[col] = values[:, j]
+        features = pd.DataFrame(columns, index=chunk.index, columns=self.columns)
+
+        unreadable = np.isnan(values)
+        out_of_range = ~unreadable & ((values < self.low) | (values > self.high))
+
+        blocks = [cat_missing, cat_unknown, cat_not_scalar, raw_missing, unreadable & ~raw_missing, out_of_range]
+        if 'differential_sum' in self.checks:
+            # NaN when a percentage is missing, which that row is rejected for already
+            total = values[:, self.differential].sum(axis=1)
+            blocks.append((np.abs(total - 100) > self.tolerance)[:, None])
+        return Validation(features, np.hstack(blocks), self.checks)
+
+    def _validate_row(self, chunk):
+        """validate() for a one-row chunk, with the same result, checked value by value.
+
+        Returns None when a value is neither a string categorical nor a
+        numeric number, which validate() then handles column-wide.
+        """
+        row = dict(zip(chunk.columns, chunk.iloc[0].tolist()))
+        dtypes = chunk.dtypes
+        failed = np.zeros((1, len(self.checks)), dtype=bool)
+        cleaned = {}
+        for col, options in self.categorical:
+            value = row[col]
+            if not isinstance(value, str):
+                return None
+            cleaned[col] = value.strip()
+            if not cleaned[col]:
+                failed[0, self._check_index[f'missing:{col}']] = True
+            elif cleaned[col] not in options:
+                failed[0, self._check_index[f'unknown:{col}']] = True
+        values = []
+        for col, low, high in zip(self.numeric, self.low, self.high):
+            value = row[col]
+            if not isinstance(value, Real):
+                return None
+            value = float(value)
+            if value != value:
+                failed[0, self._check_index[f'missing:{col}']] = True
+            elif not low <= value <= high:
+                failed[0, self._check_index[f'out_of_range:{col}']] = True
+            values.append(value)
+        if 'differential_sum' in self._check_index:
+            # NaN compares False, as in validate()
+            total = sum(values[j] for j in self.differential)
+            failed[0, self._check_index['differential_sum']] = abs(total - 100) > self.tolerance
+
+        features = chunk.reindex(columns=self.columns)
+        for col, _ in self.categorical:
+            if dtypes[col] != object or cleaned[col] is not row[col]:
+                features[col] = np.array([cleaned[col]], dtype=object)
+        for col, value in zip(self.numeric, values):
+            if dtypes[col] != np.float64:
+                features[col] = np.array([value])
+        return Validation(features, failed, self.checks)
+
+
+def quarantined(chunk, validation):
+    """The rows of chunk that failed validation, with a REASONS_COLUMN column."""
+    rejected = chunk[~validation.valid].copy()
+    rejected[REASONS_COLUMN] = validation.reasons()[~validation.valid]
+    return rejected
@@ -0,0 +1,212 @@
+"""Model loading and scoring helpers shared by the Streamlit app and the batch CLI.
+
+Nothing in here imports Streamlit, so it can be used from cron jobs and
+worker processes.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from malaria_artifacts import MODEL_PATH, load_pipeline
+from malaria_schema import FIELDS, SchemaValidator, quarantined
+
+# Input columns expected by the model, in the order the scan form builds them
+FEATURE_COLUMNS = [field.name for field in FIELDS]
+CATEGORICAL_COLUMNS = ['location', 'bednet', 'fever_symptom']
+NUMERIC_COLUMNS = [c for c in FEATURE_COLUMNS if c not in CATEGORICAL_COLUMNS]
+
+# Rows scored per model call in batch mode
+BATCH_CHUNK_SIZE = 5000
+
+# Class indices used by the model: class 0 is malaria, class 1 is no malaria
+MALARIA = 0
+NO_MALARIA = 1
+LABELS = {MALARIA: "Malaria", NO_MALARIA: "No Malaria"}
+
+# Column holding the confirmed (microscopy or RDT) outcome in labeled files
+LABEL_COLUMN = 'label'
+
+# A row is labelled malaria when its malaria probability is at least this.
+# 0.5 reproduces the classifier's own predict(); sites can tune it.
+DECISION_THRESHOLD = float(os.environ.get('MALARIA_DECISION_THRESHOLD', 0.5))
+
+# Valid ranges and options of the AI Scan form inputs, from the schema
+FORM_RANGES = {field.name: (field.low, field.high) for field in FIELDS if field.options is None}
+FORM_OPTIONS = {field.name: field.options for field in FIELDS if field.options is not None}
+
+VALIDATOR = SchemaValidator()
+
+
+def score(model, features, threshold=DECISION_THRESHOLD):
+    """Score rows with a single predict_proba call.
+
+    Returns (prediction, prediction_proba) in the same layout as the pipeline's
+    predict() and predict_proba(), with the class derived from the probabilities
+    using threshold on the malaria probability.
+    """
+    prediction_proba = model.predict_proba(features)
+    return labels_from_proba(prediction_proba, threshold), prediction_proba
+
+
+def labels_from_proba(prediction_proba, threshold=DECISION_THRESHOLD):
+    """Class labels for predict_proba rows at the given malaria threshold."""
+    # Compare the no-malaria column the way XGBClassifier.predict() does, so
+    # labels match predict() exactly at the default threshold
+    return np.where(prediction_proba[:, NO_MALARIA] > 1 - threshold, NO_MALARIA, MALARIA)
+
+
+def canonical_numeric(features, decimals=4):
+    """Numeric inputs as a float64 matrix rounded to decimals, with -0.0 folded into 0.0."""
+    return np.round(features[NUMERIC_COLUMNS].to_numpy(dtype=np.float64), decimals) + 0.0
+
+
+def unique_rows(features):
+    """Indices of the first occurrence of each distinct input row, and the
+    inverse mapping each row to its position among those.
+
+    features should already be cleaned by validate_batch_chunk.
+    """
+    numeric = canonical_numeric(features)
+    codes = np.column_stack([pd.factorize(features[col])[0] for col in CATEGORICAL_COLUMNS]).astype(np.float64)
+    rows = np.ascontiguousarray(np.hstack([numeric, codes]))
+    _, first, inverse = np.unique(rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel(),
+                                  return_index=True, return_inverse=True)
+    return first, inverse
+
+
+def random_inputs(n_rows, seed=0):
+    """Random scan inputs drawn uniformly from the form's ranges and options.
+
+    Neutrophils % is set to make up the rest of the differential, so the rows
+    pass validation.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for col in FEATURE_COLUMNS:
+        if col in FORM_OPTIONS:
+            data[col] = rng.choice(FORM_OPTIONS[col], n_rows)
+        else:
+            low, high = FORM_RANGES[col]
+            data[col] = rng.uniform(low, high, n_rows).round(1)
+    data['neutrophils_percent'] = (100 - data['lymphocytes_percent'] - data['mixed_cells_percent']).round(1)
+    return pd.DataFrame(data, columns=FEATURE_COLUMNS)
+
+
+def read_batch_chunks(source, chunk_size=BATCH_CHUNK_SIZE):
+    """Yield a CSV, Parquet or Excel file as DataFrames of at most chunk_size rows.
+
+    source can be a path or a file-like object with a name attribute, such as a
+    Streamlit upload. CSV and Parquet are streamed; Excel is read in one go.
+    """
+    name = str(getattr(source, 'name', source)).lower()
+    if name.endswith(('.xlsx', '.xls')):
+        frame = pd.read_excel(source)
+        for start in range(0, len(frame), chunk_size):
+            yield frame.iloc[start:start + chunk_size]
+    elif name.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size)
+
+
+def validate_batch_chunk(chunk):
+    """Check a chunk of uploaded rows against the input schema (see malaria_schema).
+
+    Returns the rows that passed, restricted to FEATURE_COLUMNS with numeric
+    columns coerced, and the rows that failed, as they were uploaded plus a
+    rejection_reasons column. Raises ValueError if any required column is
+    missing.
+    """
+    validation = VALIDATOR.validate(chunk)
+    return validation.features[validation.valid], quarantined(chunk, validation)
+
+
+def read_labels(values):
+    """Class indices of confirmed outcomes, -1 where there is none.
+
+    Outcomes are "Malaria" or "No Malaria" in any case, or the model's own
+    class indices: 0 for malaria and 1 for no malaria.
+    """
+    text = pd.Series(values).astype(str).str.strip().str.lower().to_numpy()
+    classes = np.full(len(text), -1, dtype=np.int64)
+    for index, name in LABELS.items():
+        classes[np.isin(text, [name.lower(), str(index), f"{index}.0"])] = index
+    return classes
+
+
+def read_labeled(source, label_column=LABEL_COLUMN, chunk_size=BATCH_CHUNK_SIZE):
+    """The valid, labeled rows of a file with the 21 inputs and a label column.
+
+    Returns (features, labels, skipped): the rows that passed validation and
+    have a readable label, their class indices, and how many rows were
+    skipped. Raises ValueError if a required column is missing.
+    """
+    features, labels, skipped = [], [], 0
+    for chunk in read_batch_chunks(source, chunk_size):
+        if label_column not in chunk.columns:
+            raise ValueError(f"Missing label column: {label_column}")
+        validation = VALIDATOR.validate(chunk)
+        classes = read_labels(chunk[label_column])
+        keep = validation.valid & (classes >= 0)
+        features.append(validation.features[keep])
+        labels.append(classes[keep])
+        skipped += int((~keep).sum())
+    if not features:
+        return pd.DataFrame(columns=FEATURE_COLUMNS), np.empty(0, dtype=np.int64), skipped
+    return pd.concat(features, ignore_index=True), np.concatenate(labels), skipped
+
+
+def batch_risk_levels(features):
+    """Health Dashboard risk level of each row, from the malaria_rules table."""
+    # malaria_rules imports this module, so it can't be imported at the top
+    from malaria_rules import assess
+    return assess(features).level
+
+
+def score_batch_chunk(model, chunk, threshold=DECISION_THRESHOLD, explain=None, model_version=None, decimals=4):
+    """Score one chunk of uploaded rows with a single predict_proba call.
+
+    explain names a malaria_explain method ('exact' or 'approx'); with it a
+    contribution_<field> column per input field and contribution_bias are
+    added, computed in one booster call. model_version, when given, is
+    recorded in a model_version column. malaria_probability is rounded to
+    decimals places for export; None keeps it unrounded.
+
+    Returns (scored, rejected): the rows that passed validate_batch_chunk, with
+    their inputs cleaned as it cleans them, and their results; and the
+    quarantined rows with their rejection reasons.
+    """
+    validation = VALIDATOR.validate(chunk)
+    features = validation.features[validation.valid]
+
+    # Repeated uploads often duplicate rows; score each distinct row once
+    first, inverse = unique_rows(features)
+    distinct = features.iloc[first] if len(first) < len(features) else features
+    _, prediction_proba = score(model, distinct, threshold)
+    if distinct is not features:
+        prediction_proba = prediction_proba[inverse]
+    prediction = labels_from_proba(prediction_proba, threshold)
+
+    scored = chunk[validation.valid].copy()
+    # Export the inputs as validated (categoricals stripped, numerics coerced), so
+    # the history, rollups and drift monitor see the values that were scored
+    for col in FEATURE_COLUMNS:
+        scored[col] = features[col].to_numpy()
+    scored['prediction'] = np.where(prediction == NO_MALARIA, LABELS[NO_MALARIA], LABELS[MALARIA])
+    probability = prediction_proba[:, MALARIA]
+    scored['malaria_probability'] = probability if decimals is None else probability.round(decimals)
+    scored['risk_level'] = batch_risk_levels(features)
+    if model_version is not None:
+        scored['model_version'] = model_version
+    if explain:
+        # malaria_explain imports this module, so it can't be imported at the top
+        from malaria_explain import CONTRIBUTION_COLUMNS, contributions
+        values = contributions(model, distinct, explain)
+        if distinct is not features:
+            values = values[inverse]
+        for i, col in enumerate(CONTRIBUTION_COLUMNS):
+            scored[f'contribution_{col}'] = values[:, i].round(4)
+    return scored, quarantined(chunk, validation)
@@ -0,0 +1,161 @@
+"""Compact per-session record of the last scan.
+
+The app used to keep the last scan in st.session_state as the one-row
+DataFrame it scored, plus the NumPy scalars and rows the model returned.
+Each of those carries a pandas index, block manager and array headers,
+several kilobytes per connected user for 21 numbers. ScanRecord keeps the
+same scan in a fixed layout instead:
+
+    numbers        the 18 numeric fields, packed as array('d') in
+                   NUMERIC_COLUMNS order
+    codes          one byte per categorical field: the index of its value
+                   among the field's form options
+    label          the predicted class (MALARIA or NO_MALARIA)
+    probability    the malaria probability
+    model_version  the version of the model that scored it (the string is
+                   shared with the deployment, not copied per session)
+
+The dashboard, recommendations and what-if pages read fields from it by
+name and rebuild the columns they need on demand.
+
+Measure the memory one session's scan state takes both ways:
+
+    python malaria_session.py --sessions 1000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+import warnings
+from array import array
+
+import numpy as np
+
+from malaria_scoring import CATEGORICAL_COLUMNS, FEATURE_COLUMNS, FORM_OPTIONS, MALARIA, NUMERIC_COLUMNS
+
+_NUMERIC_INDEX = {col: i for i, col in enumerate(NUMERIC_COLUMNS)}
+_CATEGORICAL_INDEX = {col: i for i, col in enumerate(CATEGORICAL_COLUMNS)}
+_OPTIONS = [FORM_OPTIONS[col] for col in CATEGORICAL_COLUMNS]
+
+
+class ScanRecord:
+    """One scored scan: its inputs, predicted class, malaria probability and model version."""
+
+    __slots__ = ('numbers', 'codes', 'label', 'probability', 'model_version')
+
+    def __init__(self, numbers, codes, label, probability, model_version=None):
+        self.numbers = numbers
+        self.codes = codes
+        self.label = label
+        self.probability = probability
+        self.model_version = model_version
+
+    @classmethod
+    def from_scan(cls, features, label, probability, model_version=None, row=0):
+        """The record of row of a scored features DataFrame, whose values come from the form."""
+        numbers = array('d', features[NUMERIC_COLUMNS].to_numpy(dtype=np.float64)[row].tolist())
+        codes = bytes(options.index(features[col].iat[row]) for col, options in zip(CATEGORICAL_COLUMNS, _OPTIONS))
+        return cls(numbers, codes, int(label), float(probability), model_version)
+
+    def __getitem__(self, col):
+        if col in _NUMERIC_INDEX:
+            return self.numbers[_NUMERIC_INDEX[col]]
+        i = _CATEGORICAL_INDEX[col]
+        return _OPTIONS[i][self.codes[i]]
+
+    def to_dict(self):
+        """Field name to value, in FEATURE_COLUMNS order."""
+        return {col: self[col] for col in FEATURE_COLUMNS}
+
+    def columns(self):
+        """The record as a dict of one-row columns, as malaria_rules.assess() takes it."""
+        return {col: [self[col]] for col in FEATURE_COLUMNS}
+
+
+def _traced_bytes(build):
+    """Bytes still allocated after build() returns, as traced by tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, kept
+
+
+def measure(model, n_sessions=1000, seed=0):
+    """Bytes per session of the last scan's state, as the app kept it before and as a ScanRecord.
+
+    Every session scores one random form input, exactly as the AI Scan page
+    does, and keeps its state in its own dict, as st.session_state would.
+    """
+    import pandas as pd
+
+    from malaria_explain import contributions
+    from malaria_scoring import random_inputs, score
+
+    rows = random_inputs(n_sessions, seed).to_dict(orient='records')
+    version = 'measure'
+    scored = []
+    for row in rows:
+        input_data = pd.DataFrame({col: [row[col]] for col in FEATURE_COLUMNS})
+        prediction, prediction_proba = score(model, input_data)
+        scored.append((input_data, prediction, prediction_proba, contributions(model, input_data)))
+
+    def before():
+        # Allocated here so all of it is traced; as in the app, the probability and contribution
+        # rows are views that keep their whole (1, n) arrays alive
+        sessions = []
+        for row, (_, prediction, prediction_proba, contribution) in zip(rows, scored):
+            sessions.append({
+                'last_prediction': prediction[0],
+                'last_prediction_proba': prediction_proba.copy()[0],
+                'last_input_data': pd.DataFrame({col: [row[col]] for col in FEATURE_COLUMNS}),
+                'last_contributions': contribution.copy()[0],
+                'last_model_version': version,
+            })
+        return sessions
+
+    def after():
+        return [{'last_scan': ScanRecord.from_scan(input_data, prediction[0], prediction_proba[0, MALARIA], version)}
+                for input_data, prediction, prediction_proba, _ in scored]
+
+    before_bytes, kept = _traced_bytes(before)
+    del kept
+    after_bytes, kept = _traced_bytes(after)
+    record = kept[0]['last_scan']
+    assert all(record[col] == rows[0][col] for col in FEATURE_COLUMNS)
+    return {
+        'sessions': n_sessions,
+        'before_bytes_per_session': before_bytes / n_sessions,
+        'after_bytes_per_session': after_bytes / n_sessions,
+        'before_total_mb': before_bytes / 2**20,
+        'after_total_mb': after_bytes / 2**20,
+    }
+
+
+def main(argv=None):
+    from malaria_scoring import MODEL_PATH, load_pipeline
+
+    parser = argparse.ArgumentParser(description="Measure per-session memory of the last scan's state.")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--model", default=os.environ.get('MALARIA_MODEL_PATH', MODEL_PATH))
+    parser.add_argument("--json", action='store_true', help="Print the measurements as JSON")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    results = measure(load_pipeline(args.model), args.sessions)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"{results['sessions']:,} sessions     per session      total")
+    print(f"DataFrame + NumPy  {results['before_bytes_per_session']:>8,.0f} B  {results['before_total_mb']:>7.2f} MB")
+    print(f"ScanRecord         {results['after_bytes_per_session']:>8,.0f} B  {results['after_total_mb']:>7.2f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
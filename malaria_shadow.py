@@ -0,0 +1,240 @@
+"""Champion/challenger shadow scoring.
+
+The production model (the champion) answers every request as usual.
+ShadowScorer.observe() then hands the same inputs and the champion's
+probabilities to a small background thread pool, where each challenger
+model scores them too. Per request and challenger, the row count, label
+disagreements, probability deltas and both latencies go to a SQLite log,
+and every row the two models label differently is kept with its inputs.
+
+Challengers never sit on the request path: observe() only queues work, and
+when the queue is full the request is skipped for shadowing (counted in
+malaria_shadow_dropped_total) rather than slowing anything down. Each
+challenger's booster runs single-threaded so it competes as little as
+possible with the champion for CPU.
+
+Challenger artifacts are listed in MALARIA_CHALLENGERS, separated by
+os.pathsep; the log lives at MALARIA_SHADOW_DB. Print the comparison so far:
+
+    python malaria_shadow.py
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import malaria_metrics as metrics
+from malaria_artifacts import load_pipeline, model_version
+from malaria_encoder import CompiledScorer, compile_scorer
+from malaria_scoring import DECISION_THRESHOLD, FEATURE_COLUMNS, MALARIA, NO_MALARIA, labels_from_proba, score
+
+CHALLENGERS = [path for path in os.environ.get('MALARIA_CHALLENGERS', '').split(os.pathsep) if path]
+SHADOW_DB = os.environ.get('MALARIA_SHADOW_DB', 'malaria_shadow.db')
+MAX_WORKERS = 2
+MAX_PENDING = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shadow_requests (
+    id INTEGER PRIMARY KEY,
+    scored_at REAL NOT NULL,
+    champion_version TEXT,
+    challenger TEXT NOT NULL,
+    challenger_version TEXT,
+    rows INTEGER NOT NULL,
+    disagreements INTEGER NOT NULL,
+    abs_delta_sum REAL NOT NULL,
+    max_abs_delta REAL NOT NULL,
+    champion_latency_s REAL,
+    challenger_latency_s REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shadow_disagreements (
+    request_id INTEGER NOT NULL REFERENCES shadow_requests (id),
+    champion_probability REAL NOT NULL,
+    challenger_probability REAL NOT NULL,
+    inputs TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shadow_requests_challenger_time ON shadow_requests (challenger, scored_at);
+"""
+
+
+class Challenger:
+    """A model artifact scored in the shadow of the champion."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.version = model_version(path)
+        self.model = compile_scorer(load_pipeline(path))
+        if isinstance(self.model, CompiledScorer):
+            self.model.booster.set_param({'nthread': 1})
+
+
+def load_challengers(paths=CHALLENGERS):
+    return [Challenger(path) for path in paths]
+
+
+class ShadowLog:
+    """SQLite store of shadow comparisons, safe to share between threads."""
+
+    def __init__(self, path=SHADOW_DB):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, champion_version, challenger, champion_latency, challenger_latency,
+               features, champion_proba, challenger_proba, threshold=DECISION_THRESHOLD):
+        """Log one request scored by one challenger; returns the number of disagreements."""
+        champion_label = labels_from_proba(champion_proba, threshold)
+        challenger_label = labels_from_proba(challenger_proba, threshold)
+        disagree = np.flatnonzero(champion_label != challenger_label)
+        delta = np.abs(challenger_proba[:, MALARIA] - champion_proba[:, MALARIA])
+
+        with self._lock, self._conn:
+            request_id = self._conn.execute(
+                "INSERT INTO shadow_requests (scored_at, champion_version, challenger, challenger_version, rows, "
+                "disagreements, abs_delta_sum, max_abs_delta, champion_latency_s, challenger_latency_s) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), champion_version, challenger.name, challenger.version, len(delta), len(disagree),
+                 float(delta.sum()), float(delta.max(initial=0.0)), champion_latency, challenger_latency),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO shadow_disagreements VALUES (?, ?, ?, ?)",
+                [
+                    (request_id, float(champion_proba[i, MALARIA]), float(challenger_proba[i, MALARIA]),
+                     features.iloc[i].to_json())
+                    for i in disagree
+                ],
+            )
+        return len(disagree)
+
+    def summary(self, since=None, latency_sample=10000):
+        """Per challenger: requests, rows, agreement rate, probability deltas and latency percentiles."""
+        where, params = ("WHERE scored_at >= ?", (since,)) if since is not None else ("", ())
+        with self._lock:
+            totals = self._conn.execute(
+                f"SELECT challenger, challenger_version, COUNT(*), SUM(rows), SUM(disagreements), "
+                f"SUM(abs_delta_sum), MAX(max_abs_delta) FROM shadow_requests {where} "
+                f"GROUP BY challenger, challenger_version ORDER BY challenger", params).fetchall()
+            latencies = {
+                (name, version): np.array(self._conn.execute(
+                    "SELECT champion_latency_s, challenger_latency_s FROM shadow_requests "
+                    "WHERE challenger = ? AND challenger_version = ? ORDER BY id DESC LIMIT ?",
+                    (name, version, latency_sample)).fetchall(), dtype=np.float64)
+                for name, version, *_ in totals
+            }
+
+        rows = []
+        for name, version, requests, n_rows, disagreements, delta_sum, max_delta in totals:
+            sample = latencies[(name, version)]
+            rows.append({
+                'challenger': name,
+                'version': version,
+                'requests': requests,
+                'rows': n_rows,
+                'agreement_rate': 1 - disagreements / n_rows if n_rows else None,
+                'mean_abs_delta': delta_sum / n_rows if n_rows else None,
+                'max_abs_delta': max_delta,
+                'champion_p50_ms': np.nanpercentile(sample[:, 0], 50) * 1000,
+                'challenger_p50_ms': np.percentile(sample[:, 1], 50) * 1000,
+                'challenger_p95_ms': np.percentile(sample[:, 1], 95) * 1000,
+            })
+        return pd.DataFrame(rows)
+
+    def disagreements(self, limit=100):
+        """The most recent rows the champion and a challenger labelled differently."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT r.scored_at, r.challenger, d.champion_probability, d.challenger_probability, d.inputs "
+                "FROM shadow_disagreements d JOIN shadow_requests r ON r.id = d.request_id "
+                "ORDER BY d.rowid DESC LIMIT ?", (limit,)).fetchall()
+        frame = pd.DataFrame(rows, columns=['scored_at', 'challenger', 'champion_probability',
+                                            'challenger_probability', 'inputs'])
+        frame['scored_at'] = pd.to_datetime(frame['scored_at'], unit='s')
+        frame['inputs'] = frame['inputs'].map(json.loads)
+        return frame
+
+
+class ShadowScorer:
+    """Score requests with every challenger in background threads and log the comparison."""
+
+    def __init__(self, challengers, log, champion_version=None, threshold=DECISION_THRESHOLD,
+                 max_workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self.challengers = challengers
+        self.log = log
+        self.champion_version = champion_version
+        self.threshold = threshold
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shadow')
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def observe(self, features, malaria_probability, champion_latency=None):
+        """Queue a champion-scored request for shadow scoring; never blocks.
+
+        features are the inputs the champion scored, already validated and
+        cleaned as score_batch_chunk() returns them (other columns are
+        ignored), and malaria_probability the champion's malaria
+        probabilities as returned to the caller. Returns False if the request
+        was dropped because the queue is full.
+        """
+        if not self.challengers:
+            return False
+        if not self._pending.acquire(blocking=False):
+            metrics.inc('shadow_dropped_total')
+            return False
+        malaria_probability = np.asarray(malaria_probability, dtype=np.float32)
+        champion_proba = np.empty((len(malaria_probability), 2), dtype=np.float32)
+        champion_proba[:, MALARIA] = malaria_probability
+        champion_proba[:, NO_MALARIA] = 1 - malaria_probability
+        future = self._pool.submit(self._run, features[FEATURE_COLUMNS], champion_proba, champion_latency)
+        future.add_done_callback(lambda _: self._pending.release())
+        return True
+
+    def _run(self, features, champion_proba, champion_latency):
+        for challenger in self.challengers:
+            try:
+                start = time.perf_counter()
+                _, challenger_proba = score(challenger.model, features, self.threshold)
+                latency = time.perf_counter() - start
+                metrics.observe(f'shadow_{challenger.name}', latency)
+                disagreements = self.log.record(
+                    self.champion_version, challenger, champion_latency, latency,
+                    features, champion_proba, challenger_proba, self.threshold)
+                metrics.inc('shadow_disagreements_total', disagreements)
+            except Exception:
+                metrics.inc('shadow_errors_total')
+
+    def close(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize champion/challenger shadow scoring.")
+    parser.add_argument("--db", default=SHADOW_DB, help="Shadow log database")
+    parser.add_argument("--disagreements", type=int, default=0, help="Also list this many recent disagreements")
+    args = parser.parse_args(argv)
+
+    log = ShadowLog(args.db)
+    summary = log.summary()
+    if summary.empty:
+        print("No shadow comparisons logged yet.")
+        return 0
+    print(summary.to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+    if args.disagreements:
+        print()
+        print(log.disagreements(args.disagreements).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
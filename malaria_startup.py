@@ -0,0 +1,92 @@
+"""Startup-time report for the Streamlit app.
+
+Imports malaria_app in a fresh interpreter under `python -X importtime` and
+breaks the import time down by the modules the app imports directly, then
+times a cold model load and the first prediction the same way the AI Scan
+page does. Use --json to save the numbers and track regressions.
+
+    python malaria_startup.py
+    python malaria_startup.py --json startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_MODEL_SNIPPET = """
+import time, warnings
+warnings.filterwarnings('ignore')
+start = time.perf_counter()
+from malaria_encoder import compile_scorer
+from malaria_scoring import load_pipeline, random_inputs, score
+imported = time.perf_counter()
+scorer = compile_scorer(load_pipeline())
+loaded = time.perf_counter()
+score(scorer, random_inputs(1))
+predicted = time.perf_counter()
+print(imported - start, loaded - imported, predicted - loaded)
+"""
+
+
+def import_breakdown(module='malaria_app'):
+    """Seconds spent importing module, and per directly imported module.
+
+    Returns (total_seconds, {module_name: cumulative_seconds}).
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=HERE,
+    )
+    total = 0.0
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if depth == 0 and name.strip() == module:
+            total = seconds
+        elif depth == 1:
+            # A module can appear more than once if its import is retried
+            children[name.strip()] = children.get(name.strip(), 0.0) + seconds
+    return total, children
+
+
+def model_startup():
+    """Seconds to import the scoring modules, load the model and run the first prediction."""
+    result = subprocess.run(
+        [sys.executable, '-c', _MODEL_SNIPPET], capture_output=True, text=True, check=True, cwd=HERE,
+    )
+    imports, load, first_prediction = map(float, result.stdout.split())
+    return {'model_imports': imports, 'model_load': load, 'first_prediction': first_prediction}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report where the app spends its startup time.")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--top", type=int, default=15, help="Number of imports to list")
+    args = parser.parse_args(argv)
+
+    total, children = import_breakdown()
+    model = model_startup()
+
+    print(f"import malaria_app: {total * 1000:.0f} ms")
+    for name, seconds in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<32} {seconds * 1000:>8.1f} ms")
+    print()
+    print(f"model imports (in background warm-up): {model['model_imports'] * 1000:.0f} ms")
+    print(f"model load:                            {model['model_load'] * 1000:.0f} ms")
+    print(f"first prediction:                      {model['first_prediction'] * 1000:.0f} ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'app_import': total, 'imports': children, **model}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Incremental rollups of the scan history for population-level surveillance.
+
+Two tables are kept next to `scans` in the history database and updated in
+the same transaction as every append:
+
+  daily_rollup      per day and per category of location, bednet and
+                    fever_symptom (plus an 'all' row per day): scans,
+                    malaria positives and the sum of malaria probabilities
+  histogram_rollup  per feature in HISTOGRAM_FEATURES and per predicted
+                    class: counts and value sums in fixed bins
+
+Reading them costs the same however many scans there are, so the
+Surveillance page never touches the raw scans. rebuild_rollups() recomputes
+both tables from `scans`, e.g. for a database written before rollups existed.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from malaria_scoring import FORM_RANGES, LABELS, MALARIA, NO_MALARIA
+
+DIMENSIONS = ['location', 'bednet', 'fever_symptom']
+HISTOGRAM_FEATURES = ['hb_level', 'platelet_count', 'temperature']
+HISTOGRAM_BINS = 30
+UNKNOWN = "Unknown"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    category TEXT NOT NULL,
+    scans INTEGER NOT NULL,
+    positives INTEGER NOT NULL,
+    probability_sum REAL NOT NULL,
+    PRIMARY KEY (day, dimension, category)
+);
+CREATE TABLE IF NOT EXISTS histogram_rollup (
+    feature TEXT NOT NULL,
+    prediction INTEGER NOT NULL,
+    bin INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    value_sum REAL NOT NULL,
+    PRIMARY KEY (feature, prediction, bin)
+);
+"""
+
+_UPSERT_DAILY = """
+INSERT INTO daily_rollup (day, dimension, category, scans, positives, probability_sum) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, dimension, category) DO UPDATE SET
+    scans = scans + excluded.scans,
+    positives = positives + excluded.positives,
+    probability_sum = probability_sum + excluded.probability_sum
+"""
+
+_UPSERT_HISTOGRAM = """
+INSERT INTO histogram_rollup (feature, prediction, bin, count, value_sum) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (feature, prediction, bin) DO UPDATE SET
+    count = count + excluded.count,
+    value_sum = value_sum + excluded.value_sum
+"""
+
+
+def bin_edges(feature):
+    """Histogram bin edges of feature, spanning the scan form's range."""
+    low, high = FORM_RANGES[feature]
+    return np.linspace(low, high, HISTOGRAM_BINS + 1)
+
+
+def day_of(timestamp):
+    """Local calendar day of a Unix timestamp, as YYYY-MM-DD."""
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+
+def update_rollups(conn, day, categories, malaria_probability, prediction, values):
+    """Add a set of scans to the rollups; run inside the transaction that stores them.
+
+    day is one day string or one per row; categories maps each of DIMENSIONS
+    to per-row values; values maps each of HISTOGRAM_FEATURES to per-row
+    numbers (NaN for missing).
+    """
+    positive = np.asarray(prediction) == MALARIA
+    frame = pd.DataFrame({
+        'day': day,
+        'positives': positive.astype(np.int64),
+        'probability_sum': np.asarray(malaria_probability, dtype=np.float64),
+    })
+    rows = []
+    for dimension in ['all', *DIMENSIONS]:
+        if dimension == 'all':
+            frame['category'] = 'all'
+        else:
+            category = pd.Series(categories[dimension], dtype=object).reset_index(drop=True)
+            frame['category'] = category.where(category.notna(), UNKNOWN).astype(str)
+        grouped = frame.groupby(['day', 'category'], sort=False).agg(
+            scans=('positives', 'size'), positives=('positives', 'sum'), probability_sum=('probability_sum', 'sum'))
+        rows.extend(
+            (day_, dimension, category, int(scans), int(positives), float(probability_sum))
+            for (day_, category), scans, positives, probability_sum in zip(
+                grouped.index, grouped['scans'], grouped['positives'], grouped['probability_sum'])
+        )
+    conn.executemany(_UPSERT_DAILY, rows)
+
+    rows = []
+    for feature in HISTOGRAM_FEATURES:
+        column = pd.to_numeric(pd.Series(values[feature]), errors='coerce').to_numpy(dtype=np.float64)
+        present = ~np.isnan(column)
+        # Values outside the form's range land in the first or last bin
+        bins = np.clip(np.searchsorted(bin_edges(feature), column, side='right') - 1, 0, HISTOGRAM_BINS - 1)
+        for cls in (MALARIA, NO_MALARIA):
+            mask = present & (positive == (cls == MALARIA))
+            counts = np.bincount(bins[mask], minlength=HISTOGRAM_BINS)
+            sums = np.bincount(bins[mask], weights=column[mask], minlength=HISTOGRAM_BINS)
+            rows.extend(
+                (feature, cls, int(b), int(counts[b]), float(sums[b])) for b in np.flatnonzero(counts)
+            )
+    conn.executemany(_UPSERT_HISTOGRAM, rows)
+
+
+def rebuild_rollups(history, chunk_size=100000):
+    """Recompute both rollup tables from the scans table of a ScanHistory."""
+    columns = ['scanned_at', *DIMENSIONS, *HISTOGRAM_FEATURES, 'malaria_probability', 'prediction']
+    with history.transaction() as conn:
+        conn.execute("DELETE FROM daily_rollup")
+        conn.execute("DELETE FROM histogram_rollup")
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, {', '.join(columns)} FROM scans WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            chunk = pd.DataFrame(rows, columns=['id', *columns])
+            days = [day_of(t) for t in chunk['scanned_at']]
+            update_rollups(conn, days, chunk, chunk['malaria_probability'], chunk['prediction'], chunk)
+
+
+class Surveillance:
+    """Read side of the rollups."""
+
+    def __init__(self, history):
+        self.history = history
+
+    def daily(self, since=None):
+        """Per-day, per-category rows (day, dimension, category, scans, positives, probability_sum)."""
+        query = "SELECT day, dimension, category, scans, positives, probability_sum FROM daily_rollup"
+        params = ()
+        if since is not None:
+            query += " WHERE day >= ?"
+            params = (since,)
+        frame = self.history.query(query + " ORDER BY day", params)
+        return pd.DataFrame(frame, columns=['day', 'dimension', 'category', 'scans', 'positives', 'probability_sum'])
+
+    def positivity_over_time(self, since=None):
+        """Scans, positives and positivity rate per day."""
+        daily = self.daily(since)
+        totals = daily[daily['dimension'] == 'all'].set_index('day')[['scans', 'positives']]
+        totals['positivity'] = totals['positives'] / totals['scans']
+        return totals
+
+    def positivity_by(self, dimension, since=None):
+        """Scans, positives and positivity rate per category of dimension."""
+        daily = self.daily(since)
+        totals = daily[daily['dimension'] == dimension].groupby('category')[['scans', 'positives']].sum()
+        totals['positivity'] = totals['positives'] / totals['scans']
+        return totals
+
+    def distribution(self, feature):
+        """Per-bin counts of feature for positives and negatives, plus the bin centres and means.
+
+        Returns (DataFrame indexed by bin centre with one count column per
+        label in LABELS, {label: mean value}).
+        """
+        rows = self.history.query(
+            "SELECT prediction, bin, count, value_sum FROM histogram_rollup WHERE feature = ?", (feature,))
+        edges = bin_edges(feature)
+        centres = np.round((edges[:-1] + edges[1:]) / 2, 2)
+        counts = {label: np.zeros(HISTOGRAM_BINS, dtype=np.int64) for label in LABELS.values()}
+        sums = {label: 0.0 for label in LABELS.values()}
+        for prediction, b, count, value_sum in rows:
+            counts[LABELS[prediction]][b] += count
+            sums[LABELS[prediction]] += value_sum
+        means = {label: sums[label] / counts[label].sum() if counts[label].sum() else None for label in counts}
+        return pd.DataFrame(counts, index=centres), means
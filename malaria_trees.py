@@ -0,0 +1,114 @@
+"""Pure-NumPy evaluator for the model's tree ensemble.
+
+FlatTreeEnsemble dumps every tree of a binary:logistic XGBoost booster into
+flat, contiguous arrays (split feature, threshold, children, leaf value,
+default direction), with all trees sharing one node index space. Prediction
+walks all rows through all trees one level at a time with vectorized
+gathers, so there is no per-row Python loop and no XGBoost call at all.
+
+Splits follow XGBoost's rules: a row goes left when its float32 feature
+value is below the float32 threshold, and missing (NaN) values follow the
+node's default direction. XGBoost allocates a node's children as a pair, so
+the right child is always left + 1 and one gather per level finds the next
+node.
+"""
+import json
+
+import numpy as np
+
+# Rows evaluated together; bounds the (rows x trees) node-index matrix
+BLOCK_ROWS = 4096
+
+
+class FlatTreeEnsemble:
+    def __init__(self, feature, threshold, left, default_left, value, roots, max_depth, base_margin):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.base_margin = base_margin
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Flatten a booster's trees. Raises ValueError for unsupported models."""
+        learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+        if learner['objective']['name'] != 'binary:logistic':
+            raise ValueError(f"Unsupported objective: {learner['objective']['name']}")
+        gradient_booster = learner['gradient_booster']
+        if gradient_booster['name'] != 'gbtree':
+            raise ValueError(f"Unsupported booster: {gradient_booster['name']}")
+
+        base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+        base_margin = float(np.log(base_score / (1 - base_score)))
+
+        features, thresholds, lefts, defaults, values, roots = [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for tree in gradient_booster['model']['trees']:
+            if any(tree['split_type']):
+                raise ValueError("Categorical splits are not supported")
+            left = np.asarray(tree['left_children'], dtype=np.int64)
+            right = np.asarray(tree['right_children'], dtype=np.int64)
+            n_nodes = len(left)
+            node_ids = np.arange(n_nodes)
+            is_leaf = left == -1
+            if np.any(right[~is_leaf] != left[~is_leaf] + 1):
+                raise ValueError("Tree children are not stored in pairs")
+
+            # Leaves point back at themselves and always "go left", so extra
+            # levels below a shallow leaf are no-ops
+            left = np.where(is_leaf, node_ids, left) + offset
+            feature = np.where(is_leaf, 0, tree['split_indices'])
+            split_conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+
+            features.append(feature)
+            thresholds.append(np.where(is_leaf, np.inf, split_conditions))
+            lefts.append(left)
+            defaults.append(np.asarray(tree['default_left'], dtype=bool) | is_leaf)
+            # XGBoost stores a leaf's value in its split condition slot
+            values.append(np.where(is_leaf, split_conditions, 0).astype(np.float64))
+            roots.append(offset)
+
+            depth = np.zeros(n_nodes, dtype=np.int64)
+            for nid in range(1, n_nodes):
+                parent = tree['parents'][nid]
+                if parent < n_nodes:
+                    depth[nid] = depth[parent] + 1
+            max_depth = max(max_depth, int(depth.max()))
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float32),
+            left=np.concatenate(lefts).astype(np.intp),
+            default_left=np.concatenate(defaults),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            base_margin=base_margin,
+        )
+
+    def predict_margin(self, X, block_rows=BLOCK_ROWS):
+        """Raw ensemble output (log-odds of class 1) for each row of X."""
+        X = np.asarray(X, dtype=np.float32)
+        margin = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), block_rows):
+            block = X[start:start + block_rows]
+            has_missing = np.isnan(block).any()
+            node = np.repeat(self.roots[np.newaxis, :], len(block), axis=0)
+            for _ in range(self.max_depth):
+                x = np.take_along_axis(block, self.feature[node], axis=1)
+                go_left = x < self.threshold[node]
+                if has_missing:
+                    go_left |= np.isnan(x) & self.default_left[node]
+                node = self.left[node] + ~go_left
+            margin[start:start + block_rows] = self.value[node].sum(axis=1) + self.base_margin
+        return margin
+
+    def predict(self, X, block_rows=BLOCK_ROWS):
+        """Probability of class 1 for each row of X, as float32 like XGBoost."""
+        margin = self.predict_margin(X, block_rows)
+        return (1 / (1 + np.exp(-margin))).astype(np.float32)